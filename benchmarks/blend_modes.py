@@ -0,0 +1,68 @@
+"""Time the non-separable blend modes against the colorsys loop they replaced.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/blend_modes.py [--size 256] [--repeat 5]
+"""
+
+import argparse
+import colorsys
+import time
+
+import numpy as np
+from PIL import Image
+
+from pyshop.core import blend_layers
+
+HSL_MODES = ("Hue", "Saturation", "Color", "Luminosity")
+
+
+def hls_round_trip_blend(base, top, mode):
+    """The per-pixel colorsys blend used before the W3C SetLum/SetSat formulas."""
+    output = []
+    for base_rgb, top_rgb in zip(base.reshape(-1, 3), top.reshape(-1, 3)):
+        base_h, base_l, base_s = colorsys.rgb_to_hls(*base_rgb)
+        top_h, top_l, top_s = colorsys.rgb_to_hls(*top_rgb)
+        if mode == "Hue":
+            output.append(colorsys.hls_to_rgb(top_h, base_l, base_s))
+        elif mode == "Saturation":
+            output.append(colorsys.hls_to_rgb(base_h, base_l, top_s))
+        elif mode == "Color":
+            output.append(colorsys.hls_to_rgb(top_h, base_l, top_s))
+        else:
+            output.append(colorsys.hls_to_rgb(base_h, top_l, base_s))
+    return np.array(output, dtype=np.float32).reshape(base.shape)
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=256, help="tile edge in pixels")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per mode; the best is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    base = Image.fromarray(rng.integers(0, 256, (args.size, args.size, 4), dtype=np.uint8), "RGBA")
+    top = Image.fromarray(rng.integers(0, 256, (args.size, args.size, 4), dtype=np.uint8), "RGBA")
+    base_rgb = np.asarray(base.convert("RGB"), dtype=np.float32) / 255.0
+    top_rgb = np.asarray(top.convert("RGB"), dtype=np.float32) / 255.0
+
+    print(f"{args.size}x{args.size} tile, colorsys loop run once, blend_layers best of {args.repeat}")
+    print(f"{'mode':<12}{'colorsys':>12}{'blend_layers':>14}{'speedup':>10}")
+    for mode in HSL_MODES:
+        old = best_of(1, lambda: hls_round_trip_blend(base_rgb, top_rgb, mode))
+        new = best_of(args.repeat, lambda: blend_layers(base, top, mode))
+        print(f"{mode:<12}{old * 1000:>10.1f}ms{new * 1000:>12.1f}ms{old / new:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
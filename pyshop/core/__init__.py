@@ -1,9 +1,21 @@
 """Core document, layer, selection, history, and rendering models."""
 
-from .adjustments import apply_adjustment
+from .adjustments import (
+    LUT_ADJUSTMENTS,
+    adjustment_label,
+    adjustment_lut,
+    apply_adjustment,
+    apply_lut,
+    auto_contrast_levels,
+    compile_adjustment_luts,
+    format_curve_points,
+    parse_curve_points,
+)
 from .blend import blend_layers
 from .brush import (
     BrushSettings,
+    BrushStroke,
+    brush_tip,
     erase_brush_dab,
     erase_brush_line,
     erase_brush_stroke,
@@ -15,7 +27,23 @@ from .brush import (
 )
 from .channels import apply_channel_visibility
 from .color import named_background_rgba, qcolor_to_rgba
-from .compositor import TiledCompositeCache, composite_layers, composite_layers_tile, render_layer_tile
+from .compositor import (
+    MAX_RENDER_WORKERS,
+    SAMPLE_SIZES,
+    TiledCompositeCache,
+    composite_layers,
+    composite_layers_tile,
+    default_render_workers,
+    layer_content_bounds,
+    layer_signature,
+    render_executor,
+    render_layer_tile,
+    render_tiles,
+    render_workers,
+    sample_composite,
+    set_render_workers,
+    top_level_span,
+)
 from .document import (
     Document,
     ImageOpenError,
@@ -37,8 +65,16 @@ from .export import (
     load_exportable_image,
     preset_by_name,
 )
-from .history import DiffHistoryCommand, HistoryCommand, HistoryManager, PairedSnapshotCommand
-from .layer import Layer, clone_layer_state
+from .fill import SampleCache, color_match_mask, contiguous_region, flood_fill, matching_region
+from .history import (
+    DEFAULT_HISTORY_MEMORY_BUDGET,
+    DiffHistoryCommand,
+    HistoryCommand,
+    HistoryManager,
+    LayerEditCommand,
+    PairedSnapshotCommand,
+)
+from .layer import METADATA_FIELDS, Layer, clone_layer_state, next_revision
 from .macros import (
     ALLOWED_MACRO_COMMANDS,
     MACRO_FILE_SUFFIX,
@@ -49,9 +85,11 @@ from .macros import (
     save_macro_file,
 )
 from .ora import ORA_FILE_SUFFIX, ORAFormatError, ORAImportResult, is_ora_path, load_ora, save_ora
+from .patchstore import StoredImage
 from .path import selection_mask_bounds
 from .project import (
     PROJECT_FILE_SUFFIX,
+    EncodedLayerCache,
     ProjectFormatError,
     ProjectState,
     is_project_path,
@@ -60,16 +98,35 @@ from .project import (
 )
 from .psd import PSDExportError, PSDImportError, load_psd_layers, save_flattened_psd, save_layered_psd
 from .raw import RAW_EXTENSIONS, RAWImportError, is_raw_path, load_raw_image
-from .retouch import apply_retouch_dab
+from .retouch import RETOUCH_MODES, apply_retouch_dab, apply_retouch_stroke
 from .safeio import save_image_atomic
-from .selection import build_marching_ants_path
-from .tiles import DEFAULT_TILE_SIZE, TileBox, iter_intersecting_tile_boxes, iter_tile_boxes
+from .selection import (
+    Selection,
+    apply_in_selection,
+    build_marching_ants_path,
+    simplify_contours,
+    trace_selection_contours,
+    update_contour_tiles,
+)
+from .tiles import (
+    DEFAULT_TILE_SIZE,
+    MAX_TILE_LEVEL,
+    TileBox,
+    bounds_intersect,
+    clip_bounds,
+    intersect_bounds,
+    iter_intersecting_tile_boxes,
+    iter_tile_boxes,
+    union_bounds,
+)
 from .text import render_text_tile
+from .tilestore import PixelTiles
 from .vector import render_vector_shape_tile
 
 __all__ = [
     "DEFAULT_TILE_SIZE",
     "DEFAULT_EXPORT_PRESETS",
+    "DEFAULT_HISTORY_MEMORY_BUDGET",
     "DiffHistoryCommand",
     "Document",
     "ALLOWED_MACRO_COMMANDS",
@@ -77,36 +134,62 @@ __all__ = [
     "HistoryManager",
     "HistoryCommand",
     "ImageOpenError",
+    "LUT_ADJUSTMENTS",
     "MACRO_FILE_SUFFIX",
     "MAX_DOCUMENT_PIXELS",
+    "MAX_RENDER_WORKERS",
+    "MAX_TILE_LEVEL",
+    "METADATA_FIELDS",
     "MacroFormatError",
     "ORA_FILE_SUFFIX",
     "ORAFormatError",
     "ORAImportResult",
+    "EncodedLayerCache",
     "PairedSnapshotCommand",
+    "PixelTiles",
     "PSDExportError",
     "PSDImportError",
     "PROJECT_FILE_SUFFIX",
     "RAW_EXTENSIONS",
     "RAWImportError",
+    "RETOUCH_MODES",
+    "SAMPLE_SIZES",
+    "SampleCache",
+    "Selection",
     "BrushSettings",
+    "BrushStroke",
     "ProjectFormatError",
     "ProjectState",
+    "StoredImage",
     "TileBox",
     "TiledCompositeCache",
     "Layer",
+    "LayerEditCommand",
     "app_data_dir",
+    "adjustment_label",
+    "adjustment_lut",
     "apply_adjustment",
     "apply_effect",
     "apply_channel_visibility",
+    "apply_in_selection",
+    "apply_lut",
+    "auto_contrast_levels",
     "apply_retouch_dab",
+    "apply_retouch_stroke",
     "batch_export_images",
     "blend_layers",
+    "bounds_intersect",
+    "brush_tip",
     "build_marching_ants_path",
+    "clip_bounds",
     "clone_layer_state",
+    "color_match_mask",
+    "compile_adjustment_luts",
     "composite_layers",
     "composite_layers_tile",
+    "contiguous_region",
     "create_document_layers",
+    "default_render_workers",
     "clear_recovery_project",
     "default_channel_visibility",
     "effect_label",
@@ -116,13 +199,18 @@ __all__ = [
     "export_image_with_preset",
     "export_path_for_preset",
     "flattened_document_layers",
+    "flood_fill",
+    "format_curve_points",
     "image_document_layers",
     "iter_brush_dabs",
+    "intersect_bounds",
     "iter_intersecting_tile_boxes",
     "iter_tile_boxes",
     "is_project_path",
     "is_ora_path",
     "is_raw_path",
+    "layer_content_bounds",
+    "layer_signature",
     "load_exportable_image",
     "load_psd_layers",
     "load_macro_file",
@@ -131,14 +219,20 @@ __all__ = [
     "load_raw_image",
     "macro_steps_from_records",
     "macro_steps_to_records",
+    "matching_region",
     "named_background_rgba",
+    "next_revision",
     "open_raster_image",
+    "parse_curve_points",
     "paint_brush_dab",
     "paint_brush_line",
     "paint_brush_stroke",
     "qcolor_to_rgba",
     "preset_by_name",
+    "render_executor",
     "render_layer_tile",
+    "render_tiles",
+    "render_workers",
     "recovery_project_path",
     "render_text_tile",
     "render_vector_shape_tile",
@@ -147,8 +241,15 @@ __all__ = [
     "save_layered_psd",
     "save_macro_file",
     "save_ora",
+    "sample_composite",
     "save_project",
+    "set_render_workers",
     "selection_mask_bounds",
+    "simplify_contours",
     "smoothed_brush_point",
+    "top_level_span",
+    "trace_selection_contours",
+    "union_bounds",
+    "update_contour_tiles",
     "write_error_log",
 ]
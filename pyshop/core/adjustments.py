@@ -1,17 +1,157 @@
-from PIL import Image, ImageChops, ImageEnhance
+import numpy as np
+from PIL import Image, ImageEnhance, ImageStat
 
 
-def apply_adjustment(image: Image.Image, adjustment: dict) -> Image.Image:
+LUT_ADJUSTMENTS = ("brightness_contrast", "levels", "curves", "color_balance", "invert", "posterize", "solarize")
+CHANNELS = ("red", "green", "blue")
+_VALUES = np.arange(256, dtype=np.float64)
+_IDENTITY = np.tile(np.arange(256, dtype=np.uint8), (3, 1))
+
+
+def _blend_lut(degenerate: float, factor: float):
+    """Match ``Image.blend`` against a flat ``degenerate`` value, which truncates after clipping."""
+    values = np.float32(degenerate) + np.float32(factor) * (_VALUES.astype(np.float32) - np.float32(degenerate))
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def _mean_luma(image: Image.Image) -> int:
+    return int(ImageStat.Stat(image.convert("L")).mean[0] + 0.5)
+
+
+def _levels_lut(black: int, white: int, gamma: float, output_black: int = 0, output_white: int = 255):
+    ratio = np.clip((_VALUES - black) / max(1, white - black), 0.0, 1.0)
+    values = output_black + (output_white - output_black) * ratio ** (1.0 / max(0.01, gamma))
+    return values.astype(np.uint8)
+
+
+def _levels_settings_lut(settings: dict):
+    return _levels_lut(
+        settings.get("black", 0),
+        settings.get("white", 255),
+        settings.get("gamma", 1.0),
+        settings.get("output_black", 0),
+        settings.get("output_white", 255),
+    )
+
+
+def _curve_lut(points):
+    points = sorted((int(x), int(y)) for x, y in points or ())
+    if not points:
+        return np.arange(256, dtype=np.uint8)
+    xs, ys = zip(*points)
+    return np.clip(np.interp(_VALUES, xs, ys) + 0.5, 0, 255).astype(np.uint8)
+
+
+def parse_curve_points(text: str):
+    """Parse ``"x,y x,y ..."`` curve points, each coordinate 0-255."""
+    points = []
+    for pair in text.replace(";", " ").split():
+        x, y = (int(value) for value in pair.split(","))
+        if not (0 <= x <= 255 and 0 <= y <= 255):
+            raise ValueError(f"Curve point out of range: {pair}")
+        points.append([x, y])
+    if len(points) < 2:
+        raise ValueError("Curves need at least two points")
+    return sorted(points)
+
+
+def format_curve_points(points) -> str:
+    return " ".join(f"{x},{y}" for x, y in points or ())
+
+
+def auto_contrast_levels(image: Image.Image) -> dict:
+    """Return a Levels adjustment that stretches each RGB channel of ``image`` to the full range."""
+    histogram = image.convert("RGB").histogram()
+    adjustment = {"type": "levels"}
+    for index, channel in enumerate(CHANNELS):
+        used = np.flatnonzero(histogram[index * 256:(index + 1) * 256])
+        if len(used) and used[-1] > used[0]:
+            adjustment[channel] = {"black": int(used[0]), "white": int(used[-1])}
+    return adjustment
+
+
+def adjustment_label(adjustment: dict) -> str:
+    labels = {
+        "brightness_contrast": "Brightness/Contrast",
+        "hue_saturation": "Hue/Saturation",
+        "levels": "Levels",
+        "curves": "Curves",
+        "color_balance": "Color Balance",
+        "invert": "Invert",
+        "grayscale": "Grayscale",
+        "posterize": "Posterize",
+        "solarize": "Solarize",
+    }
+    return labels.get(adjustment.get("type"), "Adjustment")
+
+
+def adjustment_needs_image(adjustment: dict) -> bool:
+    """Return True when an adjustment's table depends on statistics of the whole input image."""
+    kind = adjustment.get("type")
+    return kind == "brightness_contrast" and bool(adjustment.get("contrast"))
+
+
+def adjustment_lut(adjustment: dict, image: Image.Image | None = None):
+    """Compile a per-channel adjustment into a (3, 256) uint8 table, or return None if it is not one.
+
+    ``image`` is the input the table will be applied to; it is only read for
+    adjustments where ``adjustment_needs_image`` is True.
+    """
     kind = adjustment.get("type")
     if kind == "brightness_contrast":
-        result = image
+        lut = np.arange(256, dtype=np.uint8)
         brightness = adjustment.get("brightness", 0)
         contrast = adjustment.get("contrast", 0)
         if brightness:
-            result = ImageEnhance.Brightness(result).enhance(1 + brightness / 100)
+            lut = _blend_lut(0, 1 + brightness / 100)
         if contrast:
-            result = ImageEnhance.Contrast(result).enhance(1 + contrast / 100)
-        return result.convert("RGBA")
+            if image is None:
+                raise ValueError("Contrast adjustments need the input image")
+            mean = _mean_luma(apply_lut(image, np.tile(lut, (3, 1))) if brightness else image)
+            lut = _blend_lut(mean, 1 + contrast / 100)[lut]
+        return np.tile(lut, (3, 1))
+    if kind == "levels":
+        master = _levels_settings_lut(adjustment)
+        return np.stack([_levels_settings_lut(adjustment.get(channel) or {})[master] for channel in CHANNELS])
+    if kind == "curves":
+        master = _curve_lut(adjustment.get("points"))
+        return np.stack([_curve_lut(adjustment.get(channel))[master] for channel in CHANNELS])
+    if kind == "color_balance":
+        return np.stack([np.clip(_VALUES + adjustment.get(channel, 0), 0, 255).astype(np.uint8) for channel in CHANNELS])
+    if kind == "invert":
+        return 255 - _IDENTITY
+    if kind == "posterize":
+        bits = max(1, min(8, int(adjustment.get("bits", 4))))
+        return _IDENTITY & np.uint8(~(2 ** (8 - bits) - 1) & 0xFF)
+    if kind == "solarize":
+        threshold = int(adjustment.get("threshold", 128))
+        return np.where(_IDENTITY < threshold, _IDENTITY, 255 - _IDENTITY).astype(np.uint8)
+    return None
+
+
+def compile_adjustment_luts(adjustments, image: Image.Image | None = None):
+    """Fold a chain of per-channel adjustments into one (3, 256) table, or None if any link is not per-channel."""
+    lut = _IDENTITY
+    for adjustment in adjustments:
+        if adjustment_needs_image(adjustment):
+            step = adjustment_lut(adjustment, apply_lut(image, lut) if image is not None else None)
+        else:
+            step = adjustment_lut(adjustment)
+        if step is None:
+            return None
+        lut = np.take_along_axis(step, lut.astype(np.intp), axis=1)
+    return lut
+
+
+def apply_lut(image: Image.Image, lut) -> Image.Image:
+    """Map the RGB bands of an RGBA image through a (3, 256) table in one pass, keeping alpha."""
+    return image.convert("RGBA").point(np.concatenate([np.asarray(lut, dtype=np.uint8).ravel(), _IDENTITY[0]]).tolist())
+
+
+def apply_adjustment(image: Image.Image, adjustment: dict) -> Image.Image:
+    kind = adjustment.get("type")
+    if kind in LUT_ADJUSTMENTS:
+        return apply_lut(image, adjustment_lut(adjustment, image))
     if kind == "hue_saturation":
         hue = adjustment.get("hue", 0)
         saturation = adjustment.get("saturation", 0)
@@ -28,9 +168,6 @@ def apply_adjustment(image: Image.Image, adjustment: dict) -> Image.Image:
             rgb = Image.merge("HSV", (hue_channel, sat_channel, value_channel)).convert("RGB")
         red, green, blue = rgb.split()
         return Image.merge("RGBA", (red, green, blue, alpha))
-    if kind == "invert":
-        red, green, blue, alpha = image.split()
-        return Image.merge("RGBA", (ImageChops.invert(red), ImageChops.invert(green), ImageChops.invert(blue), alpha))
     if kind == "grayscale":
         red, green, blue, alpha = image.split()
         gray = Image.merge("RGB", (red, green, blue)).convert("L").convert("RGB")
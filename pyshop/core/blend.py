@@ -1,15 +1,43 @@
-import colorsys
-
 import numpy as np
 from PIL import Image
 
 
-def _rgb_float(image: Image.Image):
-    return np.array(image.convert("RGB"), dtype=np.float32) / 255.0
+def premultiplied_from_image(image: Image.Image):
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    pixels = np.asarray(image).transpose(2, 0, 1).astype(np.float32, order="C")
+    pixels *= 1.0 / 255.0
+    pixels[:3] *= pixels[3]
+    return pixels
+
+
+def _unpremultiply(pixels):
+    alpha = pixels[3]
+    scale = np.divide(1.0, alpha, out=np.zeros_like(alpha), where=alpha > 0)
+    rgb = pixels[:3] * scale
+    return np.minimum(rgb, 1.0, out=rgb)
+
 
+def image_from_premultiplied(pixels) -> Image.Image:
+    output = np.empty(pixels.shape[1:] + (4,), dtype=np.uint8)
+    rgb = _unpremultiply(pixels)
+    rgb *= 255.0
+    rgb += 0.5
+    output[..., :3] = rgb.transpose(1, 2, 0)
+    output[..., 3] = np.clip(pixels[3], 0.0, 1.0) * 255.0 + 0.5
+    return Image.fromarray(output, "RGBA")
 
-def _image_from_float(pixels):
-    return Image.fromarray((np.clip(pixels, 0.0, 1.0) * 255).astype(np.uint8), "RGB")
+
+def paint_over(base, paint, alpha):
+    """Composite straight ``paint`` (0-255 RGB) with ``alpha`` coverage over interleaved 8-bit RGBA ``base``."""
+    base = base.astype(np.float32) * (1.0 / 255.0)
+    under = base[..., 3] * (1.0 - alpha)
+    out_alpha = alpha + under
+    scale = np.divide(1.0, out_alpha, out=np.zeros_like(out_alpha), where=out_alpha > 0)
+    output = np.empty(base.shape, dtype=np.uint8)
+    output[..., :3] = np.clip(paint * (alpha * scale)[..., None] + base[..., :3] * 255.0 * (under * scale)[..., None] + 0.5, 0, 255)
+    output[..., 3] = out_alpha * 255.0 + 0.5
+    return output
 
 
 def _color_dodge(base, top):
@@ -29,25 +57,52 @@ def _soft_light(base, top):
 
 
 def _luminance(pixels):
-    return pixels[..., 0] * 0.299 + pixels[..., 1] * 0.587 + pixels[..., 2] * 0.114
+    return pixels[0] * 0.299 + pixels[1] * 0.587 + pixels[2] * 0.114
+
+
+def _lum(pixels):
+    return pixels[0] * 0.3 + pixels[1] * 0.59 + pixels[2] * 0.11
+
+
+def _channel_min(pixels):
+    return np.minimum(np.minimum(pixels[0], pixels[1]), pixels[2])
+
+
+def _channel_max(pixels):
+    return np.maximum(np.maximum(pixels[0], pixels[1]), pixels[2])
+
+
+def _clip_color(pixels):
+    lum = _lum(pixels)[None]
+    low = _channel_min(pixels)[None]
+    high = _channel_max(pixels)[None]
+    pixels = np.where(low < 0.0, lum + (pixels - lum) * lum / np.maximum(lum - low, 1e-6), pixels)
+    return np.where(high > 1.0, lum + (pixels - lum) * (1.0 - lum) / np.maximum(high - lum, 1e-6), pixels)
+
+
+def _set_lum(pixels, lum):
+    return _clip_color(pixels + (lum - _lum(pixels))[None])
+
+
+def _sat(pixels):
+    return _channel_max(pixels) - _channel_min(pixels)
+
+
+def _set_sat(pixels, saturation):
+    low = _channel_min(pixels)[None]
+    spread = _channel_max(pixels)[None] - low
+    scale = np.divide(saturation[None], spread, out=np.zeros_like(spread), where=spread > 0)
+    return (pixels - low) * scale
 
 
 def _hsl_blend(base, top, mode):
-    base_flat = base.reshape(-1, 3)
-    top_flat = top.reshape(-1, 3)
-    output = []
-    for base_rgb, top_rgb in zip(base_flat, top_flat):
-        base_h, base_l, base_s = colorsys.rgb_to_hls(*base_rgb)
-        top_h, top_l, top_s = colorsys.rgb_to_hls(*top_rgb)
-        if mode == "Hue":
-            output.append(colorsys.hls_to_rgb(top_h, base_l, base_s))
-        elif mode == "Saturation":
-            output.append(colorsys.hls_to_rgb(base_h, base_l, top_s))
-        elif mode == "Color":
-            output.append(colorsys.hls_to_rgb(top_h, base_l, top_s))
-        else:
-            output.append(colorsys.hls_to_rgb(base_h, top_l, base_s))
-    return np.array(output, dtype=np.float32).reshape(base.shape)
+    if mode == "Hue":
+        return _set_lum(_set_sat(top, _sat(base)), _lum(base))
+    if mode == "Saturation":
+        return _set_lum(_set_sat(base, _sat(top)), _lum(base))
+    if mode == "Color":
+        return _set_lum(top, _lum(base))
+    return _set_lum(base, _lum(top))
 
 
 def _blend_pixels(base, top, mode: str):
@@ -74,9 +129,9 @@ def _blend_pixels(base, top, mode: str):
     if mode == "Lighten":
         return np.maximum(base, top)
     if mode == "Darker Color":
-        return np.where(_luminance(base)[..., None] <= _luminance(top)[..., None], base, top)
+        return np.where(_luminance(base)[None] <= _luminance(top)[None], base, top)
     if mode == "Lighter Color":
-        return np.where(_luminance(base)[..., None] >= _luminance(top)[..., None], base, top)
+        return np.where(_luminance(base)[None] >= _luminance(top)[None], base, top)
     if mode == "Difference":
         return np.abs(base - top)
     if mode == "Exclusion":
@@ -98,13 +153,39 @@ def _blend_pixels(base, top, mode: str):
     return top
 
 
+def _blend_premultiplied_pixels(base, top, mode: str):
+    """Return ``B(base, top) * base_alpha * top_alpha`` for modes with a closed form on premultiplied colour."""
+    if mode == "Multiply":
+        return base[:3] * top[:3]
+    if mode == "Screen":
+        blended = base[:3] * top[3:4]
+        blended += top[:3] * base[3:4]
+        blended -= base[:3] * top[:3]
+        return blended
+    return None
+
+
+def blend_premultiplied(base, top, mode: str):
+    top_alpha = top[3:4]
+    if mode == "Normal":
+        base *= 1.0 - top_alpha
+        base += top
+        return base
+
+    base_alpha = base[3:4].copy()
+    blended = _blend_premultiplied_pixels(base, top, mode)
+    if blended is None:
+        blended = _blend_pixels(_unpremultiply(base), _unpremultiply(top), mode)
+        blended *= top_alpha * base_alpha
+    base *= 1.0 - top_alpha
+    base[:3] += top[:3] * (1.0 - base_alpha)
+    base[:3] += blended
+    base[3:4] += top_alpha
+    return base
+
+
 def blend_layers(base: Image.Image, top: Image.Image, mode: str) -> Image.Image:
     if mode == "Normal":
         return Image.alpha_composite(base.convert("RGBA"), top.convert("RGBA"))
-
-    blended = _image_from_float(_blend_pixels(_rgb_float(base), _rgb_float(top), mode))
-    _, _, _, top_alpha = top.split()
-    result = base.copy()
-    blended_rgba = blended.convert("RGBA")
-    blended_rgba.putalpha(top_alpha)
-    return Image.alpha_composite(result.convert("RGBA"), blended_rgba)
+    blended = blend_premultiplied(premultiplied_from_image(base), premultiplied_from_image(top), mode)
+    return image_from_premultiplied(blended)
@@ -1,14 +1,22 @@
+from dataclasses import dataclass
+from functools import lru_cache
 import math
 import random
-from dataclasses import dataclass
 
-from PIL import Image, ImageDraw
+import numpy as np
+from PIL import Image
+
+from .tiles import clip_bounds, union_bounds
 
 
 @dataclass(frozen=True)
 class BrushSettings:
     size: int = 10
     opacity: int = 255
+    flow: int = 100
+    hardness: int = 100
+    angle: int = 0
+    roundness: int = 100
     spacing: int = 25
     smoothing: int = 0
     scatter: int = 0
@@ -27,6 +35,9 @@ class BrushSettings:
         scale = pressure if self.pressure_opacity else 1.0
         return max(0, min(255, int(round(self.opacity * scale))))
 
+    def flow_fraction(self) -> float:
+        return max(0, min(100, self.flow)) / 100
+
     def spacing_pixels(self, pressure: float = 1.0) -> float:
         return max(1.0, self.effective_size(pressure) * max(1, self.spacing) / 100)
 
@@ -65,7 +76,7 @@ def smoothed_brush_point(previous, current, smoothing: int):
     )
 
 
-def iter_brush_dabs(x1: int, y1: int, x2: int, y2: int, settings: BrushSettings, pressure: float = 1.0):
+def _iter_dab_positions(x1, y1, x2, y2, settings: BrushSettings, pressure: float = 1.0):
     size = settings.effective_size(pressure)
     spacing = settings.spacing_pixels(pressure)
     distance = math.hypot(x2 - x1, y2 - y1)
@@ -85,44 +96,229 @@ def iter_brush_dabs(x1: int, y1: int, x2: int, y2: int, settings: BrushSettings,
             radius = rng.random() * scatter_radius
             x += math.cos(angle) * radius
             y += math.sin(angle) * radius
+        yield x, y, size, step
+
+
+def iter_brush_dabs(x1: int, y1: int, x2: int, y2: int, settings: BrushSettings, pressure: float = 1.0):
+    for x, y, size, step in _iter_dab_positions(x1, y1, x2, y2, settings, pressure):
         yield int(round(x)), int(round(y)), size, step
 
 
 def paint_brush_dab(image, x: int, y: int, size: int, color):
+    return _stamp_dab(image, x, y, size, color)
+
+
+STROKE_BUFFER_PADDING = 64
+TIP_SUBPIXEL_STEPS = 4
+
+
+@lru_cache(maxsize=256)
+def brush_tip(size: int, hardness: int = 100, offset=(0, 0), angle: int = 0, roundness: int = 100):
+    """Return an antialiased alpha stamp and its (left, top) position relative to the dab pixel."""
     if size <= 1:
-        if 0 <= x < image.width and 0 <= y < image.height:
-            image.putpixel((x, y), color)
-        return
-    half = size // 2
-    ImageDraw.Draw(image).ellipse((x - half, y - half, x + half, y + half), fill=color)
+        stamp = np.ones((1, 1), dtype=np.float32)
+        stamp.flags.writeable = False
+        return stamp, 0, 0
+    radius = size / 2
+    reach = int(math.ceil(radius + 1))
+    coords = np.arange(-reach, reach + 1, dtype=np.float32)
+    dx = coords[None, :] - offset[0]
+    dy = coords[:, None] - offset[1]
+    theta = math.radians(angle)
+    u = dx * math.cos(theta) + dy * math.sin(theta)
+    v = (dy * math.cos(theta) - dx * math.sin(theta)) / (max(1, min(100, roundness)) / 100)
+    distance = np.hypot(u, v)
+    stamp = np.clip(radius + 0.5 - distance, 0.0, 1.0)
+    inner = radius * max(0, min(100, hardness)) / 100
+    if inner < radius:
+        falloff = np.clip((radius - distance) / (radius - inner), 0.0, 1.0)
+        stamp *= falloff * falloff * (3.0 - 2.0 * falloff)
+    rows = np.flatnonzero(stamp.any(axis=1))
+    columns = np.flatnonzero(stamp.any(axis=0))
+    stamp = np.ascontiguousarray(stamp[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1], dtype=np.float32)
+    stamp.flags.writeable = False
+    return stamp, int(columns[0]) - reach, int(rows[0]) - reach
+
+
+def _tip_for_position(x: float, y: float, size: int, settings: BrushSettings):
+    steps = TIP_SUBPIXEL_STEPS if size > 1 else 1
+    qx = round(x * steps)
+    qy = round(y * steps)
+    offset = (qx % steps / steps, qy % steps / steps)
+    stamp, left, top = brush_tip(size, settings.hardness, offset, settings.angle, settings.roundness)
+    return stamp, qx // steps + left, qy // steps + top
+
+
+def _blend_coverage(base, alpha, paint, erase: bool = False):
+    """Apply float ``alpha`` coverage to the RGBA image ``base`` and return the blended image.
+
+    ``paint`` is either one RGB colour or a per-pixel RGB array. Coverage is
+    quantized to 8 bits and laid over ``base`` with Pillow's ``alpha_composite``;
+    an erasing dab scales the base alpha down instead.
+    """
+    if erase:
+        output = np.array(base)
+        remaining = output[..., 3] * (1.0 - alpha)
+        remaining += np.float32(0.5)
+        output[..., 3] = remaining
+        output[output[..., 3] == 0] = 0
+        return Image.fromarray(output, "RGBA")
+    coverage = alpha * np.float32(255.0)
+    coverage += np.float32(0.5)
+    coverage = coverage.astype(np.uint8)
+    if isinstance(paint, np.ndarray):
+        top = np.empty(paint.shape[:2] + (4,), dtype=np.uint8)
+        top[..., :3] = np.clip(paint + 0.5, 0, 255)
+        top[..., 3] = coverage
+        top = Image.fromarray(top, "RGBA")
+    else:
+        top = Image.new("RGBA", base.size, (*paint[:3], 0))
+        top.putalpha(Image.fromarray(coverage, "L"))
+    return Image.alpha_composite(base, top)
+
+
+def _stamp_dab(image, x: float, y: float, size: int, color, erase: bool = False):
+    """Blend one dab straight onto ``image``; a lone dab has nothing to accumulate against."""
+    stamp, left, top = _tip_for_position(x, y, size, BrushSettings(size=size))
+    bounds = clip_bounds((left, top, left + stamp.shape[1], top + stamp.shape[0]), image.width, image.height)
+    if bounds is None:
+        return None
+    alpha = stamp[bounds[1] - top:bounds[3] - top, bounds[0] - left:bounds[2] - left] * np.float32(color[3] / 255.0)
+    image.paste(_blend_coverage(image.crop(bounds), alpha, color, erase), bounds[:2])
+    return bounds
+
+
+class BrushStroke:
+    """Accumulates the dabs of one stroke and blends them over the pixels the stroke started from.
+
+    Each dab only re-blends the pixels its own coverage raised. The per-pixel
+    colour buffer is allocated only once a dab's colour differs from the
+    stroke colour. An erasing stroke uses the accumulated coverage to remove
+    alpha instead of laying down colour.
+    """
+
+    def __init__(self, image, settings: BrushSettings, color=(0, 0, 0, 255), erase: bool = False):
+        self.image = image
+        self.settings = settings
+        self.color = color
+        self.erase = erase
+        self.bounds = None
+        self.dirty = None
+        self._base = None
+        self._alpha = None
+        self._paint = None
+
+    def add_segment(self, x1: int, y1: int, x2: int, y2: int, pressure: float = 1.0):
+        flow = self.settings.flow_fraction()
+        if self.erase:
+            base_color = self.color
+            if self.settings.pressure_opacity:
+                flow *= max(0.01, min(1.0, pressure))
+        else:
+            opacity = self.settings.effective_opacity(pressure)
+            base_color = (self.color[0], self.color[1], self.color[2], min(self.color[3], opacity))
+        dabs = list(_iter_dab_positions(x1, y1, x2, y2, self.settings, pressure))
+        reach = max(size for _x, _y, size, _step in dabs) // 2 + 2
+        xs = [x for x, _y, _size, _step in dabs]
+        ys = [y for _x, y, _size, _step in dabs]
+        bounds = clip_bounds(
+            (int(min(xs)) - reach, int(min(ys)) - reach, int(max(xs)) + reach + 1, int(max(ys)) + reach + 1),
+            self.image.width,
+            self.image.height,
+        )
+        if bounds is not None:
+            self._reserve(bounds)
+        dirty = None
+        for x, y, size, dab_index in dabs:
+            color = base_color if self.erase else _dynamic_color(base_color, self.settings, dab_index)
+            dirty = union_bounds(dirty, self.add_dab(x, y, size, color, flow))
+        return dirty
+
+    def add_dab(self, x: float, y: float, size: int, color, flow: float | None = None):
+        """Accumulate one dab, blend the pixels it changed and return their bounds, or None."""
+        stamp, left, top = _tip_for_position(x, y, size, self.settings)
+        bounds = clip_bounds((left, top, left + stamp.shape[1], top + stamp.shape[0]), self.image.width, self.image.height)
+        if bounds is None:
+            return None
+        self._reserve(bounds)
+        coverage = stamp[bounds[1] - top:bounds[3] - top, bounds[0] - left:bounds[2] - left]
+        region = self._region(bounds)
+        alpha = self._alpha[region]
+        gain = np.float32(color[3] / 255.0) - alpha
+        np.maximum(gain, 0.0, out=gain)
+        gain *= coverage
+        gain *= np.float32(self.settings.flow_fraction() if flow is None else flow)
+        rows = np.flatnonzero(gain.any(axis=1))
+        if not len(rows):
+            return None
+        columns = np.flatnonzero(gain.any(axis=0))
+        alpha += gain
+        if not self.erase and (self._paint is not None or tuple(color[:3]) != tuple(self.color[:3])):
+            if self._paint is None:
+                self._paint = np.empty(self._alpha.shape + (3,), dtype=np.float32)
+                self._paint[:] = self.color[:3]
+            weight = np.divide(gain, alpha, out=np.zeros_like(gain), where=alpha > 0)
+            paint = self._paint[region]
+            change = np.array(color[:3], dtype=np.float32) - paint
+            change *= weight[..., None]
+            paint += change
+        left, top = bounds[:2]
+        bounds = (left + int(columns[0]), top + int(rows[0]), left + int(columns[-1]) + 1, top + int(rows[-1]) + 1)
+        self.dirty = union_bounds(self.dirty, bounds)
+        self.composite(bounds)
+        return bounds
+
+    def composite(self, bounds):
+        region = self._region(bounds)
+        left, top = self.bounds[:2]
+        base = self._base.crop((bounds[0] - left, bounds[1] - top, bounds[2] - left, bounds[3] - top))
+        paint = self.color if self._paint is None else self._paint[region]
+        self.image.paste(_blend_coverage(base, self._alpha[region], paint, self.erase), bounds[:2])
+
+    def _region(self, bounds):
+        return (
+            slice(bounds[1] - self.bounds[1], bounds[3] - self.bounds[1]),
+            slice(bounds[0] - self.bounds[0], bounds[2] - self.bounds[0]),
+        )
+
+    def _reserve(self, bounds):
+        if self.bounds is not None and union_bounds(self.bounds, bounds) == self.bounds:
+            return
+        left, top, right, bottom = union_bounds(self.bounds, bounds)
+        pad = max(STROKE_BUFFER_PADDING, (right - left) // 2, (bottom - top) // 2)
+        grown = clip_bounds((left - pad, top - pad, right + pad, bottom + pad), self.image.width, self.image.height)
+        height, width = grown[3] - grown[1], grown[2] - grown[0]
+        base = self.image.crop(grown)
+        alpha = np.zeros((height, width), dtype=np.float32)
+        paint = None
+        if self._paint is not None:
+            paint = np.empty((height, width, 3), dtype=np.float32)
+            paint[:] = self.color[:3]
+        previous, self.bounds = self.bounds, grown
+        if previous is not None:
+            region = self._region(previous)
+            base.paste(self._base, (previous[0] - grown[0], previous[1] - grown[1]))
+            alpha[region] = self._alpha
+            if paint is not None:
+                paint[region] = self._paint
+        self._base, self._alpha, self._paint = base, alpha, paint
 
 
 def paint_brush_stroke(image, x1: int, y1: int, x2: int, y2: int, settings: BrushSettings, color, pressure: float = 1.0):
-    opacity = settings.effective_opacity(pressure)
-    base_color = (color[0], color[1], color[2], min(color[3], opacity))
-    for x, y, size, dab_index in iter_brush_dabs(x1, y1, x2, y2, settings, pressure):
-        paint_brush_dab(image, x, y, size, _dynamic_color(base_color, settings, dab_index))
+    return BrushStroke(image, settings, color).add_segment(x1, y1, x2, y2, pressure)
 
 
 def paint_brush_line(image, x1: int, y1: int, x2: int, y2: int, size: int, color):
-    paint_brush_stroke(image, x1, y1, x2, y2, BrushSettings(size=size, opacity=color[3]), color)
+    return paint_brush_stroke(image, x1, y1, x2, y2, BrushSettings(size=size, opacity=color[3]), color)
 
 
 def erase_brush_dab(image, x: int, y: int, size: int):
-    if size <= 1:
-        if 0 <= x < image.width and 0 <= y < image.height:
-            image.putpixel((x, y), (0, 0, 0, 0))
-        return
-    half = size // 2
-    mask = Image.new("L", image.size, 0)
-    ImageDraw.Draw(mask).ellipse((x - half, y - half, x + half, y + half), fill=255)
-    image.paste((0, 0, 0, 0), (0, 0, image.width, image.height), mask)
+    return _stamp_dab(image, x, y, size, (0, 0, 0, 255), erase=True)
 
 
 def erase_brush_stroke(image, x1: int, y1: int, x2: int, y2: int, settings: BrushSettings, pressure: float = 1.0):
-    for x, y, size, _dab_index in iter_brush_dabs(x1, y1, x2, y2, settings, pressure):
-        erase_brush_dab(image, x, y, size)
+    return BrushStroke(image, settings, erase=True).add_segment(x1, y1, x2, y2, pressure)
 
 
 def erase_brush_line(image, x1: int, y1: int, x2: int, y2: int, size: int):
-    erase_brush_stroke(image, x1, y1, x2, y2, BrushSettings(size=size))
+    return erase_brush_stroke(image, x1, y1, x2, y2, BrushSettings(size=size))
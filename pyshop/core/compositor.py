@@ -1,12 +1,62 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import numpy as np
 from PIL import Image, ImageFilter
 
-from .adjustments import apply_adjustment
-from .blend import blend_layers
+from .adjustments import LUT_ADJUSTMENTS, adjustment_needs_image, apply_adjustment, apply_lut, compile_adjustment_luts
+from .blend import blend_premultiplied, image_from_premultiplied, premultiplied_from_image
 from .effects import apply_effect
-from .tiles import TileBox
+from .tiles import DEFAULT_TILE_SIZE, MAX_TILE_LEVEL, TileBox, bounds_intersect, clip_bounds, iter_intersecting_tile_boxes, iter_tile_boxes
 from .text import render_text_tile
 from .vector import render_vector_shape_tile
 
+MAX_RENDER_WORKERS = 16
+
+
+def default_render_workers() -> int:
+    return max(1, min(MAX_RENDER_WORKERS, os.cpu_count() or 1))
+
+
+_render_workers = default_render_workers()
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+
+def render_workers() -> int:
+    return _render_workers
+
+
+def set_render_workers(count: int):
+    global _render_executor, _render_workers
+    count = max(1, int(count))
+    with _render_executor_lock:
+        if count != _render_workers and _render_executor is not None:
+            _render_executor.shutdown(wait=False)
+            _render_executor = None
+        _render_workers = count
+
+
+def _shared_executor():
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ThreadPoolExecutor(max_workers=_render_workers, thread_name_prefix="pyshop-render")
+        return _render_executor
+
+
+def render_executor() -> ThreadPoolExecutor:
+    return _shared_executor()
+
+
+def render_tiles(render, tile_boxes):
+    tile_boxes = list(tile_boxes)
+    if _render_workers <= 1 or len(tile_boxes) <= 1:
+        return [(tile_box, render(tile_box)) for tile_box in tile_boxes]
+    return list(zip(tile_boxes, _shared_executor().map(render, tile_boxes)))
+
 
 def _apply_opacity(image: Image.Image, opacity: int) -> Image.Image:
     if opacity >= 255:
@@ -38,96 +88,545 @@ def _apply_mask(image: Image.Image, layer, crop_box) -> Image.Image:
     return Image.merge("RGBA", (red, green, blue, alpha))
 
 
-def _clip_to_base(image: Image.Image, base: Image.Image) -> Image.Image:
-    red, green, blue, alpha = image.split()
-    base_alpha = base.getchannel("A")
-    alpha = Image.composite(alpha, Image.new("L", alpha.size, 0), base_alpha)
-    return Image.merge("RGBA", (red, green, blue, alpha))
+def _control_amount(layer, crop_box):
+    amount = max(0, min(255, layer.opacity)) / 255.0
+    mask = _effective_mask(layer, crop_box)
+    if mask is not None:
+        return np.asarray(mask, dtype=np.float32)[None] * (amount / 255.0)
+    return amount
 
 
-def _apply_group_controls(image: Image.Image, group, crop_box) -> Image.Image:
-    image = _apply_mask(image, group, crop_box)
-    return _apply_opacity(image, group.opacity)
+def _apply_controls(pixels, layer, crop_box):
+    amount = _control_amount(layer, crop_box)
+    if not isinstance(amount, float) or amount < 1.0:
+        pixels *= amount
+    return pixels
 
 
-def _adjustment_effect_mask(layer, base: Image.Image, crop_box):
-    mask = Image.new("L", base.size, max(0, min(255, layer.opacity)))
-    layer_mask = _effective_mask(layer, crop_box)
-    if layer_mask is not None:
-        mask = Image.composite(mask, Image.new("L", mask.size, 0), layer_mask)
-    if layer.clipping:
-        mask = Image.composite(mask, Image.new("L", mask.size, 0), base.getchannel("A"))
-    return mask
+def _clip_to_base(pixels, base):
+    pixels *= base[3:4]
+    return pixels
 
 
-def render_layer_tile(layer, crop_box) -> Image.Image:
+def _render_source_tile(layer, crop_box) -> Image.Image:
     if layer.vector_shape:
-        image = render_vector_shape_tile(layer.vector_shape, crop_box, (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]))
-    elif layer.text_item:
-        image = render_text_tile(layer.text_item, crop_box, (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]))
-    else:
-        image = layer.image.crop(crop_box)
-    image = _apply_mask(image, layer, crop_box)
+        return render_vector_shape_tile(layer.vector_shape, crop_box, (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]))
+    if layer.text_item:
+        return render_text_tile(layer.text_item, crop_box, (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]))
+    return layer.crop_image(crop_box)
+
+
+def render_layer_tile(layer, crop_box) -> Image.Image:
+    image = _apply_mask(_render_source_tile(layer, crop_box), layer, crop_box)
     return _apply_opacity(image, layer.opacity)
 
 
+def _fuses_adjustment(layer) -> bool:
+    adjustment = layer.adjustment
+    return (
+        layer.visible
+        and adjustment is not None
+        and adjustment.get("type") in LUT_ADJUSTMENTS
+        and not adjustment_needs_image(adjustment)
+        and layer.opacity >= 255
+        and layer.mask is None
+        and not layer.clipping
+    )
+
+
+def _composites_over(layer) -> bool:
+    """Return True for a layer that can be folded into a uint8 ``alpha_composite`` run."""
+    return (
+        layer.visible
+        and not layer.is_group
+        and not layer.adjustment
+        and not layer.effect
+        and not layer.clipping
+        and layer.blend_mode == "Normal"
+        and layer.opacity >= 255
+        and layer.mask is None
+    )
+
+
+def _apply_filter_layer(result, layer, crop_box, render):
+    filtered = premultiplied_from_image(render(image_from_premultiplied(result)))
+    amount = _control_amount(layer, crop_box)
+    if layer.clipping:
+        amount = amount * result[3:4]
+    result += (filtered - result) * amount
+    return result
+
+
+def layer_content_bounds(layer):
+    width, height = layer.size
+    if layer.adjustment or layer.effect or layer.is_group or layer.vector_shape or layer.text_item:
+        return 0, 0, width, height
+    bounds = layer.image.getbbox()
+    dx, dy = layer.offset
+    if bounds is None or not (dx or dy):
+        return bounds
+    return clip_bounds((bounds[0] + dx, bounds[1] + dy, bounds[2] + dx, bounds[3] + dy), width, height)
+
+
+def _renders_per_tile(layer) -> bool:
+    if layer.effect:
+        return False
+    return not (layer.adjustment and adjustment_needs_image(layer.adjustment))
+
+
 def composite_layers(layers) -> Image.Image | None:
     if not layers:
         return None
-    width, height = layers[0].image.size
-    return composite_layers_tile(layers, TileBox(0, 0, width, height))
+    width, height = layers[0].size
+    if not all(_renders_per_tile(layer) for layer in layers):
+        return composite_layers_tile(layers, TileBox(0, 0, width, height))
+    result = Image.new("RGBA", (width, height))
+    for tile_box, tile in render_tiles(lambda tile_box: composite_layers_tile(layers, tile_box), iter_tile_boxes(width, height)):
+        result.paste(tile, (tile_box.x, tile_box.y))
+    return result
 
 
 def composite_layers_tile(layers, tile_box) -> Image.Image:
-    result = Image.new("RGBA", (tile_box.width, tile_box.height), (0, 0, 0, 0))
+    return _image_from_state(_composite_stack((None, None), layers, tile_box), tile_box)
+
+
+def _empty_pixels(tile_box):
+    return np.zeros((4, tile_box.height, tile_box.width), dtype=np.float32)
+
+
+def _image_from_state(state, tile_box) -> Image.Image:
+    result, run = state
+    if result is None:
+        return run if run is not None else Image.new("RGBA", (tile_box.width, tile_box.height))
+    return image_from_premultiplied(_flush_run(state, tile_box))
+
+
+def _flush_run(state, tile_box):
+    """Return the premultiplied pixels of a ``(result, run)`` compositing state."""
+    result, run = state
+    if run is None:
+        return _empty_pixels(tile_box) if result is None else result
+    pixels = premultiplied_from_image(run)
+    return pixels if result is None else blend_premultiplied(result, pixels, "Normal")
+
+
+def _composite_pixels(result, layers, tile_box):
+    return _flush_run(_composite_stack((result, None), layers, tile_box), tile_box)
+
+
+def _composite_stack(state, layers, tile_box):
+    """Composite ``layers`` onto a ``(result, run)`` state and return the new state.
+
+    ``result`` holds premultiplied float pixels, or None while nothing has been
+    flushed into it. ``run`` holds consecutive plain Normal layers folded in
+    uint8 with ``alpha_composite`` and is only converted to float when a layer
+    that needs the running result arrives. ``result`` is updated in place.
+    """
+    result, run = state
     crop_box = tile_box.as_crop_box()
     index = 0
     while index < len(layers):
         layer = layers[index]
         index += 1
+        if _composites_over(layer):
+            tile = _render_source_tile(layer, crop_box)
+            run = tile if run is None else Image.alpha_composite(run, tile)
+            continue
         if not layer.visible:
             if layer.is_group:
                 while index < len(layers) and layers[index].group_id == layer.group_id:
                     index += 1
             continue
+        result, run = _flush_run((result, run), tile_box), None
         if layer.is_group:
             children = []
             while index < len(layers) and layers[index].group_id == layer.group_id:
                 children.append(layers[index])
                 index += 1
             if children:
-                group_tile = composite_layers_tile(children, tile_box)
-                group_tile = _apply_group_controls(group_tile, layer, crop_box)
+                group_pixels = _composite_pixels(None, children, tile_box)
+                group_pixels = _apply_controls(group_pixels, layer, crop_box)
                 if layer.clipping:
-                    group_tile = _clip_to_base(group_tile, result)
-                result = blend_layers(result, group_tile, layer.blend_mode)
+                    group_pixels = _clip_to_base(group_pixels, result)
+                result = blend_premultiplied(result, group_pixels, layer.blend_mode)
             continue
         if layer.adjustment:
-            adjusted = apply_adjustment(result, layer.adjustment)
-            mask = _adjustment_effect_mask(layer, result, crop_box)
-            result = Image.composite(adjusted, result, mask)
+            run_adjustments = [layer.adjustment]
+            while _fuses_adjustment(layer) and index < len(layers) and _fuses_adjustment(layers[index]):
+                run_adjustments.append(layers[index].adjustment)
+                index += 1
+            if len(run_adjustments) > 1:
+                result = premultiplied_from_image(apply_lut(image_from_premultiplied(result), compile_adjustment_luts(run_adjustments)))
+            else:
+                result = _apply_filter_layer(result, layer, crop_box, lambda image: apply_adjustment(image, layer.adjustment))
             continue
         if layer.effect:
-            effected = apply_effect(result, layer.effect)
-            mask = _adjustment_effect_mask(layer, result, crop_box)
-            result = Image.composite(effected, result, mask)
+            result = _apply_filter_layer(result, layer, crop_box, lambda image: apply_effect(image, layer.effect))
             continue
-        tile = render_layer_tile(layer, crop_box)
+        pixels = _apply_controls(premultiplied_from_image(_render_source_tile(layer, crop_box)), layer, crop_box)
         if layer.clipping:
-            tile = _clip_to_base(tile, result)
-        result = blend_layers(result, tile, layer.blend_mode)
-    return result
+            pixels = _clip_to_base(pixels, result)
+        result = blend_premultiplied(result, pixels, layer.blend_mode)
+    return result, run
+
+
+SAMPLE_SIZES = {"Point Sample": 0, "3 by 3 Average": 1, "5 by 5 Average": 2}
+
+
+def _cached_sample_region(cache, width, height, bounds):
+    left, top, right, bottom = bounds
+    region = Image.new("RGBA", (right - left, bottom - top))
+    for tile_box in iter_intersecting_tile_boxes(width, height, bounds):
+        tile = cache.cached_tile(tile_box)
+        if tile is None:
+            return None
+        crop = (max(left, tile_box.x), max(top, tile_box.y), min(right, tile_box.right), min(bottom, tile_box.bottom))
+        piece = tile.crop((crop[0] - tile_box.x, crop[1] - tile_box.y, crop[2] - tile_box.x, crop[3] - tile_box.y))
+        region.paste(piece, (crop[0] - left, crop[1] - top))
+    return region
+
+
+def sample_composite(layers, x: int, y: int, radius: int = 0, cache=None):
+    if not layers:
+        return None
+    width, height = layers[0].size
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+    radius = max(0, int(radius))
+    bounds = (max(0, x - radius), max(0, y - radius), min(width, x + radius + 1), min(height, y + radius + 1))
+    if any(layer.visible and not _renders_per_tile(layer) for layer in layers):
+        region = (cache.composite(layers) if cache is not None else composite_layers(layers)).crop(bounds)
+    elif cache is not None:
+        region = _cached_sample_region(cache, width, height, bounds)
+    else:
+        region = None
+    if region is None:
+        region = composite_layers_tile(layers, TileBox(bounds[0], bounds[1], bounds[2] - bounds[0], bounds[3] - bounds[1]))
+    if radius == 0:
+        return region.getpixel((x - bounds[0], y - bounds[1]))
+    average = premultiplied_from_image(region).reshape(4, -1).mean(axis=1).reshape(4, 1, 1)
+    return image_from_premultiplied(average).getpixel((0, 0))
+
+
+def layer_signature(layer):
+    return layer.revision
+
+
+def top_level_span(layers, index: int):
+    layer = layers[index]
+    start = index
+    if layer.group_id is not None and not layer.is_group:
+        while start >= 0 and not (layers[start].is_group and layers[start].group_id == layer.group_id):
+            start -= 1
+        if start < 0:
+            return 0, len(layers)
+    end = start + 1
+    if layers[start].is_group:
+        while end < len(layers) and layers[end].group_id == layers[start].group_id:
+            end += 1
+    return start, end
+
+
+def _composites_as_normal_over(layers) -> bool:
+    for layer in layers:
+        if layer.group_id is not None and not layer.is_group:
+            continue
+        if not layer.visible:
+            continue
+        if layer.adjustment or layer.effect or layer.clipping or layer.blend_mode != "Normal":
+            return False
+    return True
+
+
+def _image_nbytes(image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _state_nbytes(value) -> int:
+    if isinstance(value, tuple):
+        return sum(_state_nbytes(part) for part in value)
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return _image_nbytes(value)
+
+
+def _reduce_tile(pyramid, level: int):
+    while len(pyramid) <= level:
+        previous = pyramid[-1]
+        pyramid.append(previous.reduce(2) if previous.width > 1 or previous.height > 1 else previous)
+    return pyramid
+
+
+# The same worst case as DisplayTileCache's 512 full-size tiles.
+COMPOSITE_CACHE_BYTES = 512 * DEFAULT_TILE_SIZE * DEFAULT_TILE_SIZE * 4
+STACK_CACHE_BYTES = 256 * 1024 * 1024
 
 
 class TiledCompositeCache:
-    def __init__(self):
-        self._tiles = {}
+    """Composited document tiles, their placeholders and zoomed-out pyramid levels.
+
+    Everything but the stacks around the active layer shares one LRU budget of
+    ``max_bytes``. Placeholders go first, then the least recently used tiles
+    together with their pyramids. The below and above stacks each keep at most
+    ``max_stack_bytes``.
+
+    The navigator overview keeps one reduced piece per tile outside that
+    budget. Pieces are cut from cached tiles when there are any, or rendered
+    straight to the overview level with ``render_tile(..., level=...)``, so a
+    zoomed-out overview never has to hold the document at full resolution.
+    """
+
+    def __init__(self, max_bytes: int = COMPOSITE_CACHE_BYTES, max_stack_bytes: int = STACK_CACHE_BYTES):
+        self._tiles = OrderedDict()
+        self._stale = OrderedDict()
+        self._pending = {}
+        self._pyramids = {}
+        self._overview = {}
+        self._overview_pending = {}
+        self._below = OrderedDict()
+        self._above = OrderedDict()
+        self.max_bytes = max_bytes
+        self.max_stack_bytes = max_stack_bytes
+        self.nbytes = 0
+        self._composite = None
+        self._lock = threading.Lock()
+
+    def invalidate(self, bounds=None):
+        with self._lock:
+            for key in [key for key in self._tiles if bounds is None or bounds_intersect(key, bounds)]:
+                self._set_stale(key, self._tiles.pop(key))
+            for key in [key for key in self._pending if bounds is None or bounds_intersect(key, bounds)]:
+                del self._pending[key]
+            for key in [key for key in self._overview if bounds is None or bounds_intersect(key, bounds)]:
+                self._overview[key] = self._overview[key][:2] + (False,)
+            for key in [key for key in self._overview_pending if bounds is None or bounds_intersect(key, bounds)]:
+                del self._overview_pending[key]
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._stale.clear()
+            self._pending.clear()
+            self._pyramids.clear()
+            self._overview.clear()
+            self._overview_pending.clear()
+            self._below.clear()
+            self._above.clear()
+            self.nbytes = 0
+            self._composite = None
+
+    def composite(self, layers):
+        """Return the full composite of ``layers``, kept until a layer or the stack changes."""
+        signature = tuple((layer.uid, layer_signature(layer)) for layer in layers)
+        cached = self._composite
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        image = composite_layers(layers)
+        self._composite = (signature, image)
+        return image
+
+    def cached_tile(self, tile_box):
+        key = tile_box.as_crop_box()
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def placeholder_tile(self, tile_box):
+        return self._stale.get(tile_box.as_crop_box())
+
+    def tile_level(self, tile_box, tile, level: int):
+        level = max(0, min(MAX_TILE_LEVEL, level))
+        if tile is None or level == 0:
+            return tile
+        key = tile_box.as_crop_box()
+        with self._lock:
+            if tile is not self._tiles.get(key) and tile is not self._stale.get(key):
+                return _reduce_tile([tile], level)[level]
+            pyramid = self._pyramids.get(key)
+            if pyramid is None or pyramid[0] is not tile:
+                self._drop_pyramid(key)
+                pyramid = [tile]
+                self._pyramids[key] = pyramid
+            levels = len(pyramid)
+            _reduce_tile(pyramid, level)
+            self.nbytes += sum(_image_nbytes(reduced) for reduced in pyramid[levels:])
+            self._trim()
+            return pyramid[level]
+
+    def overview_level(self, size, max_size) -> int:
+        width, height = size
+        level = 0
+        while level < MAX_TILE_LEVEL and (width >> (level + 1)) >= max_size[0] and (height >> (level + 1)) >= max_size[1]:
+            level += 1
+        return level
+
+    def overview_image(self, layers, max_size):
+        """Assemble a zoomed-out overview from what is already cached and return it with the tiles it lacks.
+
+        Each tile comes from its cached composite, an overview piece that is
+        still current, or failing that a stale placeholder. The returned tile
+        boxes still need ``render_tile(..., level=...)`` at the returned level;
+        nothing is rendered here.
+        """
+        if not layers:
+            return None, [], 0
+        width, height = layers[0].size
+        level = self.overview_level((width, height), max_size)
+        scale = 1 << level
+        overview = Image.new("RGBA", (-(-width // scale), -(-height // scale)))
+        missing = []
+        for tile_box in iter_tile_boxes(width, height):
+            key = tile_box.as_crop_box()
+            tile = self.cached_tile(tile_box)
+            if tile is not None:
+                piece = self.tile_level(tile_box, tile, level)
+                with self._lock:
+                    self._overview[key] = (level, piece, True)
+            else:
+                with self._lock:
+                    entry = self._overview.get(key)
+                if entry is not None and entry[0] == level:
+                    piece = entry[1]
+                    current = entry[2]
+                else:
+                    stale = self.placeholder_tile(tile_box)
+                    piece = self.tile_level(tile_box, stale, level) if stale is not None else None
+                    current = False
+                if not current:
+                    missing.append(tile_box)
+            if piece is not None:
+                overview.paste(piece, (tile_box.x // scale, tile_box.y // scale))
+        return overview, missing, level
+
+    def get_tile(self, layers, tile_box, active_index: int | None = None):
+        key = tile_box.as_crop_box()
+        tile = self.cached_tile(tile_box)
+        if tile is None:
+            tile = self.render_tile(layers, tile_box, active_index)
+            with self._lock:
+                self._store(key, tile)
+        return tile
+
+    def render_missing(self, layers, tile_boxes, active_index: int | None = None):
+        missing = [tile_box for tile_box in tile_boxes if tile_box.as_crop_box() not in self._tiles]
+        rendered = render_tiles(lambda tile_box: self.render_tile(layers, tile_box, active_index), missing)
+        with self._lock:
+            for tile_box, tile in rendered:
+                self._store(tile_box.as_crop_box(), tile)
+        return len(rendered)
+
+    def is_current(self, tile_box, level: int = 0) -> bool:
+        key = tile_box.as_crop_box()
+        if not level:
+            return key in self._tiles
+        entry = self._overview.get(key)
+        return entry is not None and entry[0] == level and entry[2]
+
+    def is_pending(self, tile_box, level: int = 0) -> bool:
+        return tile_box.as_crop_box() in (self._overview_pending if level else self._pending)
+
+    def begin_render(self, tile_box, level: int = 0):
+        token = object()
+        with self._lock:
+            (self._overview_pending if level else self._pending)[tile_box.as_crop_box()] = token
+        return token
+
+    def finish_render(self, tile_box, token, tile, level: int = 0) -> bool:
+        key = tile_box.as_crop_box()
+        with self._lock:
+            pending = self._overview_pending if level else self._pending
+            if pending.get(key) is not token:
+                return False
+            if level:
+                del pending[key]
+                self._overview[key] = (level, tile, True)
+            else:
+                self._store(key, tile)
+        return True
+
+    def cancel_render(self, tile_box, token, level: int = 0):
+        key = tile_box.as_crop_box()
+        with self._lock:
+            pending = self._overview_pending if level else self._pending
+            if pending.get(key) is token:
+                del pending[key]
+
+    def _store(self, key, tile):
+        previous = self._tiles.pop(key, None)
+        if previous is not None:
+            self.nbytes -= _image_nbytes(previous)
+        self._tiles[key] = tile
+        self.nbytes += _image_nbytes(tile)
+        stale = self._stale.pop(key, None)
+        if stale is not None:
+            self.nbytes -= _image_nbytes(stale)
+        self._pending.pop(key, None)
+        self._drop_orphaned_pyramid(key)
+        self._trim()
+
+    def _set_stale(self, key, tile):
+        previous = self._stale.pop(key, None)
+        if previous is not None:
+            self.nbytes -= _image_nbytes(previous)
+        self._stale[key] = tile
+        self._drop_orphaned_pyramid(key)
+
+    def _drop_pyramid(self, key):
+        pyramid = self._pyramids.pop(key, None)
+        if pyramid is not None:
+            self.nbytes -= sum(_image_nbytes(level) for level in pyramid[1:])
+
+    def _drop_orphaned_pyramid(self, key):
+        pyramid = self._pyramids.get(key)
+        if pyramid is not None and pyramid[0] is not self._tiles.get(key) and pyramid[0] is not self._stale.get(key):
+            self._drop_pyramid(key)
+
+    def _trim(self):
+        while self.nbytes > self.max_bytes and (self._stale or len(self._tiles) > 1):
+            store = self._stale if self._stale else self._tiles
+            key, tile = store.popitem(last=False)
+            self.nbytes -= _image_nbytes(tile)
+            self._drop_orphaned_pyramid(key)
+
+    def render_tile(self, layers, tile_box, active_index: int | None = None, level: int = 0):
+        """Composite one tile; at ``level`` > 0 it is reduced to that overview level and nothing is cached."""
+        if level:
+            return _reduce_tile([composite_layers_tile(layers, tile_box)], level)[level]
+        if active_index is None or not 0 <= active_index < len(layers):
+            return composite_layers_tile(layers, tile_box)
+        return self._composite_around_active(layers, tile_box, active_index)
 
-    def invalidate(self):
-        self._tiles.clear()
+    def _composite_around_active(self, layers, tile_box, active_index: int):
+        start, end = top_level_span(layers, active_index)
+        below = layers[:start]
+        above = layers[end:]
+        result, run = self._stack_tile(self._below, below, tile_box, lambda stack, box: _composite_stack((None, None), stack, box))
+        state = (result.copy() if result is not None else None, run)
+        if not _composites_as_normal_over(above):
+            return _image_from_state(_composite_stack(state, layers[start:], tile_box), tile_box)
+        state = _composite_stack(state, layers[start:end], tile_box)
+        if not above:
+            return _image_from_state(state, tile_box)
+        above_pixels = self._stack_tile(self._above, above, tile_box, lambda stack, box: _composite_pixels(None, stack, box))
+        return image_from_premultiplied(blend_premultiplied(_flush_run(state, tile_box), above_pixels, "Normal"))
 
-    def get_tile(self, layers, tile_box):
+    def _stack_tile(self, store, layers, tile_box, render):
         key = tile_box.as_crop_box()
-        if key not in self._tiles:
-            self._tiles[key] = composite_layers_tile(layers, tile_box)
-        return self._tiles[key]
+        signature = tuple(layer_signature(layer) for layer in layers)
+        with self._lock:
+            cached = store.get(key)
+            if cached is not None and cached[0] == signature:
+                store.move_to_end(key)
+                return cached[1]
+        value = render(layers, tile_box)
+        with self._lock:
+            store[key] = (signature, value, _state_nbytes(value))
+            store.move_to_end(key)
+            total = sum(entry[2] for entry in store.values())
+            while total > self.max_stack_bytes and len(store) > 1:
+                total -= store.popitem(last=False)[1][2]
+        return value
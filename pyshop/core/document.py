@@ -4,6 +4,7 @@ from dataclasses import dataclass, field
 from PIL import Image, UnidentifiedImageError
 
 from .layer import Layer
+from .selection import Selection
 
 
 MAX_DOCUMENT_PIXELS = 100_000_000
@@ -21,7 +22,7 @@ def default_channel_visibility():
 class Document:
     layers: list = field(default_factory=list)
     active_layer_index: int = 0
-    selection_mask: object | None = None
+    selection: Selection | None = None
     current_path: list = field(default_factory=list)
     current_path_closed: bool = False
     channel_visibility: dict = field(default_factory=default_channel_visibility)
@@ -39,6 +40,14 @@ class Document:
             return (0, 0)
         return self.layers[0].image.size
 
+    @property
+    def selection_mask(self):
+        return self.selection.to_image() if self.selection is not None else None
+
+    @selection_mask.setter
+    def selection_mask(self, mask):
+        self.selection = Selection.from_mask(mask) if mask is not None else None
+
     @property
     def has_unsaved_changes(self) -> bool:
         return self.dirty_revision != self.saved_revision
@@ -55,7 +64,7 @@ class Document:
             self.active_layer_index = max(0, min(index, len(self.layers) - 1))
 
     def reset_metadata(self):
-        self.selection_mask = None
+        self.selection = None
         self.current_path = []
         self.current_path_closed = False
         self.channel_visibility = default_channel_visibility()
@@ -101,6 +110,7 @@ class Document:
 def create_document_layers(width: int, height: int, background_rgba):
     background = Layer("Background", width, height)
     background.image.paste(background_rgba, (0, 0, width, height))
+    background.mark_pixels_changed()
     return [background]
 
 
@@ -0,0 +1,205 @@
+import numpy as np
+from PIL import Image, ImageFilter
+
+from .blend import paint_over
+from .tiles import clip_bounds, intersect_bounds
+
+
+def color_match_mask(pixels, target, tolerance: int, channels: int = 3):
+    """Return a boolean mask of pixels whose first ``channels`` bands are within ``tolerance`` of ``target``."""
+    match = np.ones(pixels.shape[:2], dtype=bool)
+    for channel in range(channels):
+        band = pixels[..., channel].astype(np.int16)
+        band -= int(target[channel])
+        np.abs(band, out=band)
+        match &= band <= tolerance
+    return match
+
+
+def _row_runs(match):
+    height, width = match.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = match
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _end_rows, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def _run_links(rows, starts, ends, stride: int):
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    first = np.searchsorted(end_keys, (rows + 1) * stride + starts, side="right")
+    last = np.searchsorted(start_keys, (rows + 1) * stride + ends, side="left")
+    counts = np.maximum(last - first, 0)
+    upper = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    lower = np.repeat(first, counts) + offsets
+    return upper, lower
+
+
+def _component_labels(count: int, upper, lower):
+    parent = np.arange(count)
+    while True:
+        left = parent[upper]
+        right = parent[lower]
+        pending = left != right
+        if not pending.any():
+            return parent
+        np.minimum.at(parent, np.maximum(left, right)[pending], np.minimum(left, right)[pending])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+
+def _runs_mask(shape, rows, starts, ends):
+    height, width = shape
+    marks = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(marks, (rows, starts), 1)
+    np.add.at(marks, (rows, ends), -1)
+    return np.cumsum(marks, axis=1)[:, :width] > 0
+
+
+def contiguous_region(match, x: int, y: int):
+    """Return the 4-connected component of ``match`` containing (x, y) as a boolean mask."""
+    if not match[y, x]:
+        return np.zeros(match.shape, dtype=bool)
+    rows, starts, ends = _row_runs(match)
+    upper, lower = _run_links(rows, starts, ends, match.shape[1] + 2)
+    labels = _component_labels(len(rows), upper, lower)
+    seed = np.flatnonzero((rows == y) & (starts <= x) & (ends > x))[0]
+    selected = labels == labels[seed]
+    if selected.all():
+        return match
+    return _runs_mask(match.shape, rows[selected], starts[selected], ends[selected])
+
+
+def matching_region(pixels, x: int, y: int, tolerance: int, contiguous: bool = True, channels: int = 3):
+    """Return the boolean region a wand or bucket click at (x, y) selects in ``pixels``."""
+    match = color_match_mask(pixels, pixels[y, x], tolerance, channels)
+    return contiguous_region(match, x, y) if contiguous else match
+
+
+class SampleCache:
+    """Keeps the last sampled pixel array until its revision key changes."""
+
+    def __init__(self):
+        self._key = None
+        self._pixels = None
+
+    def pixels(self, key, render):
+        if self._pixels is None or key != self._key:
+            self._pixels = np.asarray(render())
+            self._key = key
+        return self._pixels
+
+    def clear(self):
+        self._key = None
+        self._pixels = None
+
+
+def fill_coverage(match, antialias: bool = False):
+    """Return float coverage for a matched region, or the boolean mask itself when it is already exact."""
+    if not antialias:
+        return match
+    coverage = match.astype(np.float32)
+    blurred = Image.fromarray(match.astype(np.uint8) * 255, "L").filter(ImageFilter.BoxBlur(1))
+    np.maximum(coverage, np.asarray(blurred, dtype=np.float32) * (1.0 / 255.0), out=coverage)
+    return coverage
+
+
+def _coverage_bounds(coverage):
+    rows = np.flatnonzero(coverage.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(coverage.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def _selected_coverage(coverage, selection, origin):
+    """Trim ``coverage`` placed at ``origin`` to the selection bounds and weight it by the selection there.
+
+    Returns the document-space bounds and the trimmed coverage, or (None, None).
+    """
+    found = _coverage_bounds(coverage)
+    if found is None:
+        return None, None
+    found = (found[0] + origin[0], found[1] + origin[1], found[2] + origin[0], found[3] + origin[1])
+    bounds = intersect_bounds(found, selection.bounds)
+    if bounds is None:
+        return None, None
+    left, top, right, bottom = (bounds[0] - origin[0], bounds[1] - origin[1], bounds[2] - origin[0], bounds[3] - origin[1])
+    coverage = coverage[top:bottom, left:right].astype(np.float32)
+    coverage *= np.asarray(selection.crop(bounds), dtype=np.float32) * (1.0 / 255.0)
+    inner = _coverage_bounds(coverage)
+    if inner is None:
+        return None, None
+    coverage = coverage[inner[1]:inner[3], inner[0]:inner[2]]
+    return (bounds[0] + inner[0], bounds[1] + inner[1], bounds[0] + inner[2], bounds[1] + inner[3]), coverage
+
+
+def _sample_window(sample, window):
+    if isinstance(sample, np.ndarray):
+        return sample[window[1]:window[3], window[0]:window[2]]
+    if window == (0, 0) + sample.size:
+        return np.asarray(sample)
+    return np.asarray(sample.crop(window))
+
+
+def flood_fill(
+    image: Image.Image,
+    x: int,
+    y: int,
+    color,
+    tolerance: int = 32,
+    contiguous: bool = True,
+    antialias: bool = False,
+    sample=None,
+    selection=None,
+):
+    """Fill the region matching the colour at (x, y) with ``color`` and return the dirty bounds.
+
+    ``sample`` is an image or RGBA array to match against instead of ``image`` itself.
+    ``selection`` is a ``Selection``; matching and labeling only look at its
+    bounds, so a contiguous fill does not leave them, and the fill is weighted
+    by its cropped mask inside the dirty box.
+    """
+    if not (0 <= x < image.width and 0 <= y < image.height):
+        return None
+    window = (0, 0, image.width, image.height)
+    if selection is not None:
+        window = intersect_bounds(selection.bounds, window)
+        if window is None or not (window[0] <= x < window[2] and window[1] <= y < window[3]):
+            return None
+        if antialias:
+            window = clip_bounds((window[0] - 1, window[1] - 1, window[2] + 1, window[3] + 1), image.width, image.height)
+    source = _sample_window(sample if sample is not None else image, window)
+    x, y = x - window[0], y - window[1]
+    target = source[y, x]
+    if sample is None and tuple(int(value) for value in target) == tuple(color):
+        return None
+    coverage = fill_coverage(matching_region(source, x, y, tolerance, contiguous, source.shape[2]), antialias)
+    if selection is not None:
+        bounds, coverage = _selected_coverage(coverage, selection, window[:2])
+    else:
+        bounds = _coverage_bounds(coverage)
+        if bounds is not None:
+            coverage = coverage[bounds[1]:bounds[3], bounds[0]:bounds[2]]
+    if bounds is None:
+        return None
+
+    pixels = np.array(image.crop(bounds))
+    paint = np.array(color[:3], dtype=np.float32)
+    if color[3] == 255:
+        solid = coverage if coverage.dtype == bool else coverage >= 1.0
+        np.copyto(pixels, np.array(color, dtype=np.uint8), where=solid[..., None])
+        if coverage.dtype != bool:
+            partial = (coverage > 0) & ~solid
+            if partial.any():
+                pixels[partial] = paint_over(pixels[partial][None], paint, coverage[partial][None])[0]
+    else:
+        pixels = paint_over(pixels, paint, coverage.astype(np.float32) * (color[3] / 255.0))
+    image.paste(Image.fromarray(pixels, "RGBA"), bounds[:2])
+    return bounds
@@ -1,10 +1,22 @@
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import copy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import os
+import shutil
+import threading
+import weakref
 
 from PIL import ImageChops
 
+from .diagnostics import app_data_dir
 from .layer import clone_layer_state
+from .patchstore import StoredImage
+from .tilestore import PixelTiles
+from .tiles import clip_bounds
+
+
+DEFAULT_HISTORY_MEMORY_BUDGET = 512 * 1024 * 1024
 
 
 @dataclass
@@ -24,6 +36,7 @@ class LayerMetadata:
     group_expanded: bool
     vector_shape: dict | None
     text_item: dict | None
+    offset: tuple = (0, 0)
 
 
 @dataclass
@@ -52,6 +65,7 @@ def _metadata(layer) -> LayerMetadata:
         layer.group_expanded,
         copy.deepcopy(layer.vector_shape),
         copy.deepcopy(layer.text_item),
+        tuple(layer.offset),
     )
 
 
@@ -71,6 +85,7 @@ def _apply_metadata(layer, metadata: LayerMetadata):
     layer.group_expanded = metadata.group_expanded
     layer.vector_shape = copy.deepcopy(metadata.vector_shape)
     layer.text_item = copy.deepcopy(metadata.text_item)
+    layer.offset = metadata.offset
 
 
 def _same_mask(before, after):
@@ -79,20 +94,125 @@ def _same_mask(before, after):
     return before.mask.size == after.mask.size and ImageChops.difference(before.mask, after.mask).getbbox() is None
 
 
+def _changed_bounds(before, after, bounds=None):
+    if bounds is None:
+        return before.pixel_tiles().difference_bbox(after.pixel_tiles())
+    width, height = after.size
+    bounds = clip_bounds(bounds, width, height)
+    if bounds is None:
+        return None
+    changed = ImageChops.difference(before.crop_image(bounds), after.crop_image(bounds)).getbbox(alpha_only=False)
+    if changed is None:
+        return None
+    return changed[0] + bounds[0], changed[1] + bounds[1], changed[2] + bounds[0], changed[3] + bounds[1]
+
+
+def _buffer_nbytes(buffer) -> int:
+    if isinstance(buffer, StoredImage):
+        return buffer.nbytes
+    return len(buffer.getbands()) * buffer.width * buffer.height
+
+
+def _layer_buffers(layers):
+    """Yield the tile images and masks held by ``layers``; shared ones are the same objects."""
+    for layer in layers:
+        yield from layer.pixel_tiles().tiles.values()
+        if layer.mask is not None:
+            yield layer.mask
+
+
+def _live_tiles(layers):
+    return [layer.pixel_tiles() for layer in layers]
+
+
+_snapshot_lock = threading.Lock()
+
+
+def _with_tiles(layer, tiles: dict):
+    pixel_tiles = layer.pixel_tiles()
+    return clone_layer_state(layer, PixelTiles(pixel_tiles.size, pixel_tiles.mode, tiles, pixel_tiles.tile_size, pixel_tiles.info))
+
+
+def _paged_in(slots: dict, stored: dict) -> dict:
+    """Return snapshot ``slots`` with the tiles moved into ``stored`` loaded back in."""
+    if not stored:
+        return slots
+    loaded = {}
+    for (slot, key), image in stored.items():
+        loaded.setdefault(slot, {})[key] = image.load()
+    slots = dict(slots)
+    for slot, tiles in loaded.items():
+        slots[slot] = _with_tiles(slots[slot], {**slots[slot].pixel_tiles().tiles, **tiles})
+    return slots
+
+
+def _stored_out(slots: dict, stored: dict, store):
+    """Swap snapshot tiles for the ``StoredImage`` that ``store(tile)`` returns; None keeps a tile in memory."""
+    slots = dict(slots)
+    stored = dict(stored)
+    for slot, layer in slots.items():
+        tiles = layer.pixel_tiles().tiles
+        kept = {}
+        for key, tile in tiles.items():
+            image = store(tile)
+            if image is None:
+                kept[key] = tile
+            else:
+                stored[(slot, key)] = image
+        if len(kept) != len(tiles):
+            slots[slot] = _with_tiles(layer, kept)
+    return slots, stored
+
+
+def _patch_images(patches):
+    for patch in patches:
+        for stored in (patch.before_crop, patch.after_crop):
+            if stored is not None:
+                yield stored
+
+
 @dataclass
 class HistoryCommand:
     layers: list
     active_index: int
+    stored: dict = field(default_factory=dict)
 
     @classmethod
-    def capture(cls, layers, active_index: int):
-        return cls([clone_layer_state(layer) for layer in layers], active_index)
+    def capture(cls, layers, active_index: int, reuse=()):
+        snapshots = {snapshot.revision: snapshot for snapshot in reuse}
+        return cls([snapshots.get(layer.revision) or clone_layer_state(layer) for layer in layers], active_index)
+
+    def snapshot_layers(self) -> list:
+        with _snapshot_lock:
+            layers, stored = self.layers, self.stored
+        return list(_paged_in(dict(enumerate(layers)), stored).values())
 
     def restore(self):
-        return [clone_layer_state(layer) for layer in self.layers], self.active_index
+        return [clone_layer_state(layer) for layer in self.snapshot_layers()], self.active_index
 
     def compact_against(self, after_layers, after_index: int):
-        return DiffHistoryCommand.capture(self.layers, self.active_index, after_layers, after_index)
+        return DiffHistoryCommand.capture(self.snapshot_layers(), self.active_index, after_layers, after_index)
+
+    def buffers(self) -> list:
+        with _snapshot_lock:
+            return [*_layer_buffers(self.layers), *self.stored.values()]
+
+    def store_tiles(self, store):
+        with _snapshot_lock:
+            slots, self.stored = _stored_out(dict(enumerate(self.layers)), self.stored, store)
+            self.layers = list(slots.values())
+
+    def compress(self):
+        for image in list(self.stored.values()):
+            image.compress()
+
+    def spill(self, directory):
+        for image in list(self.stored.values()):
+            image.spill(directory)
+
+    def discard(self):
+        # Stored tiles can be shared with neighbouring entries; they are released with the last of them.
+        pass
 
 
 @dataclass
@@ -102,24 +222,28 @@ class DiffHistoryCommand:
     patches: list[LayerPatch]
 
     @classmethod
-    def capture(cls, before_layers, before_index: int, after_layers, after_index: int):
+    def capture(cls, before_layers, before_index: int, after_layers, after_index: int, bounds=None):
         if len(before_layers) != len(after_layers):
             return PairedSnapshotCommand.capture(before_layers, before_index, after_layers, after_index)
 
         patches = []
         for before, after in zip(before_layers, after_layers):
-            if before.image.size != after.image.size:
+            if before.pixel_revision == after.pixel_revision:
+                patches.append(LayerPatch(_metadata(before), _metadata(after), None, None, None))
+                continue
+            if before.size != after.size or any(before.offset) or any(after.offset):
+                # Patches are pasted in layer pixels; a pending move offset would shift them.
                 return PairedSnapshotCommand.capture(before_layers, before_index, after_layers, after_index)
             if not _same_mask(before, after):
                 return PairedSnapshotCommand.capture(before_layers, before_index, after_layers, after_index)
-            bbox = ImageChops.difference(before.image, after.image).getbbox()
+            bbox = _changed_bounds(before, after, bounds)
             patches.append(
                 LayerPatch(
                     before_metadata=_metadata(before),
                     after_metadata=_metadata(after),
                     bbox=bbox,
-                    before_crop=before.image.crop(bbox) if bbox else None,
-                    after_crop=after.image.crop(bbox) if bbox else None,
+                    before_crop=StoredImage(before.crop_image(bbox)) if bbox else None,
+                    after_crop=StoredImage(after.crop_image(bbox)) if bbox else None,
                 )
             )
         return cls(before_index, after_index, patches)
@@ -127,6 +251,32 @@ class DiffHistoryCommand:
     def compact_against(self, after_layers, after_index: int):
         return self
 
+    @property
+    def nbytes(self) -> int:
+        return sum(stored.nbytes for stored in _patch_images(self.patches))
+
+    def buffers(self) -> list:
+        return list(_patch_images(self.patches))
+
+    def store_tiles(self, store):
+        pass
+
+    @property
+    def disk_bytes(self) -> int:
+        return sum(stored.disk_bytes for stored in _patch_images(self.patches))
+
+    def compress(self):
+        for stored in _patch_images(self.patches):
+            stored.compress()
+
+    def spill(self, directory):
+        for stored in _patch_images(self.patches):
+            stored.spill(directory)
+
+    def discard(self):
+        for stored in _patch_images(self.patches):
+            stored.discard()
+
     def undo(self, current_layers):
         return self._apply(current_layers, before=True), self.before_index
 
@@ -139,10 +289,49 @@ class DiffHistoryCommand:
             _apply_metadata(layer, patch.before_metadata if before else patch.after_metadata)
             crop = patch.before_crop if before else patch.after_crop
             if patch.bbox and crop is not None:
-                layer.image.paste(crop, patch.bbox)
+                layer.image.paste(crop.load(), patch.bbox)
+                layer.mark_pixels_changed(patch.bbox)
         return layers
 
 
+@dataclass
+class LayerEditCommand:
+    active_index: int
+    targets: dict
+    bounds: tuple | None = None
+    stored: dict = field(default_factory=dict)
+
+    @classmethod
+    def capture(cls, layers, active_index: int, targets, bounds=None):
+        return cls(active_index, {index: clone_layer_state(layers[index]) for index in targets}, bounds)
+
+    def compact_against(self, after_layers, after_index: int):
+        with _snapshot_lock:
+            targets, stored = self.targets, self.stored
+        targets = _paged_in(targets, stored)
+        before_layers = [targets.get(index, layer) for index, layer in enumerate(after_layers)]
+        return DiffHistoryCommand.capture(before_layers, self.active_index, after_layers, after_index, self.bounds)
+
+    def buffers(self) -> list:
+        with _snapshot_lock:
+            return [*_layer_buffers(self.targets.values()), *self.stored.values()]
+
+    def store_tiles(self, store):
+        with _snapshot_lock:
+            self.targets, self.stored = _stored_out(self.targets, self.stored, store)
+
+    def compress(self):
+        for image in list(self.stored.values()):
+            image.compress()
+
+    def spill(self, directory):
+        for image in list(self.stored.values()):
+            image.spill(directory)
+
+    def discard(self):
+        pass
+
+
 @dataclass
 class PairedSnapshotCommand:
     before: HistoryCommand
@@ -150,11 +339,32 @@ class PairedSnapshotCommand:
 
     @classmethod
     def capture(cls, before_layers, before_index: int, after_layers, after_index: int):
-        return cls(HistoryCommand.capture(before_layers, before_index), HistoryCommand.capture(after_layers, after_index))
+        return cls(
+            HistoryCommand.capture(before_layers, before_index, reuse=before_layers),
+            HistoryCommand.capture(after_layers, after_index),
+        )
 
     def compact_against(self, after_layers, after_index: int):
         return self
 
+    def buffers(self) -> list:
+        return self.before.buffers() + self.after.buffers()
+
+    def store_tiles(self, store):
+        self.before.store_tiles(store)
+        self.after.store_tiles(store)
+
+    def compress(self):
+        self.before.compress()
+        self.after.compress()
+
+    def spill(self, directory):
+        self.before.spill(directory)
+        self.after.spill(directory)
+
+    def discard(self):
+        pass
+
     def undo(self, current_layers):
         return self.before.restore()
 
@@ -162,30 +372,159 @@ class PairedSnapshotCommand:
         return self.after.restore()
 
 
+_history_executor = None
+_history_executor_lock = threading.Lock()
+
+
+def _maintenance_executor():
+    global _history_executor
+    with _history_executor_lock:
+        if _history_executor is None:
+            _history_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyshop-history")
+        return _history_executor
+
+
 class HistoryManager:
-    def __init__(self, max_states: int = 30):
-        self.undo_stack = deque(maxlen=max_states)
-        self.redo_stack = deque(maxlen=max_states)
+    """Undo and redo stacks kept under a memory budget.
+
+    Memory is counted per buffer, not per entry. A tile is counted once however
+    many entries hold it, and not at all while the live layers still hold it.
+    Maintenance compresses every entry except the latest undo step. Snapshot
+    tiles the live document no longer uses move into stored images shared by
+    the entries that hold them. Past the budget, entries are spilled to disk
+    oldest first.
+    """
+
+    def __init__(self, max_states: int = 30, memory_budget: int = DEFAULT_HISTORY_MEMORY_BUDGET, spill_dir=None):
+        self.max_states = max_states
+        self.memory_budget = memory_budget
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self._spill_dir = spill_dir
+        self._spill_cleanup = None
+        self._maintenance = None
+        self._live = []
 
     def save_state(self, layers, active_index):
+        previous = self.undo_stack[-1] if self.undo_stack else None
+        reuse = previous.layers if isinstance(previous, HistoryCommand) else ()
         self._compact_latest(layers, active_index)
-        self.undo_stack.append(HistoryCommand.capture(layers, active_index))
-        self.redo_stack.clear()
+        self._push(self.undo_stack, HistoryCommand.capture(layers, active_index, reuse))
+        self._clear_redo()
+        self._live = _live_tiles(layers)
+        self._schedule_maintenance()
+
+    def save_layer_state(self, layers, active_index, targets, bounds=None):
+        self._compact_latest(layers, active_index)
+        self._push(self.undo_stack, LayerEditCommand.capture(layers, active_index, targets, bounds))
+        self._clear_redo()
+        self._live = _live_tiles(layers)
+        self._schedule_maintenance()
+
+    def set_latest_bounds(self, bounds):
+        command = self.undo_stack[-1] if self.undo_stack else None
+        if isinstance(command, LayerEditCommand):
+            command.bounds = bounds
 
     def undo(self, current_layers, current_index):
         if not self.undo_stack:
             return None, None
         command = self.undo_stack.pop().compact_against(current_layers, current_index)
-        self.redo_stack.append(command)
-        return command.undo(current_layers)
+        self._push(self.redo_stack, command)
+        layers, index = command.undo(current_layers)
+        self._live = _live_tiles(layers)
+        self._schedule_maintenance()
+        return layers, index
 
     def redo(self, current_layers, current_index):
         if not self.redo_stack:
             return None, None
         command = self.redo_stack.pop()
-        self.undo_stack.append(command)
-        return command.redo(current_layers)
+        self._push(self.undo_stack, command)
+        layers, index = command.redo(current_layers)
+        self._live = _live_tiles(layers)
+        return layers, index
+
+    def memory_usage(self, live_layers=None) -> int:
+        """Bytes held only by history: pass the current layers to exclude tiles they still share."""
+        live = self._live if live_layers is None else _live_tiles(live_layers)
+        return self._usage(self._commands(), live)
+
+    def disk_usage(self) -> int:
+        seen = set()
+        total = 0
+        for buffer in [buffer for command in self._commands() for buffer in command.buffers()]:
+            if isinstance(buffer, StoredImage) and id(buffer) not in seen:
+                seen.add(id(buffer))
+                total += buffer.disk_bytes
+        return total
+
+    def flush(self):
+        if self._maintenance is not None:
+            self._maintenance.result()
+
+    def spill_directory(self):
+        if self._spill_dir is None:
+            self._spill_dir = app_data_dir() / "history" / f"{os.getpid()}-{id(self):x}"
+            self._spill_cleanup = weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+        return self._spill_dir
+
+    def _commands(self):
+        return list(self.undo_stack) + list(self.redo_stack)
+
+    @staticmethod
+    def _usage(commands, live) -> int:
+        # The buffer list keeps every object alive, so ids stay unique while they are compared.
+        buffers = [buffer for command in commands for buffer in command.buffers()]
+        seen = {id(tile) for tiles in live for tile in tiles.tiles.values()}
+        total = 0
+        for buffer in buffers:
+            if id(buffer) not in seen:
+                seen.add(id(buffer))
+                total += _buffer_nbytes(buffer)
+        return total
+
+    def _push(self, stack, command):
+        while len(stack) >= self.max_states:
+            stack.popleft().discard()
+        stack.append(command)
+
+    def _clear_redo(self):
+        while self.redo_stack:
+            self.redo_stack.pop().discard()
 
     def _compact_latest(self, layers, active_index):
         if self.undo_stack:
             self.undo_stack[-1] = self.undo_stack[-1].compact_against(layers, active_index)
+
+    def _schedule_maintenance(self):
+        pending = self._maintenance
+        if pending is None or pending.running() or pending.done():
+            self._maintenance = _maintenance_executor().submit(self._maintain)
+
+    def _maintain(self):
+        undo = list(self.undo_stack)
+        redo = list(self.redo_stack)
+        live = self._live
+        older = undo[:-1] + redo[::-1]
+        pinned = {id(tile): tile for tiles in live for tile in tiles.tiles.values()}
+        pinned.update((id(buffer), buffer) for command in undo[-1:] for buffer in command.buffers())
+        stored = {}
+
+        def store(tile):
+            if id(tile) in pinned:
+                return None
+            if id(tile) not in stored:
+                stored[id(tile)] = tile, StoredImage(tile)
+            return stored[id(tile)][1]
+
+        for command in older:
+            command.store_tiles(store)
+            command.compress()
+        stored.clear()
+        usage = self._usage(undo + redo, live)
+        for command in older:
+            if usage <= self.memory_budget:
+                break
+            command.spill(self.spill_directory())
+            usage = self._usage(undo + redo, live)
@@ -1,7 +1,40 @@
 import copy
+import itertools
 
 from PIL import Image
 
+from .tilestore import PixelTiles
+
+
+_layer_ids = itertools.count(1)
+_revisions = itertools.count(1)
+_UNSET = object()
+
+METADATA_FIELDS = frozenset(
+    {
+        "name",
+        "visible",
+        "opacity",
+        "blend_mode",
+        "locked",
+        "mask_density",
+        "mask_feather",
+        "clipping",
+        "adjustment",
+        "effect",
+        "is_group",
+        "group_id",
+        "group_expanded",
+        "vector_shape",
+        "text_item",
+        "offset",
+    }
+)
+
+
+def next_revision() -> int:
+    return next(_revisions)
+
 
 class Layer:
     BLEND_MODES = [
@@ -33,7 +66,15 @@ class Layer:
         "Luminosity",
     ]
 
-    def __init__(self, name: str = "Layer", width: int = 800, height: int = 600, image=None):
+    def __init__(self, name: str = "Layer", width: int = 800, height: int = 600, image=None, tiles=None):
+        self.uid = next(_layer_ids)
+        self.pixel_revision = 0
+        self.metadata_revision = 0
+        self._image = None
+        self._tiles = None
+        self._tiles_revision = None
+        self._dirty_tiles = None
+        self._mask = None
         self.name = name
         self.visible = True
         self.opacity = 255
@@ -50,21 +91,99 @@ class Layer:
         self.group_expanded = True
         self.vector_shape = None
         self.text_item = None
-        if image is not None:
+        self.offset = (0, 0)
+        if tiles is not None:
+            self._tiles = tiles
+            self.mark_pixels_changed()
+            self._tiles_revision = self.pixel_revision
+        elif image is not None:
             self.image = image.convert("RGBA")
             self.image.info.update(image.info)
         else:
             self.image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
 
+    @property
+    def image(self):
+        if self._image is None and self._tiles is not None:
+            self._image = self._tiles.to_image()
+            self._dirty_tiles = set()
+        return self._image
+
+    @image.setter
+    def image(self, value):
+        self._image = value
+        self.mark_pixels_changed()
+
+    @property
+    def size(self):
+        return self._image.size if self._image is not None else self._tiles.size
+
+    def crop_image(self, crop_box):
+        dx, dy = self.offset
+        if dx or dy:
+            left, top, right, bottom = crop_box
+            crop_box = left - dx, top - dy, right - dx, bottom - dy
+        if self._image is None and self._tiles is not None:
+            return self._tiles.crop(crop_box)
+        return self._image.crop(crop_box)
+
+    def commit_offset(self):
+        dx, dy = self.offset
+        if not (dx or dy):
+            return None
+        width, height = self.size
+        image = self.crop_image((0, 0, width, height))
+        image.info.update(self._image.info if self._image is not None else self._tiles.info)
+        self.offset = (0, 0)
+        self.image = image
+        return image.getbbox()
+
+    def pixel_tiles(self) -> PixelTiles:
+        if self._tiles_revision != self.pixel_revision:
+            if self._image is not None:
+                self._tiles = PixelTiles.from_image(self._image, self._tiles, self._dirty_tiles)
+                self._dirty_tiles = set()
+            self._tiles_revision = self.pixel_revision
+        return self._tiles
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @mask.setter
+    def mask(self, value):
+        self._mask = value
+        self.pixel_revision = next_revision()
+
+    def __setattr__(self, name, value):
+        if name in METADATA_FIELDS and self.__dict__.get(name, _UNSET) != value:
+            object.__setattr__(self, name, value)
+            object.__setattr__(self, "metadata_revision", next_revision())
+            return
+        object.__setattr__(self, name, value)
+
+    @property
+    def revision(self):
+        return self.pixel_revision, self.metadata_revision
+
+    def mark_pixels_changed(self, bounds=None):
+        self.pixel_revision = next_revision()
+        if bounds is None or self._tiles is None:
+            self._dirty_tiles = None
+        elif self._dirty_tiles is not None:
+            self._dirty_tiles |= self._tiles.tile_keys(bounds)
+
+    def mark_metadata_changed(self):
+        self.metadata_revision = next_revision()
+
     def copy(self):
         layer = clone_layer_state(self)
         layer.name = self.name + " copy"
         return layer
 
 
-def clone_layer_state(layer: Layer) -> Layer:
-    snapshot = Layer(layer.name)
-    snapshot.image = layer.image.copy()
+def clone_layer_state(layer: Layer, tiles: PixelTiles | None = None) -> Layer:
+    snapshot = Layer(layer.name, tiles=tiles if tiles is not None else layer.pixel_tiles())
     snapshot.visible = layer.visible
     snapshot.opacity = layer.opacity
     snapshot.blend_mode = layer.blend_mode
@@ -80,4 +199,8 @@ def clone_layer_state(layer: Layer) -> Layer:
     snapshot.group_expanded = layer.group_expanded
     snapshot.vector_shape = copy.deepcopy(layer.vector_shape)
     snapshot.text_item = copy.deepcopy(layer.text_item)
+    snapshot.offset = layer.offset
+    snapshot.pixel_revision = layer.pixel_revision
+    snapshot._tiles_revision = layer.pixel_revision
+    snapshot.metadata_revision = layer.metadata_revision
     return snapshot
@@ -0,0 +1,77 @@
+import threading
+import uuid
+import weakref
+import zlib
+from pathlib import Path
+
+from PIL import Image
+
+
+class StoredImage:
+    def __init__(self, image: Image.Image):
+        self.mode = image.mode
+        self.size = image.size
+        self._image = image
+        self._data = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._image is not None:
+            return "image"
+        if self._data is not None:
+            return "compressed"
+        return "spilled"
+
+    @property
+    def nbytes(self) -> int:
+        image, data = self._image, self._data
+        if image is not None:
+            return len(image.getbands()) * image.width * image.height
+        if data is not None:
+            return len(data)
+        return 0
+
+    @property
+    def disk_bytes(self) -> int:
+        path = self._path
+        return path.stat().st_size if path is not None and path.exists() else 0
+
+    def load(self) -> Image.Image:
+        with self._lock:
+            if self._image is not None:
+                return self._image
+            data = self._data if self._data is not None else self._path.read_bytes()
+        return Image.frombytes(self.mode, self.size, zlib.decompress(data))
+
+    def compress(self, level: int = 1):
+        image = self._image
+        if image is None:
+            return
+        data = zlib.compress(image.tobytes(), level)
+        with self._lock:
+            if self._image is image:
+                self._data = data
+                self._image = None
+
+    def spill(self, directory: Path):
+        self.compress()
+        with self._lock:
+            if self._data is None:
+                return
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{uuid.uuid4().hex}.patch"
+            path.write_bytes(self._data)
+            self._path = path
+            self._data = None
+            # Images can be shared by several history entries; the file goes with the last of them.
+            self._cleanup = weakref.finalize(self, path.unlink, True)
+
+    def discard(self):
+        with self._lock:
+            path = self._path
+            self._path = None
+        if path is not None:
+            self._cleanup.detach()
+            path.unlink(missing_ok=True)
@@ -2,7 +2,9 @@ import base64
 import json
 import os
 import tempfile
+import threading
 import zipfile
+from collections import OrderedDict
 from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
@@ -17,12 +19,52 @@ from .macros import macro_steps_from_records, macro_steps_to_records
 PROJECT_FILE_SUFFIX = ".pyshop"
 PROJECT_FORMAT_VERSION = 1
 PROJECT_MANIFEST_NAME = "manifest.json"
+ENCODED_LAYER_CACHE_BYTES = 256 * 1024 * 1024
 
 
 class ProjectFormatError(RuntimeError):
     pass
 
 
+class EncodedLayerCache:
+    """PNG bytes of saved layer pixels and masks, keyed by pixel revision.
+
+    The editor keeps one per open document so saves and autosaves only
+    re-encode layers that changed, and clears it when the document is
+    replaced. Entries are dropped oldest-first past ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int = ENCODED_LAYER_CACHE_BYTES):
+        self._entries = OrderedDict()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+    def encode(self, layer, attribute: str, mode: str) -> bytes:
+        size = layer.size if attribute == "image" else layer.mask.size
+        key = (attribute, layer.pixel_revision, size)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+        data = _image_png_bytes(getattr(layer, attribute), mode)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= len(previous)
+            self._entries[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes and self._entries:
+                self.nbytes -= len(self._entries.popitem(last=False)[1])
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
 @dataclass
 class ProjectState:
     layers: list
@@ -49,6 +91,7 @@ def save_project(
     macro_steps=None,
     color_profile: bytes | None = None,
     max_pixels: int = MAX_DOCUMENT_PIXELS,
+    encoded_layers: EncodedLayerCache | None = None,
 ):
     if not layers:
         raise ProjectFormatError("Cannot save an empty project.")
@@ -72,11 +115,11 @@ def save_project(
         layer_records = []
         for index, layer in enumerate(layers):
             image_name = f"layers/{index:04d}.png"
-            archive.writestr(image_name, _image_png_bytes(layer.image, "RGBA"))
+            archive.writestr(image_name, _layer_png_bytes(layer, "image", "RGBA", encoded_layers))
             mask_name = None
             if layer.mask is not None:
                 mask_name = f"masks/{index:04d}.png"
-                archive.writestr(mask_name, _image_png_bytes(layer.mask, "L"))
+                archive.writestr(mask_name, _layer_png_bytes(layer, "mask", "L", encoded_layers))
             layer_records.append(_layer_record(layer, image_name, mask_name))
 
         selection_name = None
@@ -181,6 +224,12 @@ def _image_png_bytes(image, mode: str) -> bytes:
     return buffer.getvalue()
 
 
+def _layer_png_bytes(layer, attribute: str, mode: str, encoded_layers=None) -> bytes:
+    if encoded_layers is None:
+        return _image_png_bytes(getattr(layer, attribute), mode)
+    return encoded_layers.encode(layer, attribute, mode)
+
+
 def _encode_bytes(value: bytes | None) -> str | None:
     if value is None:
         return None
@@ -1,35 +1,83 @@
-from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+import numpy as np
+from PIL import Image, ImageFilter
 
+from .brush import BrushSettings, brush_tip, iter_brush_dabs
+from .tiles import clip_bounds, union_bounds
 
-def apply_retouch_dab(image: Image.Image, x: int, y: int, size: int, mode: str):
-    if size <= 0:
-        return
-    half = max(1, size // 2)
-    box = (
-        max(0, x - half),
-        max(0, y - half),
-        min(image.width, x + half + 1),
-        min(image.height, y + half + 1),
-    )
-    if box[0] >= box[2] or box[1] >= box[3]:
-        return
-
-    patch = image.crop(box)
+
+RETOUCH_MODES = ("blur", "sharpen_tool", "healing", "dodge", "burn", "sponge")
+SPONGE_SATURATION = 0.65
+_TONE_LUTS = {
+    "dodge": np.clip(np.arange(256) * 1.18 + 0.5, 0, 255).astype(np.uint8),
+    "burn": np.clip(np.arange(256) * 0.82 + 0.5, 0, 255).astype(np.uint8),
+}
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _blur_radius(size: int) -> int:
+    return max(1, size // 8)
+
+
+def _filter_apron(mode: str, size: int) -> int:
     if mode == "blur":
-        patch = patch.filter(ImageFilter.GaussianBlur(max(1, size // 8)))
-    elif mode == "sharpen_tool":
-        patch = patch.filter(ImageFilter.SHARPEN)
-    elif mode == "healing":
-        patch = patch.filter(ImageFilter.MedianFilter(3))
-    elif mode == "dodge":
-        patch = ImageEnhance.Brightness(patch).enhance(1.18)
-    elif mode == "burn":
-        patch = ImageEnhance.Brightness(patch).enhance(0.82)
-    elif mode == "sponge":
-        patch = ImageEnhance.Color(patch).enhance(0.65)
+        return _blur_radius(size) * 2
+    if mode in ("sharpen_tool", "healing"):
+        return 1
+    return 0
+
+
+def _retouched_pixels(patch: Image.Image, mode: str, size: int):
+    if mode == "blur":
+        return np.asarray(patch.filter(ImageFilter.GaussianBlur(_blur_radius(size))))
+    if mode == "sharpen_tool":
+        return np.asarray(patch.filter(ImageFilter.SHARPEN))
+    if mode == "healing":
+        return np.asarray(patch.filter(ImageFilter.MedianFilter(3)))
+    pixels = np.array(patch)
+    if mode in _TONE_LUTS:
+        pixels[..., :3] = _TONE_LUTS[mode][pixels[..., :3]]
     else:
-        return
+        rgb = pixels[..., :3].astype(np.float32)
+        gray = (rgb @ _LUMA)[..., None]
+        pixels[..., :3] = np.clip(gray + (rgb - gray) * SPONGE_SATURATION + 0.5, 0, 255)
+    return pixels
+
+
+def apply_retouch_stroke(image: Image.Image, x1: int, y1: int, x2: int, y2: int, settings: BrushSettings, mode: str, pressure: float = 1.0):
+    """Retouch one stroke segment: filter its union box once and blend through the combined dab coverage."""
+    if mode not in RETOUCH_MODES or settings.size <= 0:
+        return None
+    dabs = []
+    dirty = None
+    largest = 0
+    for x, y, size, _index in iter_brush_dabs(x1, y1, x2, y2, settings, pressure):
+        stamp, left, top = brush_tip(max(2, size), settings.hardness, (0, 0), settings.angle, settings.roundness)
+        left, top = x + left, y + top
+        bounds = clip_bounds((left, top, left + stamp.shape[1], top + stamp.shape[0]), image.width, image.height)
+        if bounds is None:
+            continue
+        dabs.append((stamp, left, top, bounds))
+        dirty = union_bounds(dirty, bounds)
+        largest = max(largest, size)
+    if dirty is None:
+        return None
+
+    coverage = np.zeros((dirty[3] - dirty[1], dirty[2] - dirty[0]), dtype=np.float32)
+    for stamp, left, top, bounds in dabs:
+        target = coverage[bounds[1] - dirty[1]:bounds[3] - dirty[1], bounds[0] - dirty[0]:bounds[2] - dirty[0]]
+        np.maximum(target, stamp[bounds[1] - top:bounds[3] - top, bounds[0] - left:bounds[2] - left], out=target)
 
-    mask = Image.new("L", patch.size, 0)
-    ImageDraw.Draw(mask).ellipse((0, 0, patch.width - 1, patch.height - 1), fill=255)
-    image.paste(patch, box, mask)
+    apron = _filter_apron(mode, largest)
+    region = clip_bounds((dirty[0] - apron, dirty[1] - apron, dirty[2] + apron, dirty[3] + apron), image.width, image.height)
+    filtered = _retouched_pixels(image.crop(region), mode, largest)
+    filtered = filtered[dirty[1] - region[1]:dirty[3] - region[1], dirty[0] - region[0]:dirty[2] - region[0]]
+    original = np.asarray(image.crop(dirty)).astype(np.float32)
+    blended = original + (filtered - original) * coverage[..., None]
+    image.paste(Image.fromarray(np.clip(blended + 0.5, 0, 255).astype(np.uint8), "RGBA"), dirty[:2])
+    return dirty
+
+
+def apply_retouch_dab(image: Image.Image, x: int, y: int, size: int, mode: str):
+    if size <= 0:
+        return None
+    return apply_retouch_stroke(image, x, y, x, y, BrushSettings(size=size), mode)
@@ -1,42 +1,341 @@
 import numpy as np
-from PyQt5.QtGui import QPainterPath
+from PIL import Image, ImageChops, ImageDraw
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QPainterPath, QPolygonF
 
+from .tiles import clip_bounds, intersect_bounds, union_bounds
 
-def build_marching_ants_path(mask_np):
-    h, w = mask_np.shape
-    if mask_np.max() == 0:
-        return None
-    binary = (mask_np > 127).astype(np.uint8)
-    path = QPainterPath()
 
-    padded_h = np.pad(binary, ((1, 1), (0, 0)), mode="constant", constant_values=0)
-    diff_h = padded_h[1:, :] != padded_h[:-1, :]
+ANTS_TILE_SIZE = 256
 
-    for y in range(h + 1):
-        row = diff_h[y]
-        if not np.any(row):
-            continue
-        padded_row = np.concatenate(([0], row.astype(np.uint8), [0]))
-        row_diff = np.diff(padded_row)
-        starts = np.where(row_diff == 1)[0]
-        ends = np.where(row_diff == -1)[0]
-        for start, end in zip(starts, ends):
-            path.moveTo(start, y)
-            path.lineTo(end, y)
-
-    padded_v = np.pad(binary, ((0, 0), (1, 1)), mode="constant", constant_values=0)
-    diff_v = padded_v[:, 1:] != padded_v[:, :-1]
-
-    for x in range(w + 1):
-        col = diff_v[:, x]
-        if not np.any(col):
+
+def _directed_runs(steps):
+    """Split each line of -1/0/+1 edge steps into maximal runs of one non-zero value."""
+    lines, length = steps.shape
+    padded = np.zeros((lines, length + 2), dtype=np.int8)
+    padded[:, 1:-1] = steps
+    rows, cuts = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    same_line = rows[:-1] == rows[1:]
+    rows, starts, ends = rows[:-1][same_line], cuts[:-1][same_line], cuts[1:][same_line]
+    values = steps[rows, starts]
+    keep = values != 0
+    return rows[keep], starts[keep], ends[keep], values[keep]
+
+
+def _successors(end_keys, end_preferred, start_keys, start_flags):
+    """Match each run end to the run starting at the same vertex, preferring a right turn at saddles."""
+    result = np.full(len(end_keys), -1, dtype=np.int64)
+    if not len(start_keys) or not len(end_keys):
+        return result
+    keys = start_keys * 2 + start_flags
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    for preferred in (end_preferred, 1 - end_preferred):
+        wanted = end_keys * 2 + preferred
+        found = np.minimum(np.searchsorted(sorted_keys, wanted), len(sorted_keys) - 1)
+        hit = (result < 0) & (sorted_keys[found] == wanted)
+        result[hit] = order[found[hit]]
+    return result
+
+
+def trace_selection_contours(binary, bounds=None):
+    """Trace the pixel-edge outline of ``binary`` inside ``bounds`` into merged polylines.
+
+    Returns ``(points, closed)`` pairs with integer (x, y) lattice vertices. Each
+    boundary edge belongs to the tile holding the pixel below or right of it, so
+    outlines that cross ``bounds`` come back as open chains.
+    """
+    height, width = binary.shape
+    left, top, right, bottom = bounds or (0, 0, width, height)
+    line_bottom = bottom + 1 if bottom == height else bottom
+    line_right = right + 1 if right == width else right
+    window = np.zeros((line_bottom - top + 1, line_right - left + 1), dtype=np.int8)
+    window[max(0, 1 - top):min(height, line_bottom) - top + 1, max(0, 1 - left):min(width, line_right) - left + 1] = binary[
+        max(0, top - 1):min(height, line_bottom), max(0, left - 1):min(width, line_right)
+    ]
+
+    rows, columns = bottom - top, right - left
+    horizontal = window[1:, 1:columns + 1] - window[:-1, 1:columns + 1]
+    vertical = window[1:rows + 1, 1:] - window[1:rows + 1, :-1]
+    h_lines, h_starts, h_ends, h_values = _directed_runs(horizontal)
+    v_lines, v_starts, v_ends, v_values = _directed_runs(vertical.T)
+    if not len(h_lines) and not len(v_lines):
+        return []
+
+    stride = width + 1
+    h_y = h_lines + top
+    h_forward = h_values > 0
+    h_from_x = np.where(h_forward, h_starts, h_ends) + left
+    h_to_x = np.where(h_forward, h_ends, h_starts) + left
+    v_x = v_lines + left
+    v_forward = v_values < 0
+    v_from_y = np.where(v_forward, v_starts, v_ends) + top
+    v_to_y = np.where(v_forward, v_ends, v_starts) + top
+
+    h_next = _successors(h_y * stride + h_to_x, h_forward.astype(np.int64), v_from_y * stride + v_x, v_forward.astype(np.int64))
+    v_next = _successors(v_to_y * stride + v_x, (~v_forward).astype(np.int64), h_y * stride + h_from_x, h_forward.astype(np.int64))
+    count = len(h_lines)
+    successor = np.concatenate([np.where(h_next >= 0, h_next + count, -1), v_next])
+    starts = np.concatenate([np.stack([h_from_x, h_y], axis=1), np.stack([v_x, v_from_y], axis=1)])
+    ends = np.concatenate([np.stack([h_to_x, h_y], axis=1), np.stack([v_x, v_to_y], axis=1)])
+
+    has_predecessor = np.zeros(len(successor), dtype=bool)
+    has_predecessor[successor[successor >= 0]] = True
+    order = np.flatnonzero(~has_predecessor).tolist() + list(range(len(successor)))
+    visited = bytearray(len(successor))
+    successor = successor.tolist()
+    contours = []
+    for first in order:
+        if visited[first]:
             continue
-        padded_col = np.concatenate(([0], col.astype(np.uint8), [0]))
-        col_diff = np.diff(padded_col)
-        starts = np.where(col_diff == 1)[0]
-        ends = np.where(col_diff == -1)[0]
-        for start, end in zip(starts, ends):
-            path.moveTo(x, start)
-            path.lineTo(x, end)
+        chain = [first]
+        visited[first] = True
+        current = successor[first]
+        while current >= 0 and not visited[current]:
+            visited[current] = True
+            chain.append(current)
+            current = successor[current]
+        closed = current == first
+        points = starts[chain]
+        if not closed:
+            points = np.concatenate([points, ends[chain[-1]][None]])
+        contours.append((points, closed))
+    return contours
+
 
+def simplify_contours(contours, step: int = 1):
+    """Snap contour vertices to a ``step`` pixel grid and drop the points that collapse."""
+    if step <= 1:
+        return contours
+    simplified = []
+    for points, closed in contours:
+        snapped = np.round(points / step).astype(np.int64) * step
+        keep = np.ones(len(snapped), dtype=bool)
+        keep[1:] = np.any(snapped[1:] != snapped[:-1], axis=1)
+        snapped = snapped[keep]
+        if closed and len(snapped) > 1 and np.array_equal(snapped[0], snapped[-1]):
+            snapped = snapped[:-1]
+        if len(snapped) >= (3 if closed else 2):
+            simplified.append((snapped, closed))
+    return simplified
+
+
+def contours_path(contours, path: QPainterPath | None = None) -> QPainterPath:
+    path = path if path is not None else QPainterPath()
+    for points, closed in contours:
+        path.addPolygon(QPolygonF([QPointF(x, y) for x, y in points.tolist()]))
+        if closed:
+            path.closeSubpath()
     return path
+
+
+def _placed(binary, origin, frame):
+    """Return ``binary`` placed at document ``origin`` inside the document-space ``frame``."""
+    if (origin[0], origin[1], origin[0] + binary.shape[1], origin[1] + binary.shape[0]) == frame:
+        return binary
+    placed = np.zeros((frame[3] - frame[1], frame[2] - frame[0]), dtype=bool)
+    left, top = origin[0] - frame[0], origin[1] - frame[1]
+    placed[top:top + binary.shape[0], left:left + binary.shape[1]] = binary
+    return placed
+
+
+def changed_mask_bounds(binary, previous, origin=(0, 0), previous_origin=(0, 0)):
+    """Return the document-space tile-trace bounds affected by changing ``previous`` into ``binary``.
+
+    Each mask sits at its own document ``origin``; they are compared over the
+    union of their extents, so a mask whose bounds grew or shrank still only
+    reports the pixels that actually changed.
+    """
+    height, width = binary.shape
+    if previous is None:
+        return origin[0], origin[1], origin[0] + width + 1, origin[1] + height + 1
+    frame = union_bounds(
+        (origin[0], origin[1], origin[0] + width, origin[1] + height),
+        (previous_origin[0], previous_origin[1], previous_origin[0] + previous.shape[1], previous_origin[1] + previous.shape[0]),
+    )
+    changed = _placed(binary, origin, frame) != _placed(previous, previous_origin, frame)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(changed.any(axis=0))
+    return frame[0] + int(columns[0]), frame[1] + int(rows[0]), frame[0] + int(columns[-1]) + 2, frame[1] + int(rows[-1]) + 2
+
+
+def update_contour_tiles(binary, previous=None, tiles=None, tile_size: int = ANTS_TILE_SIZE, origin=(0, 0), previous_origin=(0, 0)):
+    """Retrace only the tiles whose outline can differ between ``previous`` and ``binary``.
+
+    Tiles are keyed by their document-space origin on a fixed ``tile_size``
+    grid and hold contours in document coordinates, so they stay valid when
+    the mask's ``origin`` or size changes between calls.
+    """
+    height, width = binary.shape
+    tiles = dict(tiles or {}) if previous is not None else {}
+    changed = changed_mask_bounds(binary, previous, origin, previous_origin)
+    if changed is None:
+        return tiles
+    frame = np.zeros((height + 1, width + 1), dtype=bool)
+    frame[:height, :width] = binary
+    offset = np.array(origin)
+    for ty in range(changed[1] // tile_size * tile_size, changed[3], tile_size):
+        for tx in range(changed[0] // tile_size * tile_size, changed[2], tile_size):
+            box = clip_bounds((tx - origin[0], ty - origin[1], tx + tile_size - origin[0], ty + tile_size - origin[1]), width + 1, height + 1)
+            contours = trace_selection_contours(frame, box) if box is not None else []
+            if contours:
+                tiles[(tx, ty)] = [(points + offset, closed) for points, closed in contours]
+            else:
+                tiles.pop((tx, ty), None)
+    return tiles
+
+
+def build_marching_ants_path(mask_np, step: int = 1):
+    binary = mask_np > 127
+    if not binary.any():
+        return None
+    return contours_path(simplify_contours(trace_selection_contours(binary), step))
+
+
+def apply_in_selection(image: Image.Image, func, selection, apron: int = 0):
+    """Run ``func`` over the selection bounds only and blend the result back through the cropped mask.
+
+    ``apron`` extra pixels around the bounds are handed to ``func`` so neighbourhood
+    filters see real context at the edges. Returns the dirty bounds.
+    """
+    bounds = selection.bounds
+    if bounds is None:
+        return None
+    left, top, right, bottom = bounds
+    region = clip_bounds((left - apron, top - apron, right + apron, bottom + apron), image.width, image.height)
+    adjusted = func(image.crop(region))
+    if region != bounds:
+        adjusted = adjusted.crop((left - region[0], top - region[1], right - region[0], bottom - region[1]))
+    image.paste(adjusted, bounds[:2], selection.mask)
+    return bounds
+
+
+class Selection:
+    """A selection stored as its bounds plus an ``"L"`` mask cropped to them.
+
+    ``mask`` is None when every pixel inside ``bounds`` is fully selected, so marquee
+    rectangles carry no per-pixel data; ``bounds`` is None for an empty selection.
+    """
+
+    __slots__ = ("size", "bounds", "mask", "_image")
+
+    def __init__(self, size, bounds=None, mask=None):
+        self.size = tuple(size)
+        self.bounds = bounds
+        self.mask = mask
+        self._image = None
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Build a selection from a full-size ``"L"`` image or 2-D array, trimmed to its non-zero pixels."""
+        if isinstance(mask, Selection):
+            return mask
+        if isinstance(mask, np.ndarray):
+            height, width = mask.shape
+            rows = np.flatnonzero(mask.any(axis=1))
+            if not len(rows):
+                return cls((width, height))
+            columns = np.flatnonzero(mask.any(axis=0))
+            bounds = int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+            cropped = mask[bounds[1]:bounds[3], bounds[0]:bounds[2]]
+            cropped = cropped.astype(np.uint8) * 255 if cropped.dtype == bool else cropped.astype(np.uint8)
+            return cls._normalized((width, height), bounds, Image.fromarray(cropped, "L"))
+        mask = mask if mask.mode == "L" else mask.convert("L")
+        bounds = mask.getbbox()
+        if bounds is None:
+            return cls(mask.size)
+        return cls._normalized(mask.size, bounds, mask.crop(bounds))
+
+    @classmethod
+    def from_shape(cls, size, box, shape: str = "rectangle"):
+        """Select a rectangle or ellipse drawn with ImageDraw's inclusive ``box`` convention."""
+        left, top, right, bottom = (int(value) for value in box)
+        region = clip_bounds((left, top, right + 1, bottom + 1), *size)
+        if region is None:
+            return cls(size)
+        mask = Image.new("L", (region[2] - region[0], region[3] - region[1]), 0)
+        local = (left - region[0], top - region[1], right - region[0], bottom - region[1])
+        if shape == "rectangle":
+            ImageDraw.Draw(mask).rectangle(local, fill=255)
+        else:
+            ImageDraw.Draw(mask).ellipse(local, fill=255)
+        return cls._normalized(size, region, mask)
+
+    @classmethod
+    def from_polygon(cls, size, points):
+        points = [(int(x), int(y)) for x, y in points]
+        xs = [x for x, _y in points]
+        ys = [y for _x, y in points]
+        region = clip_bounds((min(xs), min(ys), max(xs) + 1, max(ys) + 1), *size)
+        if region is None:
+            return cls(size)
+        mask = Image.new("L", (region[2] - region[0], region[3] - region[1]), 0)
+        ImageDraw.Draw(mask).polygon([(x - region[0], y - region[1]) for x, y in points], fill=255)
+        return cls._normalized(size, region, mask)
+
+    @classmethod
+    def _normalized(cls, size, bounds, mask):
+        trimmed = mask.getbbox()
+        if trimmed is None:
+            return cls(size)
+        if trimmed != (0, 0) + mask.size:
+            mask = mask.crop(trimmed)
+            bounds = bounds[0] + trimmed[0], bounds[1] + trimmed[1], bounds[0] + trimmed[2], bounds[1] + trimmed[3]
+        if mask.getextrema() == (255, 255):
+            mask = None
+        return cls(size, bounds, mask)
+
+    @property
+    def is_empty(self) -> bool:
+        return self.bounds is None
+
+    def crop(self, box) -> Image.Image:
+        """Return the selection values inside ``box`` as an ``"L"`` image of that size."""
+        left, top, right, bottom = box
+        if self.mask is not None and tuple(box) == self.bounds:
+            return self.mask.copy()
+        result = Image.new("L", (right - left, bottom - top), 0)
+        overlap = intersect_bounds(self.bounds, box)
+        if overlap is None:
+            return result
+        if self.mask is None:
+            result.paste(255, (overlap[0] - left, overlap[1] - top, overlap[2] - left, overlap[3] - top))
+        else:
+            x, y = self.bounds[:2]
+            result.paste(self.mask.crop((overlap[0] - x, overlap[1] - y, overlap[2] - x, overlap[3] - y)), (overlap[0] - left, overlap[1] - top))
+        return result
+
+    def to_image(self) -> Image.Image:
+        """Return the full-size mask, built once and shared; callers must not modify it."""
+        if self._image is None:
+            self._image = self.crop((0, 0) + self.size)
+        return self._image
+
+    def value_at(self, x: int, y: int) -> int:
+        if self.bounds is None or not (self.bounds[0] <= x < self.bounds[2] and self.bounds[1] <= y < self.bounds[3]):
+            return 0
+        if self.mask is None:
+            return 255
+        return self.mask.getpixel((x - self.bounds[0], y - self.bounds[1]))
+
+    def _combine(self, other, region, operation):
+        if region is None:
+            return Selection(self.size)
+        return Selection._normalized(self.size, region, operation(self.crop(region), other.crop(region)))
+
+    def union(self, other):
+        return self._combine(other, union_bounds(self.bounds, other.bounds), ImageChops.lighter)
+
+    def intersect(self, other):
+        return self._combine(other, intersect_bounds(self.bounds, other.bounds), ImageChops.darker)
+
+    def subtract(self, other):
+        return self._combine(other, self.bounds, lambda mine, theirs: ImageChops.darker(mine, ImageChops.invert(theirs)))
+
+    def invert(self):
+        full = (0, 0) + self.size
+        if self.bounds is None:
+            return Selection(self.size, full)
+        return Selection._normalized(self.size, full, ImageChops.invert(self.crop(full)))
@@ -3,6 +3,7 @@ import math
 
 
 DEFAULT_TILE_SIZE = 512
+MAX_TILE_LEVEL = 5
 
 
 @dataclass(frozen=True)
@@ -49,3 +50,43 @@ def iter_intersecting_tile_boxes(width: int, height: int, bounds, tile_size: int
     for y in range(start_y, bottom, tile_size):
         for x in range(start_x, right, tile_size):
             yield TileBox(x, y, min(tile_size, width - x), min(tile_size, height - y))
+
+
+def clip_bounds(bounds, width: int, height: int):
+    if bounds is None:
+        return None
+    left, top, right, bottom = bounds
+    left = max(0, min(width, math.floor(left)))
+    top = max(0, min(height, math.floor(top)))
+    right = max(0, min(width, math.ceil(right)))
+    bottom = max(0, min(height, math.ceil(bottom)))
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def union_bounds(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return (
+        min(first[0], second[0]),
+        min(first[1], second[1]),
+        max(first[2], second[2]),
+        max(first[3], second[3]),
+    )
+
+
+def intersect_bounds(first, second):
+    if first is None or second is None:
+        return None
+    left, top = max(first[0], second[0]), max(first[1], second[1])
+    right, bottom = min(first[2], second[2]), min(first[3], second[3])
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def bounds_intersect(first, second) -> bool:
+    return first[0] < second[2] and second[0] < first[2] and first[1] < second[3] and second[1] < first[3]
@@ -0,0 +1,78 @@
+from PIL import Image, ImageChops
+
+from .tiles import DEFAULT_TILE_SIZE, iter_intersecting_tile_boxes, iter_tile_boxes, union_bounds
+
+
+class PixelTiles:
+    __slots__ = ("size", "mode", "info", "tile_size", "tiles")
+
+    def __init__(self, size, mode: str, tiles: dict, tile_size: int = DEFAULT_TILE_SIZE, info=None):
+        self.size = size
+        self.mode = mode
+        self.tiles = tiles
+        self.tile_size = tile_size
+        self.info = dict(info or {})
+
+    @classmethod
+    def from_image(cls, image: Image.Image, previous=None, dirty=None, tile_size: int = DEFAULT_TILE_SIZE):
+        reuse = (
+            previous is not None
+            and dirty is not None
+            and previous.size == image.size
+            and previous.mode == image.mode
+            and previous.tile_size == tile_size
+        )
+        tiles = {}
+        for tile_box in iter_tile_boxes(image.width, image.height, tile_size):
+            key = tile_box.x, tile_box.y
+            if reuse and key not in dirty:
+                if key in previous.tiles:
+                    tiles[key] = previous.tiles[key]
+                continue
+            tile = image.crop(tile_box.as_crop_box())
+            if tile.getbbox(alpha_only=False) is not None:
+                tiles[key] = tile
+        return cls(image.size, image.mode, tiles, tile_size, image.info)
+
+    @property
+    def nbytes(self) -> int:
+        bands = Image.getmodebands(self.mode)
+        return sum(bands * tile.width * tile.height for tile in self.tiles.values())
+
+    def tile_keys(self, bounds):
+        width, height = self.size
+        return {(tile_box.x, tile_box.y) for tile_box in iter_intersecting_tile_boxes(width, height, bounds, self.tile_size)}
+
+    def to_image(self) -> Image.Image:
+        image = Image.new(self.mode, self.size)
+        for position, tile in self.tiles.items():
+            image.paste(tile, position)
+        image.info.update(self.info)
+        return image
+
+    def crop(self, crop_box) -> Image.Image:
+        left, top, right, bottom = crop_box
+        image = Image.new(self.mode, (right - left, bottom - top))
+        for x, y in self.tile_keys(crop_box):
+            tile = self.tiles.get((x, y))
+            if tile is None:
+                continue
+            region = max(left, x), max(top, y), min(right, x + tile.width), min(bottom, y + tile.height)
+            image.paste(tile.crop((region[0] - x, region[1] - y, region[2] - x, region[3] - y)), (region[0] - left, region[1] - top))
+        return image
+
+    def difference_bbox(self, other):
+        bbox = None
+        for key in self.tiles.keys() | other.tiles.keys():
+            before = self.tiles.get(key)
+            after = other.tiles.get(key)
+            if before is after:
+                continue
+            reference = before if before is not None else after
+            before = before if before is not None else Image.new(self.mode, reference.size)
+            after = after if after is not None else Image.new(self.mode, reference.size)
+            changed = ImageChops.difference(before, after).getbbox(alpha_only=False)
+            if changed is not None:
+                x, y = key
+                bbox = union_bounds(bbox, (changed[0] + x, changed[1] + y, changed[2] + x, changed[3] + y))
+        return bbox
@@ -1,9 +1,12 @@
 from dataclasses import dataclass
 
-from PIL import Image, ImageDraw
 from PyQt5.QtCore import QPointF, QRectF, Qt
 from PyQt5.QtGui import QColor
 
+from pyshop.core.compositor import layer_content_bounds
+from pyshop.core.selection import Selection
+from pyshop.core.tiles import clip_bounds, union_bounds
+
 
 @dataclass(frozen=True)
 class CanvasToolEvent:
@@ -41,13 +44,28 @@ def _save_history(canvas):
     canvas.editor.history.save_state(canvas.editor.layers, canvas.editor.active_layer_index)
 
 
+def _save_active_layer_history(canvas):
+    canvas.stroke_dirty = None
+    index = canvas.editor.active_layer_index
+    canvas.editor.history.save_layer_state(canvas.editor.layers, index, [index])
+
+
 def _left_button_down(event: CanvasToolEvent) -> bool:
     return bool((event.buttons or Qt.NoButton) & Qt.LeftButton)
 
 
+def _moved_bounds(layer, bounds):
+    if bounds is None:
+        return None
+    dx, dy = layer.offset
+    width, height = layer.size
+    return clip_bounds((bounds[0] + dx, bounds[1] + dy, bounds[2] + dx, bounds[3] + dy), width, height)
+
+
 class MoveToolHandler(CanvasToolHandler):
     def press(self, canvas, event):
         canvas.last_pos = event.image_pos
+        canvas.move_bounds = None
         canvas.drawing = True
         return True
 
@@ -57,14 +75,20 @@ class MoveToolHandler(CanvasToolHandler):
         layer = _active_layer(canvas)
         if not layer or layer.locked:
             return False
-        dx = event.image_pos.x() - canvas.last_pos.x()
-        dy = event.image_pos.y() - canvas.last_pos.y()
-        _save_history(canvas)
-        new_img = Image.new("RGBA", layer.image.size, (0, 0, 0, 0))
-        new_img.paste(layer.image, (int(dx), int(dy)))
-        layer.image = new_img
-        canvas.last_pos = event.image_pos
-        canvas.update()
+        if canvas.move_bounds is None:
+            _save_active_layer_history(canvas)
+            canvas.move_bounds = layer_content_bounds(layer)
+        previous = _moved_bounds(layer, canvas.move_bounds)
+        layer.offset = (int(event.image_pos.x() - canvas.last_pos.x()), int(event.image_pos.y() - canvas.last_pos.y()))
+        canvas.invalidate_image_rect(union_bounds(previous, _moved_bounds(layer, canvas.move_bounds)))
+        return True
+
+    def release(self, canvas, event):
+        layer = _active_layer(canvas)
+        if canvas.move_bounds is None or not layer:
+            return False
+        canvas.move_bounds = None
+        layer.commit_offset()
         return True
 
 
@@ -77,18 +101,16 @@ class StrokeToolHandler(CanvasToolHandler):
         layer = _active_layer(canvas)
         if not layer:
             return False
-        _save_history(canvas)
+        _save_active_layer_history(canvas)
         canvas.drawing = True
         canvas.last_pos = event.image_pos
         getattr(canvas, self.dab_method)(event.ix, event.iy)
-        canvas.update()
         return True
 
     def move(self, canvas, event):
         if not canvas.drawing or not _left_button_down(event):
             return False
         canvas.last_pos = getattr(canvas, self.line_method)(canvas.last_pos, event.image_pos)
-        canvas.update()
         return True
 
 
@@ -97,16 +119,15 @@ class FillToolHandler(CanvasToolHandler):
         layer = _active_layer(canvas)
         if not layer:
             return False
-        _save_history(canvas)
+        _save_active_layer_history(canvas)
         canvas._flood_fill(event.ix, event.iy)
-        canvas.update()
         return True
 
 
 class MagicWandToolHandler(CanvasToolHandler):
     def press(self, canvas, event):
         canvas._magic_wand_select(event.ix, event.iy)
-        canvas.update()
+        canvas.update_overlay()
         return True
 
 
@@ -127,7 +148,7 @@ class RectSelectionToolHandler(CanvasToolHandler):
         x1, y1 = canvas.selection_start.x(), canvas.selection_start.y()
         x2, y2 = event.image_pos.x(), event.image_pos.y()
         canvas.selection_rect = QRectF(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
-        canvas.update()
+        canvas.update_overlay()
         return True
 
     def release(self, canvas, event):
@@ -136,16 +157,9 @@ class RectSelectionToolHandler(CanvasToolHandler):
         layer = _active_layer(canvas)
         if not layer:
             return False
-        width, height = layer.image.size
-        mask = Image.new("L", (width, height), 0)
-        draw = ImageDraw.Draw(mask)
         rect = canvas.selection_rect
         box = (int(rect.x()), int(rect.y()), int(rect.x() + rect.width()), int(rect.y() + rect.height()))
-        if self.shape == "rectangle":
-            draw.rectangle(box, fill=255)
-        else:
-            draw.ellipse(box, fill=255)
-        canvas.set_selection_mask(mask)
+        canvas.set_selection_mask(Selection.from_shape(layer.image.size, box, self.shape))
         canvas.selection_rect = None
         canvas.drawing = False
         return True
@@ -161,7 +175,7 @@ class LassoToolHandler(CanvasToolHandler):
         if not canvas.drawing or not _left_button_down(event):
             return False
         canvas._lasso_points.append(event.image_pos)
-        canvas.update()
+        canvas.update_overlay()
         return True
 
     def release(self, canvas, event):
@@ -171,11 +185,8 @@ class LassoToolHandler(CanvasToolHandler):
         layer = _active_layer(canvas)
         if not layer:
             return False
-        width, height = layer.image.size
-        mask = Image.new("L", (width, height), 0)
-        points = [(int(point.x()), int(point.y())) for point in canvas._lasso_points]
-        ImageDraw.Draw(mask).polygon(points, fill=255)
-        canvas.set_selection_mask(mask)
+        points = [(point.x(), point.y()) for point in canvas._lasso_points]
+        canvas.set_selection_mask(Selection.from_polygon(layer.image.size, points))
         canvas.selection_rect = None
         canvas._lasso_points = []
         canvas.drawing = False
@@ -195,7 +206,7 @@ class CropToolHandler(CanvasToolHandler):
         x1, y1 = canvas.selection_start.x(), canvas.selection_start.y()
         x2, y2 = event.image_pos.x(), event.image_pos.y()
         canvas.crop_rect = QRectF(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
-        canvas.update()
+        canvas.update_overlay()
         return True
 
 
@@ -212,7 +223,7 @@ class ShapeToolHandler(CropToolHandler):
         x1, y1 = canvas.selection_start.x(), canvas.selection_start.y()
         x2, y2 = event.image_pos.x(), event.image_pos.y()
         canvas.shape_rect = QRectF(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
-        canvas.update()
+        canvas.update_overlay()
         return True
 
     def release(self, canvas, event):
@@ -244,18 +255,16 @@ class RetouchToolHandler(CanvasToolHandler):
         layer = _active_layer(canvas)
         if not layer:
             return False
-        _save_history(canvas)
+        _save_active_layer_history(canvas)
         canvas.drawing = True
         canvas.last_pos = event.image_pos
         canvas._draw_retouch(event.ix, event.iy, self.mode)
-        canvas.update()
         return True
 
     def move(self, canvas, event):
         if not canvas.drawing or not _left_button_down(event):
             return False
         canvas.last_pos = canvas._draw_retouch_line(canvas.last_pos, event.image_pos, self.mode)
-        canvas.update()
         return True
 
 
@@ -267,9 +276,9 @@ class EyedropperToolHandler(CanvasToolHandler):
         width, height = layer.image.size
         if not (0 <= event.ix < width and 0 <= event.iy < height):
             return False
-        composite = canvas.editor.get_composite()
-        if composite:
-            red, green, blue, _alpha = composite.getpixel((event.ix, event.iy))
+        color = canvas.editor.sample_color(event.ix, event.iy)
+        if color:
+            red, green, blue, _alpha = color
             canvas.color_picked.emit(QColor(red, green, blue))
         return True
 
@@ -282,7 +291,7 @@ class CloneStampToolHandler(CanvasToolHandler):
             return True
         if not canvas.editor.clone_source:
             return False
-        _save_history(canvas)
+        _save_active_layer_history(canvas)
         canvas.drawing = True
         canvas.last_pos = event.image_pos
         canvas._draw_clone_stamp(event.ix, event.iy)
@@ -293,7 +302,6 @@ class CloneStampToolHandler(CanvasToolHandler):
             return False
         canvas._draw_clone_stamp(event.ix, event.iy)
         canvas.last_pos = event.image_pos
-        canvas.update()
         return True
 
 
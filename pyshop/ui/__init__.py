@@ -1,6 +1,9 @@
 """Application shell, canvas, widgets, and shared UI helpers."""
 
 from .canvas_view import CanvasViewport
+from .display_tiles import DisplayTileCache
 from .guides import snap_coordinate, snap_point_to_guides
+from .marching_ants import MarchingAntsBuilder
+from .tile_queue import TileRenderQueue
 
-__all__ = ["CanvasViewport", "snap_coordinate", "snap_point_to_guides"]
+__all__ = ["CanvasViewport", "DisplayTileCache", "MarchingAntsBuilder", "TileRenderQueue", "snap_coordinate", "snap_point_to_guides"]
@@ -3,6 +3,8 @@ import math
 
 from PyQt5.QtCore import QPointF
 
+from pyshop.core.tiles import MAX_TILE_LEVEL
+
 
 @dataclass
 class CanvasViewport:
@@ -49,3 +51,8 @@ class CanvasViewport:
         old_zoom = self.zoom
         self.zoom = max(self.min_zoom, min(self.max_zoom, self.zoom * factor))
         self.pan_offset = canvas_pos - (canvas_pos - self.pan_offset) * (self.zoom / old_zoom)
+
+    def level_of_detail(self, max_level: int = MAX_TILE_LEVEL) -> int:
+        if self.zoom > 0.5:
+            return 0
+        return max(0, min(max_level, math.floor(math.log2(1.0 / self.zoom))))
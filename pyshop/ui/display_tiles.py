@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+
+CHANNELS = ("red", "green", "blue", "alpha")
+
+
+def channel_view(visibility) -> tuple:
+    return tuple(bool(visibility.get(channel, True)) for channel in CHANNELS)
+
+
+class DisplayTileCache:
+    def __init__(self, max_tiles: int = 512):
+        self._images = OrderedDict()
+        self.max_tiles = max_tiles
+
+    def get(self, tile_box, level: int, tile, visibility):
+        key = (tile_box.as_crop_box(), level)
+        view = channel_view(visibility)
+        cached = self._images.get(key)
+        if cached is not None and cached[0] is tile and cached[1] == view:
+            self._images.move_to_end(key)
+            return cached[3]
+
+        pixels = np.array(tile.convert("RGBA"))
+        for index, visible in enumerate(view[:3]):
+            if not visible:
+                pixels[..., index] = 0
+        if not view[3]:
+            pixels[..., 3] = 255
+        image = QImage(pixels.data, tile.width, tile.height, pixels.strides[0], QImage.Format_RGBA8888)
+        self._images[key] = (tile, view, pixels, image)
+        self._images.move_to_end(key)
+        while len(self._images) > self.max_tiles:
+            self._images.popitem(last=False)
+        return image
+
+    def clear(self):
+        self._images.clear()
@@ -0,0 +1,85 @@
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from pyshop.core.compositor import render_executor
+from pyshop.core.selection import contours_path, simplify_contours, update_contour_tiles
+
+
+SYNC_ANTS_PIXELS = 1024 * 1024
+
+
+class MarchingAntsBuilder(QObject):
+    """Keeps the selection outline as per-tile contours and rebuilds only what a mask edit touched.
+
+    Only the selection's cropped mask is traced, but the tiles sit on a
+    document-space grid, so an edit that moves the selection bounds keeps the
+    tiles it did not touch. Masks up to ``SYNC_ANTS_PIXELS`` are traced inline;
+    larger ones are traced on the render pool. The pool hands its result back
+    through ``_traced`` so the token check and the state swap happen on the GUI
+    thread, which then announces the path through ``path_ready`` with the token
+    of the request that produced it.
+    """
+
+    path_ready = pyqtSignal(int, object)
+    _traced = pyqtSignal(int, object, object)
+
+    def __init__(self, parent=None, sync_pixels: int = SYNC_ANTS_PIXELS):
+        super().__init__(parent)
+        self.sync_pixels = sync_pixels
+        self.path = None
+        self.level = 0
+        self._state = (None, {})
+        self.token = 0
+        self._traced.connect(self._on_traced)
+
+    def clear(self):
+        self.token += 1
+        self._state = (None, {})
+        self.path = None
+
+    def request(self, selection, level: int = 0):
+        if selection is None or selection.is_empty:
+            self.clear()
+            return None
+        self.level = level
+        self.token += 1
+        left, top, right, bottom = selection.bounds
+        if selection.mask is None:
+            self._state = (None, {})
+            corners = np.array([(left, top), (right, top), (right, bottom), (left, bottom)])
+            self.path = contours_path([(corners, True)])
+            return self.path
+        binary = np.asarray(selection.mask) > 127
+        if binary.size <= self.sync_pixels:
+            self._state, self.path = self._build(binary, (left, top), self._state, level)
+            return self.path
+        token = self.token
+        future = render_executor().submit(self._build, binary, (left, top), self._state, level)
+        future.add_done_callback(lambda done: self._finished(token, done))
+        return self.path
+
+    @staticmethod
+    def _build(binary, origin, state, level: int):
+        previous, tiles = state
+        previous_origin, previous = previous or ((0, 0), None)
+        tiles = update_contour_tiles(binary, previous, tiles, origin=origin, previous_origin=previous_origin)
+        state = ((origin, binary), tiles)
+        if not tiles:
+            return state, None
+        contours = [contour for key in sorted(tiles) for contour in tiles[key]]
+        return state, contours_path(simplify_contours(contours, 1 << level))
+
+    def _finished(self, token, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        state, path = future.result()
+        try:
+            self._traced.emit(token, state, path)
+        except RuntimeError:
+            pass
+
+    def _on_traced(self, token, state, path):
+        if token != self.token:
+            return
+        self._state, self.path = state, path
+        self.path_ready.emit(token, path)
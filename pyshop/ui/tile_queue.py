@@ -0,0 +1,69 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from pyshop.core.compositor import render_executor
+from pyshop.core.layer import clone_layer_state
+
+
+class TileRenderQueue(QObject):
+    """Renders missing tiles on the render pool and announces each through ``tile_ready``.
+
+    Requests at ``level`` > 0 render overview pieces instead of full tiles.
+    Each request replaces the previous one, so a view and the navigator each
+    keep their own queue. Workers composite copy-on-write snapshots of the
+    layers, never the live ones the GUI keeps painting into.
+    """
+
+    tile_ready = pyqtSignal(object)
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self._requests = {}
+        self._failed = set()
+
+    def request(self, layers, tile_boxes, active_index: int | None = None, level: int = 0) -> int:
+        wanted = {tile_box.as_crop_box(): tile_box for tile_box in tile_boxes}
+        for key, (tile_box, token, future, requested) in list(self._requests.items()):
+            if future.done():
+                del self._requests[key]
+            elif (key not in wanted or requested != level) and future.cancel():
+                self.cache.cancel_render(tile_box, token, requested)
+                del self._requests[key]
+
+        snapshot = None
+        for key, tile_box in wanted.items():
+            if key in self._failed or self.cache.is_current(tile_box, level) or self.cache.is_pending(tile_box, level):
+                continue
+            if snapshot is None:
+                snapshot = [clone_layer_state(layer) for layer in layers]
+            token = self.cache.begin_render(tile_box, level)
+            future = render_executor().submit(self.cache.render_tile, snapshot, tile_box, active_index, level)
+            self._requests[key] = (tile_box, token, future, level)
+            future.add_done_callback(lambda done, tile_box=tile_box, token=token: self._finished(tile_box, token, level, done))
+        return sum(1 for key in wanted if key in self._requests)
+
+    def take_failed(self, tile_box) -> bool:
+        key = tile_box.as_crop_box()
+        if key not in self._failed:
+            return False
+        self._failed.discard(key)
+        return True
+
+    def cancel_all(self):
+        for tile_box, token, future, level in self._requests.values():
+            if future.cancel():
+                self.cache.cancel_render(tile_box, token, level)
+        self._requests.clear()
+
+    def _finished(self, tile_box, token, level, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.cache.cancel_render(tile_box, token, level)
+            self._failed.add(tile_box.as_crop_box())
+        elif not self.cache.finish_render(tile_box, token, future.result(), level):
+            return
+        try:
+            self.tile_ready.emit(tile_box)
+        except RuntimeError:
+            pass
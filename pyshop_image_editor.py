@@ -13,40 +13,53 @@ from pyshop import APP_DISPLAY_NAME, APP_VERSION, __version__
 from pyshop.app_info import app_icon_path
 from pyshop.core import (
     BrushSettings,
+    BrushStroke,
     clear_recovery_project,
+    clip_bounds,
     Document,
     DEFAULT_EXPORT_PRESETS,
+    DEFAULT_HISTORY_MEMORY_BUDGET,
     HistoryManager,
     Layer,
     RAW_EXTENSIONS,
+    SAMPLE_SIZES,
+    SampleCache,
+    Selection,
+    adjustment_label,
+    apply_adjustment,
     apply_channel_visibility,
+    apply_in_selection,
+    auto_contrast_levels,
     batch_export_images,
-    build_marching_ants_path,
     clone_layer_state,
     composite_layers,
     create_document_layers,
-    apply_retouch_dab,
+    default_render_workers,
+    apply_retouch_stroke,
     effect_label,
-    erase_brush_stroke,
     flattened_document_layers,
+    flood_fill,
     export_image_with_preset,
+    format_curve_points,
     image_document_layers,
-    iter_brush_dabs,
     iter_intersecting_tile_boxes,
     is_ora_path,
     is_project_path,
     is_raw_path,
+    layer_content_bounds,
+    layer_signature,
     load_macro_file,
     load_ora,
     load_project,
     MacroFormatError,
+    matching_region,
     named_background_rgba,
+    EncodedLayerCache,
     open_raster_image,
-    paint_brush_stroke,
+    parse_curve_points,
     PROJECT_FILE_SUFFIX,
     preset_by_name,
     qcolor_to_rgba,
-    selection_mask_bounds,
     load_raw_image,
     load_psd_layers,
     save_flattened_psd,
@@ -54,14 +67,17 @@ from pyshop.core import (
     save_layered_psd,
     save_macro_file,
     save_ora,
+    sample_composite,
     save_project,
+    set_render_workers,
     smoothed_brush_point,
     TiledCompositeCache,
+    union_bounds,
     recovery_project_path,
     write_error_log,
 )
 from pyshop.tools import CanvasToolEvent, DEFAULT_TOOL_REGISTRY, build_default_tool_handlers
-from pyshop.ui import CanvasViewport, snap_point_to_guides
+from pyshop.ui import CanvasViewport, DisplayTileCache, MarchingAntsBuilder, TileRenderQueue, snap_point_to_guides
 from pyshop.plugins import discover_plugins
 from pyshop.windows_shell import install_windows_shell, remove_windows_shell
 
@@ -320,17 +336,26 @@ class CanvasWidget(QWidget):
         self.panning = False
         self.pan_start = QPointF()
         self.last_pos = None
+        self.move_bounds = None
+        self.brush_stroke = None
+        self.stroke_dirty = None
+        self.sample_cache = SampleCache()
         self.drawing = False
         self.selection_start = None
         self.selection_rect = None
         self.selection_mask = None
         self.marching_ants_path = None
         self.marching_offset = 0
+        self.ants = MarchingAntsBuilder(self)
+        self.ants.path_ready.connect(self._on_ants_ready)
         self.crop_rect = None
         self.shape_rect = None
         self._lasso_points = []
         self._checker_tile = None
         self.tile_cache = TiledCompositeCache()
+        self.display_tiles = DisplayTileCache()
+        self.render_queue = TileRenderQueue(self.tile_cache, self)
+        self.render_queue.tile_ready.connect(self._on_tile_ready)
         self.tool_handlers = build_default_tool_handlers()
         self.tablet_pressure = 1.0
         self._snap_tools = {"move", "select_rect", "select_ellipse", "crop", "text", "fill", "magic_wand"}
@@ -359,6 +384,10 @@ class CanvasWidget(QWidget):
     def pan_offset(self, value):
         self.viewport.pan_offset = value
 
+    @property
+    def selection(self):
+        return self.editor.document.selection
+
     @property
     def selection_mask(self):
         return self.editor.document.selection_mask
@@ -370,13 +399,16 @@ class CanvasWidget(QWidget):
     def _march_tick(self):
         if self.marching_ants_path is not None or self.selection_rect is not None:
             self.marching_offset = (self.marching_offset + 1) % 12
-            self.update()
+            self.update_overlay()
 
     def _update_marching_path(self):
-        if self.selection_mask is None:
-            self.marching_ants_path = None
+        self.marching_ants_path = self.ants.request(self.selection, self.viewport.level_of_detail())
+
+    def _on_ants_ready(self, token, path):
+        if token != self.ants.token:
             return
-        self.marching_ants_path = build_marching_ants_path(np.array(self.selection_mask))
+        self.marching_ants_path = path
+        self.update_overlay()
 
     def set_selection_mask(self, mask):
         self.selection_mask = mask
@@ -496,6 +528,44 @@ class CanvasWidget(QWidget):
         self.tile_cache.invalidate()
         return super().update(*args, **kwargs)
 
+    def update_overlay(self):
+        return super().update()
+
+    def invalidate_image_rect(self, bounds):
+        if bounds is None:
+            return
+        self.tile_cache.invalidate(bounds)
+        super().update()
+
+    def invalidate_layer_rect(self, layer, bounds):
+        if bounds is None:
+            return
+        layer.mark_pixels_changed(bounds)
+        self.invalidate_image_rect(bounds)
+
+    def invalidate_layer(self, layer):
+        self.invalidate_image_rect(layer_content_bounds(layer))
+
+    def visible_tile_boxes(self):
+        if not self.editor.layers:
+            return []
+        doc_width, doc_height = self.editor.layers[0].image.size
+        visible_bounds = self.viewport.visible_image_bounds((doc_width, doc_height), (self.width(), self.height()))
+        if visible_bounds is None:
+            return []
+        return list(iter_intersecting_tile_boxes(doc_width, doc_height, visible_bounds))
+
+    def reset_tiles(self):
+        self.render_queue.cancel_all()
+        self.tile_cache.clear()
+        self.display_tiles.clear()
+        super().update()
+
+    def _on_tile_ready(self, tile_box):
+        top_left = self.viewport.image_to_canvas(QPointF(tile_box.x, tile_box.y))
+        bottom_right = self.viewport.image_to_canvas(QPointF(tile_box.right, tile_box.bottom))
+        super().update(QRectF(top_left, bottom_right).toAlignedRect().adjusted(-1, -1, 1, 1))
+
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.SmoothPixmapTransform)
@@ -528,15 +598,26 @@ class CanvasWidget(QWidget):
                     dh = min(th, doc_height - y)
                     painter.drawPixmap(x, y, dw, dh, tile, 0, 0, dw, dh)
 
-            for box in iter_intersecting_tile_boxes(doc_width, doc_height, visible_bounds):
-                tile_image = self.tile_cache.get_tile(self.editor.layers, box)
-                tile_data = tile_image.tobytes("raw", "RGBA")
-                qimg = QImage(tile_data, box.width, box.height, QImage.Format_RGBA8888)
-                painter.drawImage(box.x, box.y, qimg)
+            boxes = self.visible_tile_boxes()
+            level = self.viewport.level_of_detail()
+            self.render_queue.request(self.editor.layers, boxes, self.editor.active_layer_index)
+            for box in boxes:
+                tile_image = self.tile_cache.cached_tile(box)
+                if tile_image is None and self.render_queue.take_failed(box):
+                    tile_image = self.tile_cache.get_tile(self.editor.layers, box, self.editor.active_layer_index)
+                if tile_image is None:
+                    tile_image = self.tile_cache.placeholder_tile(box)
+                if tile_image is None:
+                    continue
+                tile_image = self.tile_cache.tile_level(box, tile_image, level)
+                qimg = self.display_tiles.get(box, level, tile_image, self.editor.channel_visibility)
+                painter.drawImage(QRectF(box.x, box.y, box.width, box.height), qimg)
 
             self._draw_grid_and_guides(painter, doc_width, doc_height, visible_bounds)
 
         # ---- Marching Ants ----
+        if self.selection is not None and self.ants.level != self.viewport.level_of_detail():
+            self._update_marching_path()
         if self.marching_ants_path is not None:
             pen_black = QPen(QColor(0, 0, 0), 1.0)
             pen_black.setCosmetic(True)
@@ -595,7 +676,7 @@ class CanvasWidget(QWidget):
 
         if event.button() == Qt.LeftButton and tool == "zoom":
             self.viewport.zoom_at(QPointF(event.pos()), 1.25)
-            self.update()
+            self.update_overlay()
             return
 
         if event.button() == Qt.MiddleButton or (event.button() == Qt.LeftButton and tool == "hand") or (event.button() == Qt.LeftButton and event.modifiers() & Qt.AltModifier and tool != "clone_stamp"):
@@ -621,12 +702,12 @@ class CanvasWidget(QWidget):
             if layer:
                 w, h = layer.image.size
                 if 0 <= ix < w and 0 <= iy < h:
-                    self.editor.update_info_panel(ix, iy, layer.image.getpixel((ix, iy)))
+                    self.editor.update_info_panel(ix, iy, self.editor.sample_color(ix, iy))
                     self.editor.statusBar().showMessage(
                         f"X: {ix}  Y: {iy}  |  Zoom: {self.zoom:.0%}  |  Tool: {self.editor.current_tool}")
 
         if self.panning:
-            self.pan_offset = QPointF(event.pos()) - self.pan_start; self.update(); return
+            self.pan_offset = QPointF(event.pos()) - self.pan_start; self.update_overlay(); return
 
         if self.drawing and event.buttons() & Qt.LeftButton:
             handler = self._active_tool_handler()
@@ -643,15 +724,16 @@ class CanvasWidget(QWidget):
                 img_pos = self.snap_image_pos(self.canvas_to_image(QPointF(event.pos())), self.editor.current_tool)
                 handler.release(self, self._tool_event(event, img_pos))
 
+            self.end_brush_stroke()
             self.drawing = False
-            self.update()
+            self.update_overlay()
             self.editor.update_layer_panel()
 
     def wheelEvent(self, event):
         factor = 1.15 if event.angleDelta().y() > 0 else 1/1.15
         cp = QPointF(event.pos())
         self.viewport.zoom_at(cp, factor)
-        self.update()
+        self.update_overlay()
 
     def tabletEvent(self, event):
         pressure = float(event.pressure())
@@ -663,31 +745,47 @@ class CanvasWidget(QWidget):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return
         color = qcolor_to_rgba(self.editor.fg_color, self.editor.brush_opacity)
-        settings = self.editor.brush_settings()
-        paint_brush_stroke(layer.image, x, y, x, y, settings, color, self.tablet_pressure)
+        self.brush_stroke = BrushStroke(layer.image, self.editor.brush_settings(), color)
+        self.invalidate_layer_rect(layer, self.brush_stroke.add_segment(x, y, x, y, self.tablet_pressure))
 
     def _draw_brush_line(self, p1, p2):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return p2
         settings = self.editor.brush_settings()
         p2 = self._smooth_brush_point(p1, p2, settings)
-        color = qcolor_to_rgba(self.editor.fg_color, self.editor.brush_opacity)
+        if self.brush_stroke is None or self.brush_stroke.image is not layer.image or self.brush_stroke.erase:
+            self.brush_stroke = BrushStroke(layer.image, settings, qcolor_to_rgba(self.editor.fg_color, self.editor.brush_opacity))
         x1, y1, x2, y2 = int(p1.x()), int(p1.y()), int(p2.x()), int(p2.y())
-        paint_brush_stroke(layer.image, x1, y1, x2, y2, settings, color, self.tablet_pressure)
+        self.invalidate_layer_rect(layer, self.brush_stroke.add_segment(x1, y1, x2, y2, self.tablet_pressure))
         return p2
 
+    def end_brush_stroke(self):
+        stroke, self.brush_stroke = self.brush_stroke, None
+        dirty, self.stroke_dirty = self.stroke_dirty, None
+        if stroke is not None:
+            dirty = union_bounds(dirty, stroke.dirty)
+        if dirty is not None:
+            self.editor.history.set_latest_bounds(dirty)
+
+    def _stroke_touched(self, layer, bounds):
+        self.stroke_dirty = union_bounds(self.stroke_dirty, bounds)
+        self.invalidate_layer_rect(layer, bounds)
+
     def _draw_eraser(self, x, y):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return
-        erase_brush_stroke(layer.image, x, y, x, y, self.editor.brush_settings(), self.tablet_pressure)
+        self.brush_stroke = BrushStroke(layer.image, self.editor.brush_settings(), erase=True)
+        self.invalidate_layer_rect(layer, self.brush_stroke.add_segment(x, y, x, y, self.tablet_pressure))
 
     def _draw_eraser_line(self, p1, p2):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return p2
         settings = self.editor.brush_settings()
         p2 = self._smooth_brush_point(p1, p2, settings)
+        if self.brush_stroke is None or self.brush_stroke.image is not layer.image or not self.brush_stroke.erase:
+            self.brush_stroke = BrushStroke(layer.image, settings, erase=True)
         x1, y1, x2, y2 = int(p1.x()), int(p1.y()), int(p2.x()), int(p2.y())
-        erase_brush_stroke(layer.image, x1, y1, x2, y2, settings, self.tablet_pressure)
+        self.invalidate_layer_rect(layer, self.brush_stroke.add_segment(x1, y1, x2, y2, self.tablet_pressure))
         return p2
 
     def _smooth_brush_point(self, p1, p2, settings):
@@ -697,102 +795,61 @@ class CanvasWidget(QWidget):
     def _draw_retouch(self, x, y, mode):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return
-        apply_retouch_dab(layer.image, x, y, self.editor.brush_size, mode)
+        self._stroke_touched(layer, apply_retouch_stroke(layer.image, x, y, x, y, self.editor.brush_settings(), mode, self.tablet_pressure))
 
     def _draw_retouch_line(self, p1, p2, mode):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return p2
         settings = self.editor.brush_settings()
         p2 = self._smooth_brush_point(p1, p2, settings)
-        for x, y, size, _index in iter_brush_dabs(int(p1.x()), int(p1.y()), int(p2.x()), int(p2.y()), settings, self.tablet_pressure):
-            apply_retouch_dab(layer.image, x, y, size, mode)
+        x1, y1, x2, y2 = int(p1.x()), int(p1.y()), int(p2.x()), int(p2.y())
+        self._stroke_touched(layer, apply_retouch_stroke(layer.image, x1, y1, x2, y2, settings, mode, self.tablet_pressure))
         return p2
 
     def _flood_fill(self, x, y):
         layer = self.editor.active_layer()
         if not layer or layer.locked: return
-        w, h = layer.image.size
-        if x < 0 or x >= w or y < 0 or y >= h: return
-        pixels = layer.image.load()
-        target = pixels[x, y]
-        fill_color = qcolor_to_rgba(self.editor.fg_color, self.editor.brush_opacity)
-        if target == fill_color: return
-        tol = self.editor.magic_wand_tolerance
-        def match(c1, c2): return all(abs(a-b) <= tol for a, b in zip(c1[:3], c2[:3]))
-        visited = set(); stack = [(x, y)]
-        while stack:
-            cx, cy = stack.pop()
-            if (cx, cy) in visited: continue
-            if cx < 0 or cx >= w or cy < 0 or cy >= h: continue
-            if not match(pixels[cx, cy], target): continue
-            visited.add((cx, cy)); pixels[cx, cy] = fill_color
-            stack.extend([(cx+1,cy),(cx-1,cy),(cx,cy+1),(cx,cy-1)])
+        dirty = flood_fill(
+            layer.image,
+            x,
+            y,
+            qcolor_to_rgba(self.editor.fg_color, self.editor.brush_opacity),
+            self.editor.magic_wand_tolerance,
+            contiguous=self.editor.magic_wand_contiguous,
+            antialias=self.editor.fill_antialias,
+            sample=self._sample_pixels(layer) if self.editor.magic_wand_sample_all else None,
+            selection=self.selection,
+        )
+        if dirty is not None:
+            self.editor.history.set_latest_bounds(dirty)
+            self.invalidate_layer_rect(layer, dirty)
+
+    def _sample_pixels(self, layer):
+        if self.editor.magic_wand_sample_all:
+            key = ("all", tuple((item.uid, layer_signature(item)) for item in self.editor.layers), tuple(sorted(self.editor.channel_visibility.items())))
+            return self.sample_cache.pixels(key, self.editor.get_composite)
+        return self.sample_cache.pixels(("layer", layer.uid, layer_signature(layer)), lambda: layer.image)
 
     def _magic_wand_select(self, x, y):
-        """Magic wand selection - fast scanline flood fill for contiguous, vectorized for non-contiguous."""
         layer = self.editor.active_layer()
         if not layer: return
         w, h = layer.image.size
         if x < 0 or x >= w or y < 0 or y >= h: return
 
-        source = self.editor.get_composite() if self.editor.magic_wand_sample_all else layer.image
-        src_np = np.array(source).astype(np.int16)
-        target = src_np[y, x, :3].copy()
         tol = self.editor.magic_wand_tolerance
-
-        # Vectorized color match for ALL pixels at once
-        diff = np.abs(src_np[:, :, :3] - target.reshape(1, 1, 3))
-        match_all = np.all(diff <= tol, axis=2)  # boolean (h, w)
-
-        if self.editor.magic_wand_contiguous:
-            # Fast scanline flood fill on the boolean match mask
-            mask = np.zeros((h, w), dtype=np.uint8)
-            if not match_all[y, x]:
-                new_mask = Image.fromarray(mask, "L")
-            else:
-                # Scanline fill using a stack of (x, y) seed points
-                stack = [(x, y)]
-                mask[y, x] = 255
-                while stack:
-                    sx, sy = stack.pop()
-                    # Scan left
-                    lx = sx
-                    while lx > 0 and match_all[sy, lx - 1] and mask[sy, lx - 1] == 0:
-                        lx -= 1
-                        mask[sy, lx] = 255
-                    # Scan right
-                    rx = sx
-                    while rx < w - 1 and match_all[sy, rx + 1] and mask[sy, rx + 1] == 0:
-                        rx += 1
-                        mask[sy, rx] = 255
-                    # Check rows above and below for new seeds
-                    for ny in [sy - 1, sy + 1]:
-                        if ny < 0 or ny >= h:
-                            continue
-                        span_started = False
-                        for nx in range(lx, rx + 1):
-                            if match_all[ny, nx] and mask[ny, nx] == 0:
-                                if not span_started:
-                                    stack.append((nx, ny))
-                                    mask[ny, nx] = 255
-                                    span_started = True
-                            else:
-                                span_started = False
-                new_mask = Image.fromarray(mask, "L")
-        else:
-            mask = np.where(match_all, 255, 0).astype(np.uint8)
-            new_mask = Image.fromarray(mask, "L")
+        region = matching_region(self._sample_pixels(layer), x, y, tol, self.editor.magic_wand_contiguous)
+        new_selection = Selection.from_mask(region)
 
         mods = QApplication.keyboardModifiers()
-        if mods & Qt.ShiftModifier and self.selection_mask is not None:
-            self.set_selection_mask(ImageChops.lighter(self.selection_mask, new_mask))
-        elif mods & Qt.AltModifier and self.selection_mask is not None:
-            self.set_selection_mask(ImageChops.darker(self.selection_mask, ImageChops.invert(new_mask)))
+        if mods & Qt.ShiftModifier and self.selection is not None:
+            self.set_selection_mask(self.selection.union(new_selection))
+        elif mods & Qt.AltModifier and self.selection is not None:
+            self.set_selection_mask(self.selection.subtract(new_selection))
         else:
-            self.set_selection_mask(new_mask)
+            self.set_selection_mask(new_selection)
 
         self.selection_rect = None
-        count = np.count_nonzero(mask)
+        count = np.count_nonzero(region)
         self.editor.statusBar().showMessage(
             f"Magic Wand: {count} pixels selected (tolerance={tol})")
 
@@ -811,11 +868,12 @@ class CanvasWidget(QWidget):
             m = Image.new("L", (sz, sz), 0)
             ImageDraw.Draw(m).ellipse((0, 0, sz, sz), fill=255)
             layer.image.paste(src, (x-sz//2, y-sz//2), m)
+            self._stroke_touched(layer, clip_bounds((x-sz//2, y-sz//2, x-sz//2+sz, y-sz//2+sz), layer.image.width, layer.image.height))
         except: pass
 
     def clear_selection(self):
         self.set_selection_mask(None); self.marching_ants_path = None
-        self.selection_rect = None; self.update()
+        self.selection_rect = None; self.update_overlay()
 
 
 def pil_to_qpixmap(image, max_size):
@@ -866,15 +924,23 @@ class NavigatorPanel(QWidget):
         self.preview.setAlignment(Qt.AlignCenter)
         self.preview.setMinimumHeight(120)
         layout.addWidget(self.preview)
+        self.render_queue = TileRenderQueue(editor.canvas.tile_cache, self)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(50)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.render_queue.tile_ready.connect(lambda _tile_box: self.refresh_timer.start())
 
     def refresh(self):
-        composite = self.editor.get_composite()
-        if composite is None:
+        overview, missing, level = self.editor.canvas.tile_cache.overview_image(self.editor.layers, (220, 140))
+        self.render_queue.request(self.editor.layers, missing, level=level)
+        if overview is None:
             self.preview.setText("No image")
             self.preview.setPixmap(QPixmap())
             return
         self.preview.setText("")
-        self.preview.setPixmap(pil_to_qpixmap(composite, (220, 140)))
+        overview = apply_channel_visibility(overview, self.editor.channel_visibility)
+        self.preview.setPixmap(pil_to_qpixmap(overview, (220, 140)))
 
 
 class HistogramPanel(QWidget):
@@ -924,7 +990,8 @@ class InfoPanel(QWidget):
         self.color_label = QLabel("Color: -")
         self.zoom_label = QLabel("Zoom: 100%")
         self.layer_label = QLabel("Layer: -")
-        for label in [self.document_label, self.cursor_label, self.color_label, self.zoom_label, self.layer_label]:
+        self.history_label = QLabel("History: -")
+        for label in [self.document_label, self.cursor_label, self.color_label, self.zoom_label, self.layer_label, self.history_label]:
             layout.addWidget(label)
         layout.addStretch(1)
 
@@ -937,6 +1004,9 @@ class InfoPanel(QWidget):
         layer = self.editor.active_layer()
         self.layer_label.setText(f"Layer: {layer.name}" if layer else "Layer: -")
         self.zoom_label.setText(f"Zoom: {self.editor.canvas.zoom:.0%}")
+        memory = self.editor.history.memory_usage(self.editor.layers) / (1024 * 1024)
+        disk = self.editor.history.disk_usage() / (1024 * 1024)
+        self.history_label.setText(f"History: {memory:.1f} MB in memory, {disk:.1f} MB on disk")
 
     def update_cursor(self, x, y, color=None):
         self.cursor_label.setText(f"Cursor: {x}, {y}")
@@ -964,7 +1034,7 @@ class ChannelPanel(QWidget):
 
     def set_channel(self, channel, visible):
         self.editor.channel_visibility[channel] = visible
-        self.editor.canvas.update()
+        self.editor.canvas.update_overlay()
         self.editor.refresh_analysis_panels()
 
     def refresh(self):
@@ -1095,7 +1165,7 @@ class LayerPanel(QWidget):
         item = self.layer_list.item(row)
         if item:
             self.editor.set_active_layer_index(item.data(Qt.UserRole))
-            self.editor.canvas.update()
+            self.editor.canvas.update_overlay()
 
     def on_layers_reordered(self):
         new = []
@@ -1107,15 +1177,15 @@ class LayerPanel(QWidget):
 
     def on_opacity_change(self, v):
         layer = self.editor.active_layer()
-        if layer: layer.opacity = v; self.opacity_label.setText(f"{v*100//255}%"); self.editor.canvas.update()
+        if layer: layer.opacity = v; self.opacity_label.setText(f"{v*100//255}%"); self.editor.canvas.invalidate_layer(layer)
 
     def on_blend_change(self, mode):
         layer = self.editor.active_layer()
-        if layer: layer.blend_mode = mode; self.editor.canvas.update()
+        if layer: layer.blend_mode = mode; self.editor.canvas.invalidate_layer(layer)
 
     def on_visibility_toggle(self, checked):
         layer = self.editor.active_layer()
-        if layer: layer.visible = checked; self.editor.notify_layers_changed(); self.editor.canvas.update()
+        if layer: layer.visible = checked; self.editor.notify_layers_changed(); self.editor.canvas.invalidate_layer(layer)
 
     def on_lock_toggle(self, checked):
         layer = self.editor.active_layer()
@@ -1125,7 +1195,7 @@ class LayerPanel(QWidget):
         layer = self.editor.active_layer()
         if layer:
             layer.clipping = checked
-            self.editor.notify_layers_changed(); self.editor.canvas.update()
+            self.editor.notify_layers_changed(); self.editor.canvas.invalidate_layer(layer)
 
     def add_layer_mask(self):
         layer = self.editor.active_layer()
@@ -1142,13 +1212,20 @@ class LayerPanel(QWidget):
     def add_adjustment_layer(self):
         if not self.editor.layers: return
         dlg = QDialog(self); dlg.setWindowTitle("New Adjustment Layer"); form = QFormLayout(dlg)
-        kind = QComboBox(); kind.addItems(["Brightness/Contrast", "Hue/Saturation", "Invert", "Grayscale"])
+        kind = QComboBox(); kind.addItems(["Brightness/Contrast", "Hue/Saturation", "Levels", "Curves", "Color Balance", "Auto Contrast", "Invert", "Grayscale"])
         form.addRow("Type:", kind)
         brightness = QSpinBox(); brightness.setRange(-100, 100); form.addRow("Brightness:", brightness)
         contrast = QSpinBox(); contrast.setRange(-100, 100); form.addRow("Contrast:", contrast)
         hue = QSpinBox(); hue.setRange(-180, 180); form.addRow("Hue:", hue)
         saturation = QSpinBox(); saturation.setRange(-100, 100); form.addRow("Saturation:", saturation)
         lightness = QSpinBox(); lightness.setRange(-100, 100); form.addRow("Lightness:", lightness)
+        black = QSpinBox(); black.setRange(0, 254); form.addRow("Black Point:", black)
+        white = QSpinBox(); white.setRange(1, 255); white.setValue(255); form.addRow("White Point:", white)
+        gamma = QDoubleSpinBox(); gamma.setRange(0.1, 10.0); gamma.setValue(1.0); gamma.setSingleStep(0.1); form.addRow("Gamma:", gamma)
+        curve = QLineEdit("0,0 128,128 255,255"); form.addRow("Curve Points:", curve)
+        red = QSpinBox(); red.setRange(-100, 100); form.addRow("Red:", red)
+        green = QSpinBox(); green.setRange(-100, 100); form.addRow("Green:", green)
+        blue = QSpinBox(); blue.setRange(-100, 100); form.addRow("Blue:", blue)
         btns = QDialogButtonBox(QDialogButtonBox.Ok|QDialogButtonBox.Cancel)
         btns.accepted.connect(dlg.accept); btns.rejected.connect(dlg.reject); form.addRow(btns)
         if dlg.exec_() != QDialog.Accepted:
@@ -1159,6 +1236,18 @@ class LayerPanel(QWidget):
             adjustment = {"type": "brightness_contrast", "brightness": brightness.value(), "contrast": contrast.value()}
         elif selected == "Hue/Saturation":
             adjustment = {"type": "hue_saturation", "hue": hue.value(), "saturation": saturation.value(), "lightness": lightness.value()}
+        elif selected == "Levels":
+            adjustment = {"type": "levels", "black": black.value(), "white": white.value(), "gamma": gamma.value()}
+        elif selected == "Curves":
+            try:
+                adjustment = {"type": "curves", "points": parse_curve_points(curve.text())}
+            except ValueError as exc:
+                QMessageBox.warning(self, "Curves", str(exc))
+                return
+        elif selected == "Color Balance":
+            adjustment = {"type": "color_balance", "red": red.value(), "green": green.value(), "blue": blue.value()}
+        elif selected == "Auto Contrast":
+            adjustment = auto_contrast_levels(composite_layers(self.editor.layers[:self.editor.active_layer_index + 1]))
         elif selected == "Invert":
             adjustment = {"type": "invert"}
         else:
@@ -1254,18 +1343,23 @@ class ImageEditor(QMainWindow):
         self.document = Document()
         self.current_tool = "brush"
         self.fg_color = QColor(255,255,255); self.bg_color = QColor(0,0,0)
-        self.brush_size = 10; self.brush_opacity = 255
+        self.brush_size = 10; self.brush_opacity = 255; self.brush_flow = 100
+        self.brush_hardness = 100; self.brush_angle = 0; self.brush_roundness = 100
         self.brush_spacing = 25; self.brush_smoothing = 0; self.brush_scatter = 0
         self.brush_texture = 0; self.brush_color_jitter = 0
         self.brush_pressure_size = False; self.brush_pressure_opacity = False
         self.magic_wand_tolerance = 32; self.magic_wand_contiguous = True; self.magic_wand_sample_all = False
+        self.fill_antialias = False
+        self.eyedropper_sample_size = "Point Sample"
         self.show_grid = False; self.show_guides = True; self.show_rulers = True; self.snap_enabled = True
         self.grid_size = 64
         self.macro_recording = False; self.macro_replaying = False
         self.settings = QSettings("SysAdminDoc", "PyShop")
+        set_render_workers(self.settings.value("performance/renderWorkers", default_render_workers(), type=int))
         self.docks = {}
         self.plugin_discovery = None
-        self.clone_source = None; self.history = HistoryManager()
+        self.clone_source = None; self.history = self.new_history()
+        self.encoded_layers = EncodedLayerCache()
         self.current_job = None
         self.autosave_timer = QTimer()
         self.autosave_timer.setSingleShot(True)
@@ -1350,6 +1444,10 @@ class ImageEditor(QMainWindow):
         return BrushSettings(
             size=self.brush_size,
             opacity=self.brush_opacity,
+            flow=self.brush_flow,
+            hardness=self.brush_hardness,
+            angle=self.brush_angle,
+            roundness=self.brush_roundness,
             spacing=self.brush_spacing,
             smoothing=self.brush_smoothing,
             scatter=self.brush_scatter,
@@ -1427,6 +1525,7 @@ class ImageEditor(QMainWindow):
         self._act(lm, "Group Active Layer", "", lambda: self.layer_panel.group_active_layer())
         self._act(lm, "Layer Mask From Selection", "", lambda: self.layer_panel.add_layer_mask())
         self._act(lm, "New Adjustment Layer...", "", lambda: self.layer_panel.add_adjustment_layer())
+        self._act(lm, "Edit Active Adjustment Layer...", "", self.edit_active_adjustment_layer)
         self._act(lm, "Toggle Clipping Mask", "", self.toggle_active_clipping)
         lm.addSeparator()
         self._act(lm, "Merge Down", "", self.merge_down)
@@ -1560,6 +1659,26 @@ class ImageEditor(QMainWindow):
         self.opacity_spin.setSuffix("%")
         self.opacity_spin.valueChanged.connect(lambda v: setattr(self, 'brush_opacity', int(v*255/100)))
         self.options_bar.addWidget(self.opacity_spin)
+        self.options_bar.addWidget(QLabel("  Flow: "))
+        self.flow_spin = QSpinBox(); self.flow_spin.setRange(1,100); self.flow_spin.setValue(self.brush_flow)
+        self.flow_spin.setSuffix("%")
+        self.flow_spin.valueChanged.connect(lambda v: setattr(self, 'brush_flow', v))
+        self.options_bar.addWidget(self.flow_spin)
+        self.options_bar.addWidget(QLabel("  Hardness: "))
+        self.hardness_spin = QSpinBox(); self.hardness_spin.setRange(0,100); self.hardness_spin.setValue(self.brush_hardness)
+        self.hardness_spin.setSuffix("%")
+        self.hardness_spin.valueChanged.connect(lambda v: setattr(self, 'brush_hardness', v))
+        self.options_bar.addWidget(self.hardness_spin)
+        self.options_bar.addWidget(QLabel("  Angle: "))
+        self.angle_spin = QSpinBox(); self.angle_spin.setRange(-180,180); self.angle_spin.setValue(self.brush_angle)
+        self.angle_spin.setSuffix("\u00b0")
+        self.angle_spin.valueChanged.connect(lambda v: setattr(self, 'brush_angle', v))
+        self.options_bar.addWidget(self.angle_spin)
+        self.options_bar.addWidget(QLabel("  Roundness: "))
+        self.roundness_spin = QSpinBox(); self.roundness_spin.setRange(1,100); self.roundness_spin.setValue(self.brush_roundness)
+        self.roundness_spin.setSuffix("%")
+        self.roundness_spin.valueChanged.connect(lambda v: setattr(self, 'brush_roundness', v))
+        self.options_bar.addWidget(self.roundness_spin)
         self.options_bar.addWidget(QLabel("  Spacing: "))
         self.spacing_spin = QSpinBox(); self.spacing_spin.setRange(1,300); self.spacing_spin.setValue(self.brush_spacing)
         self.spacing_spin.setSuffix("%")
@@ -1602,6 +1721,14 @@ class ImageEditor(QMainWindow):
         self.sample_all_check = QCheckBox("Sample All")
         self.sample_all_check.toggled.connect(lambda v: setattr(self, 'magic_wand_sample_all', v))
         self.options_bar.addWidget(self.sample_all_check)
+        self.fill_antialias_check = QCheckBox("Anti-alias")
+        self.fill_antialias_check.toggled.connect(lambda v: setattr(self, 'fill_antialias', v))
+        self.options_bar.addWidget(self.fill_antialias_check)
+        self.options_bar.addSeparator()
+        self.options_bar.addWidget(QLabel("  Sample Size: "))
+        self.sample_size_combo = QComboBox(); self.sample_size_combo.addItems(list(SAMPLE_SIZES))
+        self.sample_size_combo.currentTextChanged.connect(lambda v: setattr(self, 'eyedropper_sample_size', v))
+        self.options_bar.addWidget(self.sample_size_combo)
 
     def create_panels(self):
         self.layer_panel = LayerPanel(self)
@@ -1788,21 +1915,25 @@ class ImageEditor(QMainWindow):
 
     def reset_document_metadata(self):
         self.document.reset_metadata()
+        self.encoded_layers.clear()
         self.macro_recording = False
         self.macro_replaying = False
         self.refresh_paths_panel()
         self.refresh_channel_panel()
         if hasattr(self, "canvas"):
+            self.canvas.reset_tiles()
             self.canvas._update_marching_path()
 
     def apply_project_state(self, state, path):
         self.document.apply_project_state(state, path)
+        self.encoded_layers.clear()
         self.macro_recording = False
         self.macro_replaying = False
-        self.history = HistoryManager()
+        self.history = self.new_history()
         self.refresh_paths_panel()
         self.refresh_channel_panel()
         self.canvas.selection_rect = None
+        self.canvas.reset_tiles()
         self.canvas._update_marching_path()
         self.layers_changed.emit()
         self.active_layer_changed.emit(self.active_layer_index)
@@ -1879,6 +2010,7 @@ class ImageEditor(QMainWindow):
             "current_path_closed": self.current_path_closed,
             "macro_steps": list(self.macro_steps),
             "color_profile": self.document.color_profile,
+            "encoded_layers": self.encoded_layers,
         }
 
     def schedule_autosave(self):
@@ -1914,27 +2046,24 @@ class ImageEditor(QMainWindow):
     def add_path_point(self, x, y):
         self.current_path.append((x, y))
         self.current_path_closed = False
-        self.refresh_paths_panel(); self.canvas.update()
+        self.refresh_paths_panel(); self.canvas.update_overlay()
 
     def close_path(self):
         if len(self.current_path) >= 3:
             self.current_path_closed = True
-            self.refresh_paths_panel(); self.canvas.update()
+            self.refresh_paths_panel(); self.canvas.update_overlay()
 
     def clear_path(self):
         self.current_path = []
         self.current_path_closed = False
         self.canvas.clear_selection()
-        self.refresh_paths_panel(); self.canvas.update()
+        self.refresh_paths_panel(); self.canvas.update_overlay()
 
     def path_to_selection(self):
         if not self.layers or len(self.current_path) < 3:
             return
-        width, height = self.layers[0].image.size
-        mask = Image.new("L", (width, height), 0)
-        ImageDraw.Draw(mask).polygon(self.current_path, fill=255)
-        self.canvas.set_selection_mask(mask)
-        self.canvas.update()
+        self.canvas.set_selection_mask(Selection.from_polygon(self.layers[0].image.size, self.current_path))
+        self.canvas.update_overlay()
 
     def toggle_active_clipping(self):
         layer = self.active_layer()
@@ -1979,7 +2108,18 @@ class ImageEditor(QMainWindow):
             errors.setEnabled(False)
             self.plugins_menu.addAction(errors)
 
+    def new_history(self):
+        budget = self.settings.value("performance/historyMemoryMB", DEFAULT_HISTORY_MEMORY_BUDGET // (1024 * 1024), type=int)
+        return HistoryManager(memory_budget=max(1, budget) * 1024 * 1024)
+
     # Compositing
+    def sample_color(self, x, y):
+        radius = SAMPLE_SIZES.get(self.eyedropper_sample_size, 0)
+        color = sample_composite(self.layers, x, y, radius, cache=self.canvas.tile_cache)
+        if color is None:
+            return None
+        return apply_channel_visibility(Image.new("RGBA", (1, 1), color), self.channel_visibility).getpixel((0, 0))
+
     def get_composite(self):
         composite = composite_layers(self.layers)
         if composite is not None:
@@ -1998,7 +2138,7 @@ class ImageEditor(QMainWindow):
         if dlg.exec_() == QDialog.Accepted:
             w, h = ws.value(), hs.value()
             self.layers = create_document_layers(w, h, named_background_rgba(bg.currentText()))
-            self.set_active_layer_index(0); self.history = HistoryManager(); self.file_path = None
+            self.set_active_layer_index(0); self.history = self.new_history(); self.file_path = None
             self.reset_document_metadata()
             self.canvas.clear_selection(); self.update_layer_panel(); self.canvas.fit_in_view()
             self.setWindowTitle(f"{APP_DISPLAY_NAME} - Untitled")
@@ -2088,7 +2228,7 @@ class ImageEditor(QMainWindow):
                 if result["kind"] == "raw"
                 else "Imported Image"
             )
-            self.set_active_layer_index(0); self.history = HistoryManager(); self.file_path = None
+            self.set_active_layer_index(0); self.history = self.new_history(); self.file_path = None
             self.reset_document_metadata()
             self.document.color_profile = result.get("color_profile")
             self.canvas.clear_selection(); self.update_layer_panel(); self.canvas.fit_in_view()
@@ -2319,37 +2459,46 @@ class ImageEditor(QMainWindow):
     def select_all(self):
         l = self.active_layer()
         if l:
-            w,h = l.image.size; self.canvas.set_selection_mask(Image.new("L",(w,h),255))
-            self.canvas.selection_rect = None; self.canvas.update()
+            w,h = l.image.size; self.canvas.set_selection_mask(Selection((w, h), (0, 0, w, h)))
+            self.canvas.selection_rect = None; self.canvas.update_overlay()
 
     def deselect(self): self.canvas.clear_selection()
 
     def invert_selection(self):
-        if self.canvas.selection_mask:
-            self.canvas.set_selection_mask(ImageChops.invert(self.canvas.selection_mask)); self.canvas.update()
+        if self.canvas.selection is not None:
+            self.canvas.set_selection_mask(self.canvas.selection.invert()); self.canvas.update_overlay()
+
+    def save_active_layer_history(self, bounds=None):
+        self.history.save_layer_state(self.layers, self.active_layer_index, [self.active_layer_index], bounds)
 
     def delete_selection(self):
         l = self.active_layer()
-        if l and self.canvas.selection_mask:
-            self.history.save_state(self.layers, self.active_layer_index)
-            r,g,b,a = l.image.split()
-            a = ImageChops.darker(a, ImageChops.invert(self.canvas.selection_mask))
-            l.image = Image.merge("RGBA", (r,g,b,a)); self.canvas.update()
+        selection = self.canvas.selection
+        if l and selection is not None and not selection.is_empty:
+            bounds = selection.bounds
+            self.save_active_layer_history(bounds)
+            region = l.image.crop(bounds)
+            region.putalpha(ImageChops.darker(region.getchannel("A"), ImageChops.invert(selection.crop(bounds))))
+            l.image.paste(region, bounds[:2])
+            self.canvas.invalidate_layer_rect(l, bounds)
 
     def copy_selection(self):
         l = self.active_layer()
-        if l and self.canvas.selection_mask:
-            self._clipboard = l.image.copy()
-            r,g,b,a = self._clipboard.split()
-            a = ImageChops.darker(a, self.canvas.selection_mask)
-            self._clipboard = Image.merge("RGBA", (r,g,b,a))
+        selection = self.canvas.selection
+        if l and selection is not None and not selection.is_empty:
+            bounds = selection.bounds
+            region = l.image.crop(bounds)
+            region.putalpha(ImageChops.darker(region.getchannel("A"), selection.crop(bounds)))
+            self._clipboard = region
+            self._clipboard_origin = bounds[:2]
 
     def cut_selection(self): self.copy_selection(); self.delete_selection()
 
     def paste_clipboard(self):
         if hasattr(self, '_clipboard') and self._clipboard:
             self.history.save_state(self.layers, self.active_layer_index)
-            nl = Layer("Pasted Layer"); nl.image = self._clipboard.copy()
+            w, h = self.layers[0].image.size if self.layers else self._clipboard.size
+            nl = Layer("Pasted Layer", w, h); nl.image.paste(self._clipboard, getattr(self, "_clipboard_origin", (0, 0)))
             self.layers.append(nl); self.set_active_layer_index(len(self.layers)-1)
             self.update_layer_panel(); self.canvas.update()
 
@@ -2429,8 +2578,8 @@ class ImageEditor(QMainWindow):
         self.update_layer_panel(); self.canvas.update()
 
     def crop_to_selection(self):
-        if self.canvas.selection_mask:
-            bounds = selection_mask_bounds(self.canvas.selection_mask)
+        if self.canvas.selection is not None:
+            bounds = self.canvas.selection.bounds
             if bounds: self._do_crop(*bounds)
         elif self.canvas.selection_rect:
             r = self.canvas.selection_rect
@@ -2494,13 +2643,15 @@ class ImageEditor(QMainWindow):
     def _apply_to_active(self, func):
         l = self.active_layer()
         if not l: return
-        self.history.save_state(self.layers, self.active_layer_index)
-        if self.canvas.selection_mask:
-            orig = l.image.copy(); l.image = func(l.image)
-            l.image = Image.composite(l.image, orig, self.canvas.selection_mask)
-        else:
+        selection = self.canvas.selection
+        if selection is None:
+            self.save_active_layer_history()
             l.image = func(l.image)
-        self.canvas.update()
+            self.canvas.update()
+            return
+        if selection.is_empty: return
+        self.save_active_layer_history(selection.bounds)
+        self.canvas.invalidate_layer_rect(l, apply_in_selection(l.image, func, selection))
 
     def add_effect_layer(self, effect):
         if not self.layers:
@@ -2516,6 +2667,56 @@ class ImageEditor(QMainWindow):
         self.canvas.update()
         self.statusBar().showMessage(f"Added {effect_label(effect)} effect layer")
 
+    def edit_active_adjustment_layer(self):
+        layer = self.active_layer()
+        if not layer or not layer.adjustment:
+            self.statusBar().showMessage("Select an adjustment layer to edit")
+            return
+        adjustment = dict(layer.adjustment)
+        kind = adjustment.get("type")
+        dlg = QDialog(self); dlg.setWindowTitle(f"Edit {adjustment_label(adjustment)}"); form = QFormLayout(dlg)
+        fields = {}
+        if kind == "brightness_contrast":
+            for key in ("brightness", "contrast"):
+                fields[key] = QSpinBox(); fields[key].setRange(-100, 100); fields[key].setValue(int(adjustment.get(key, 0)))
+        elif kind == "hue_saturation":
+            for key, limit in (("hue", 180), ("saturation", 100), ("lightness", 100)):
+                fields[key] = QSpinBox(); fields[key].setRange(-limit, limit); fields[key].setValue(int(adjustment.get(key, 0)))
+        elif kind == "levels":
+            fields["black"] = QSpinBox(); fields["black"].setRange(0, 254); fields["black"].setValue(int(adjustment.get("black", 0)))
+            fields["white"] = QSpinBox(); fields["white"].setRange(1, 255); fields["white"].setValue(int(adjustment.get("white", 255)))
+            fields["gamma"] = QDoubleSpinBox(); fields["gamma"].setRange(0.1, 10.0); fields["gamma"].setSingleStep(0.1); fields["gamma"].setValue(float(adjustment.get("gamma", 1.0)))
+        elif kind == "curves":
+            fields["points"] = QLineEdit(format_curve_points(adjustment.get("points")))
+        elif kind == "color_balance":
+            for key in ("red", "green", "blue"):
+                fields[key] = QSpinBox(); fields[key].setRange(-100, 100); fields[key].setValue(int(adjustment.get(key, 0)))
+        else:
+            self.statusBar().showMessage(f"{adjustment_label(adjustment)} has no editable parameters")
+            return
+        for key, field in fields.items():
+            form.addRow(f"{key.replace('_', ' ').title()}:", field)
+        btns = QDialogButtonBox(QDialogButtonBox.Ok|QDialogButtonBox.Cancel)
+        btns.accepted.connect(dlg.accept); btns.rejected.connect(dlg.reject); form.addRow(btns)
+        if dlg.exec_() != QDialog.Accepted:
+            return
+        for key, field in fields.items():
+            if isinstance(field, QLineEdit):
+                try:
+                    adjustment[key] = parse_curve_points(field.text())
+                except ValueError as exc:
+                    QMessageBox.warning(self, "Curves", str(exc))
+                    return
+            else:
+                adjustment[key] = field.value()
+        if adjustment == layer.adjustment:
+            return
+        self.save_active_layer_history()
+        layer.adjustment = adjustment
+        self.notify_layers_changed()
+        self.canvas.invalidate_layer(layer)
+        self.statusBar().showMessage(f"Updated {adjustment_label(adjustment)} adjustment layer")
+
     def edit_active_effect_layer(self):
         layer = self.active_layer()
         if not layer or not layer.effect:
@@ -2557,7 +2758,7 @@ class ImageEditor(QMainWindow):
             return
         if effect == layer.effect:
             return
-        self.history.save_state(self.layers, self.active_layer_index)
+        self.save_active_layer_history()
         layer.effect = effect
         self.notify_layers_changed()
         self.canvas.update()
@@ -2616,13 +2817,8 @@ class ImageEditor(QMainWindow):
         btns = QDialogButtonBox(QDialogButtonBox.Ok|QDialogButtonBox.Cancel)
         btns.accepted.connect(dlg.accept); btns.rejected.connect(dlg.reject); form.addRow(btns)
         if dlg.exec_() == QDialog.Accepted:
-            bv, cv = bs.value(), cs.value()
-            def apply(img):
-                r = img
-                if bv != 0: r = ImageEnhance.Brightness(r).enhance(1+bv/100)
-                if cv != 0: r = ImageEnhance.Contrast(r).enhance(1+cv/100)
-                return r
-            self._apply_to_active(apply)
+            adjustment = {"type": "brightness_contrast", "brightness": bs.value(), "contrast": cs.value()}
+            self._apply_to_active(lambda img: apply_adjustment(img, adjustment))
 
     def adjust_hue_saturation(self):
         dlg = QDialog(self); dlg.setWindowTitle("Hue / Saturation"); form = QFormLayout(dlg)
@@ -2654,18 +2850,11 @@ class ImageEditor(QMainWindow):
         btns = QDialogButtonBox(QDialogButtonBox.Ok|QDialogButtonBox.Cancel)
         btns.accepted.connect(dlg.accept); btns.rejected.connect(dlg.reject); form.addRow(btns)
         if dlg.exec_() == QDialog.Accepted:
-            bp, wp, gm = bsp.value(), wsp.value(), gsp.value()
-            def apply(img):
-                r,g,b,a = img.split()
-                def lv(ch): return ch.point(lambda x: int(255*max(0,min(1,((x-bp)/max(1,wp-bp))))**(1/gm)))
-                return Image.merge("RGBA",(lv(r),lv(g),lv(b),a))
-            self._apply_to_active(apply)
+            adjustment = {"type": "levels", "black": bsp.value(), "white": wsp.value(), "gamma": gsp.value()}
+            self._apply_to_active(lambda img: apply_adjustment(img, adjustment))
 
     def invert_colors(self):
-        def apply(img):
-            r,g,b,a = img.split()
-            return Image.merge("RGBA",(ImageChops.invert(r),ImageChops.invert(g),ImageChops.invert(b),a))
-        self._apply_to_active(apply)
+        self._apply_to_active(lambda img: apply_adjustment(img, {"type": "invert"}))
 
     def grayscale(self):
         def apply(img):
@@ -2674,9 +2863,11 @@ class ImageEditor(QMainWindow):
         self._apply_to_active(apply)
 
     def auto_contrast(self):
+        selection = self.canvas.selection
+        mask = selection.mask if selection is not None else None
         def apply(img):
             r,g,b,a = img.split()
-            rgb = ImageOps.autocontrast(Image.merge("RGB",(r,g,b)))
+            rgb = ImageOps.autocontrast(Image.merge("RGB",(r,g,b)), mask=mask)
             rr,gg,bb = rgb.split(); return Image.merge("RGBA",(rr,gg,bb,a))
         self._apply_to_active(apply)
 
@@ -2689,14 +2880,8 @@ class ImageEditor(QMainWindow):
         btns = QDialogButtonBox(QDialogButtonBox.Ok|QDialogButtonBox.Cancel)
         btns.accepted.connect(dlg.accept); btns.rejected.connect(dlg.reject); form.addRow(btns)
         if dlg.exec_() == QDialog.Accepted:
-            rv, gv, bv = rs.value(), gs.value(), bs.value()
-            def apply(img):
-                r,g,b,a = img.split()
-                r = r.point(lambda x: max(0,min(255,x+rv)))
-                g = g.point(lambda x: max(0,min(255,x+gv)))
-                b = b.point(lambda x: max(0,min(255,x+bv)))
-                return Image.merge("RGBA",(r,g,b,a))
-            self._apply_to_active(apply)
+            adjustment = {"type": "color_balance", "red": rs.value(), "green": gs.value(), "blue": bs.value()}
+            self._apply_to_active(lambda img: apply_adjustment(img, adjustment))
 
     # Filters
     def gaussian_blur(self):
@@ -2743,28 +2928,28 @@ class ImageEditor(QMainWindow):
     # Zoom
     def _zoom(self, f):
         self.canvas.zoom *= f
-        self.canvas.update()
+        self.canvas.update_overlay()
         self.refresh_analysis_panels()
 
     def _set_zoom(self, v):
         self.canvas.zoom = v
-        self.canvas.update()
+        self.canvas.update_overlay()
         self.refresh_analysis_panels()
 
     def set_show_grid(self, checked):
         self.show_grid = checked
         self.record_macro_step("set_show_grid", checked)
-        self.canvas.update()
+        self.canvas.update_overlay()
 
     def set_show_guides(self, checked):
         self.show_guides = checked
         self.record_macro_step("set_show_guides", checked)
-        self.canvas.update()
+        self.canvas.update_overlay()
 
     def set_show_rulers(self, checked):
         self.show_rulers = checked
         self.record_macro_step("set_show_rulers", checked)
-        self.canvas.update()
+        self.canvas.update_overlay()
 
     def set_snap_enabled(self, checked):
         self.snap_enabled = checked
@@ -2774,7 +2959,7 @@ class ImageEditor(QMainWindow):
         value, ok = QInputDialog.getInt(self, "Grid Size", "Pixels:", self.grid_size, 1, 2000, 1)
         if ok:
             self.grid_size = value
-            self.canvas.update()
+            self.canvas.update_overlay()
 
     def add_guide(self, orientation):
         if not self.layers:
@@ -2785,11 +2970,11 @@ class ImageEditor(QMainWindow):
         value, ok = QInputDialog.getInt(self, "Add Guide", label, maximum // 2, 0, maximum, 1)
         if ok:
             self.guides.append((orientation, value))
-            self.canvas.update()
+            self.canvas.update_overlay()
 
     def clear_guides(self):
         self.guides.clear()
-        self.canvas.update()
+        self.canvas.update_overlay()
 
 # ---- Main -----------------------------------------------------------------
 def main():
@@ -41,3 +41,10 @@ def test_canvas_viewport_zoom_at_preserves_anchor_position():
 
     assert viewport.zoom == 2.0
     assert viewport.canvas_to_image(QPointF(50, 50)) == QPointF(50, 50)
+
+
+def test_canvas_viewport_level_of_detail_follows_zoom():
+    assert CanvasViewport(zoom=1.0).level_of_detail() == 0
+    assert CanvasViewport(zoom=0.5).level_of_detail() == 1
+    assert CanvasViewport(zoom=0.1).level_of_detail() == 3
+    assert CanvasViewport(zoom=0.05).level_of_detail(max_level=2) == 2
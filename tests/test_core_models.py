@@ -1,40 +1,74 @@
+import colorsys
+
 import numpy as np
 import pytest
-from PIL import Image
+from PIL import Image, ImageChops, ImageFilter
 
+import pyshop.core.fill as fill_module
+import pyshop.core.history as history_module
 from pyshop.core import (
     BrushSettings,
+    BrushStroke,
     DiffHistoryCommand,
     Document,
+    EncodedLayerCache,
     HistoryManager,
     HistoryCommand,
     ImageOpenError,
     Layer,
+    PairedSnapshotCommand,
+    PixelTiles,
+    SampleCache,
+    Selection,
     ProjectFormatError,
+    TileBox,
+    TiledCompositeCache,
+    clone_layer_state,
+    adjustment_lut,
+    apply_adjustment,
     apply_channel_visibility,
+    apply_in_selection,
+    apply_lut,
+    auto_contrast_levels,
     apply_retouch_dab,
+    apply_retouch_stroke,
     blend_layers,
+    brush_tip,
     build_marching_ants_path,
+    compile_adjustment_luts,
     composite_layers,
     composite_layers_tile,
+    contiguous_region,
     create_document_layers,
     erase_brush_dab,
     erase_brush_stroke,
+    flood_fill,
+    format_curve_points,
     iter_brush_dabs,
     iter_intersecting_tile_boxes,
     iter_tile_boxes,
+    layer_content_bounds,
     load_psd_layers,
+    matching_region,
+    top_level_span,
     load_project,
     named_background_rgba,
     open_raster_image,
+    parse_curve_points,
     paint_brush_dab,
     paint_brush_line,
     paint_brush_stroke,
+    render_workers,
+    sample_composite,
     save_project,
+    set_render_workers,
     save_flattened_psd,
     save_layered_psd,
     selection_mask_bounds,
+    simplify_contours,
     smoothed_brush_point,
+    trace_selection_contours,
+    update_contour_tiles,
 )
 
 
@@ -142,6 +176,56 @@ def test_blend_layers_applies_source_alpha_once():
     assert result.getpixel((0, 0))[3] == 128
 
 
+def test_blend_modes_over_transparent_pixels_keep_the_top_color():
+    base = Image.new("RGBA", (1, 1), (0, 0, 0, 0))
+    top = Image.new("RGBA", (1, 1), (200, 80, 40, 128))
+
+    for mode in ("Multiply", "Screen", "Difference", "Color"):
+        assert blend_layers(base, top, mode).getpixel((0, 0)) == (200, 80, 40, 128)
+
+
+def test_composite_layers_tile_rounds_to_eight_bits_once():
+    base = Layer("Base", image=Image.new("RGBA", (2, 2), (255, 255, 255, 255)))
+    layers = [base]
+    for _ in range(6):
+        layer = Layer("Grey", image=Image.new("RGBA", (2, 2), (254, 254, 254, 255)))
+        layer.blend_mode = "Multiply"
+        layers.append(layer)
+
+    red, _green, _blue, alpha = composite_layers_tile(layers, TileBox(0, 0, 2, 2)).getpixel((0, 0))
+
+    assert alpha == 255
+    assert red == round(255 * (254 / 255) ** 6)
+
+
+def test_composite_layers_tile_folds_plain_normal_layers_in_eight_bits():
+    rng = np.random.default_rng(2)
+    images = [Image.fromarray(rng.integers(0, 256, (5, 6, 4), dtype=np.uint8), "RGBA") for _ in range(4)]
+    layers = [Layer(f"Layer {index}", image=image) for index, image in enumerate(images)]
+    layers[2].visible = False
+
+    expected = Image.alpha_composite(Image.alpha_composite(images[0], images[1]), images[3])
+
+    assert composite_layers_tile(layers, TileBox(0, 0, 6, 5)).tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("mode", ["Multiply", "Screen"])
+def test_premultiplied_blend_shortcuts_match_straight_colour_formula(mode):
+    rng = np.random.default_rng(3)
+    base_pixels = rng.integers(0, 256, (6, 7, 4), dtype=np.uint8)
+    top_pixels = rng.integers(0, 256, (6, 7, 4), dtype=np.uint8)
+
+    result = np.array(blend_layers(Image.fromarray(base_pixels, "RGBA"), Image.fromarray(top_pixels, "RGBA"), mode)).astype(np.float64)
+
+    base, top = base_pixels / 255.0, top_pixels / 255.0
+    base_alpha, top_alpha = base[..., 3:], top[..., 3:]
+    mixed = base[..., :3] * top[..., :3] if mode == "Multiply" else 1.0 - (1.0 - base[..., :3]) * (1.0 - top[..., :3])
+    alpha = top_alpha + base_alpha * (1.0 - top_alpha)
+    color = top[..., :3] * top_alpha * (1.0 - base_alpha) + base[..., :3] * base_alpha * (1.0 - top_alpha) + mixed * top_alpha * base_alpha
+    expected = np.concatenate([color / np.maximum(alpha, 1e-9), alpha], axis=2) * 255.0
+    assert np.abs(result - expected).max() <= 1.0
+
+
 def test_advertised_blend_modes_render_without_mutating_inputs():
     base = Image.new("RGBA", (2, 2), (50, 100, 150, 255))
     top = Image.new("RGBA", (2, 2), (200, 80, 40, 192))
@@ -157,6 +241,107 @@ def test_advertised_blend_modes_render_without_mutating_inputs():
     assert top.tobytes() == top_before.tobytes()
 
 
+def _reference_lum(color):
+    return 0.3 * color[0] + 0.59 * color[1] + 0.11 * color[2]
+
+
+def _reference_set_lum(color, lum):
+    delta = lum - _reference_lum(color)
+    color = [channel + delta for channel in color]
+    lum = _reference_lum(color)
+    low, high = min(color), max(color)
+    if low < 0:
+        color = [lum + (channel - lum) * lum / (lum - low) for channel in color]
+    if high > 1:
+        color = [lum + (channel - lum) * (1 - lum) / (high - lum) for channel in color]
+    return color
+
+
+def _reference_set_sat(color, saturation):
+    low, high = min(color), max(color)
+    if high == low:
+        return [0.0, 0.0, 0.0]
+    return [(channel - low) * saturation / (high - low) for channel in color]
+
+
+def _reference_hsl_blend(base, top, mode):
+    if mode == "Hue":
+        return _reference_set_lum(_reference_set_sat(top, max(base) - min(base)), _reference_lum(base))
+    if mode == "Saturation":
+        return _reference_set_lum(_reference_set_sat(base, max(top) - min(top)), _reference_lum(base))
+    if mode == "Color":
+        return _reference_set_lum(top, _reference_lum(base))
+    return _reference_set_lum(base, _reference_lum(top))
+
+
+@pytest.mark.parametrize("mode", ["Hue", "Saturation", "Color", "Luminosity"])
+def test_hsl_blend_modes_match_scalar_w3c_reference(mode):
+    rng = np.random.default_rng(4)
+    base_pixels = rng.integers(0, 256, (6, 7, 3), dtype=np.uint8)
+    top_pixels = rng.integers(0, 256, (6, 7, 3), dtype=np.uint8)
+    base_pixels[0, 0] = (128, 128, 128)
+    top_pixels[0, 1] = (90, 90, 90)
+    alpha = np.full((6, 7, 1), 255, dtype=np.uint8)
+    base = Image.fromarray(np.concatenate([base_pixels, alpha], axis=2), "RGBA")
+    top = Image.fromarray(np.concatenate([top_pixels, alpha], axis=2), "RGBA")
+
+    result = np.array(blend_layers(base, top, mode))[..., :3].astype(np.int16)
+
+    expected = np.zeros_like(result)
+    for y in range(6):
+        for x in range(7):
+            color = _reference_hsl_blend(list(base_pixels[y, x] / 255.0), list(top_pixels[y, x] / 255.0), mode)
+            expected[y, x] = [int(np.clip(channel, 0.0, 1.0) * 255) for channel in color]
+    assert np.abs(result - expected).max() <= 1
+
+
+def _hls_round_trip_blend(base, top, mode):
+    """The colorsys HLS blend these modes used before the W3C formulas."""
+    base_h, base_l, base_s = colorsys.rgb_to_hls(*base)
+    top_h, top_l, top_s = colorsys.rgb_to_hls(*top)
+    if mode == "Hue":
+        return colorsys.hls_to_rgb(top_h, base_l, base_s)
+    if mode == "Saturation":
+        return colorsys.hls_to_rgb(base_h, base_l, top_s)
+    if mode == "Color":
+        return colorsys.hls_to_rgb(top_h, base_l, top_s)
+    return colorsys.hls_to_rgb(base_h, top_l, base_s)
+
+
+@pytest.mark.parametrize("mode", ["Hue", "Saturation", "Color", "Luminosity"])
+def test_hsl_blend_modes_keep_the_hue_of_the_old_hls_output(mode):
+    # The W3C modes carry lightness as 0.3/0.59/0.11 luma rather than HLS (max + min) / 2,
+    # so channel values move by about 16-33 levels on average (up to ~200 on saturated
+    # blues and yellows), but identical layers are unchanged and hue stays within 3 degrees.
+    rng = np.random.default_rng(4)
+    base_pixels = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    top_pixels = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    alpha = np.full((32, 32, 1), 255, dtype=np.uint8)
+    base = Image.fromarray(np.concatenate([base_pixels, alpha], axis=2), "RGBA")
+    top = Image.fromarray(np.concatenate([top_pixels, alpha], axis=2), "RGBA")
+
+    result = np.array(blend_layers(base, top, mode))[..., :3].reshape(-1, 3).astype(np.int16)
+    old = np.array(
+        [_hls_round_trip_blend(b / 255.0, t / 255.0, mode) for b, t in zip(base_pixels.reshape(-1, 3), top_pixels.reshape(-1, 3))]
+    )
+    old = (np.clip(old, 0.0, 1.0) * 255).astype(np.int16)
+
+    assert np.abs(result - old).mean() <= 40
+    chromatic = (np.ptp(result, axis=1) > 25) & (np.ptp(old, axis=1) > 25)
+    hue_delta = np.array([abs(colorsys.rgb_to_hls(*(a / 255.0))[0] - colorsys.rgb_to_hls(*(b / 255.0))[0]) for a, b in zip(result[chromatic], old[chromatic])])
+    assert (np.minimum(hue_delta, 1.0 - hue_delta) * 360).max() <= 3.5
+    assert np.array_equal(np.array(blend_layers(base, base, mode))[..., :3], base_pixels)
+
+
+def test_color_blend_with_neutral_top_desaturates_base():
+    base = Image.new("RGBA", (1, 1), (200, 50, 50, 255))
+    top = Image.new("RGBA", (1, 1), (30, 30, 30, 255))
+
+    red, green, blue, _alpha = blend_layers(base, top, "Color").getpixel((0, 0))
+
+    assert red == green == blue
+
+
 def test_selection_path_is_none_for_empty_mask_and_present_for_selection():
     empty = np.zeros((3, 3), dtype=np.uint8)
     selected = empty.copy()
@@ -166,6 +351,50 @@ def test_selection_path_is_none_for_empty_mask_and_present_for_selection():
     assert not build_marching_ants_path(selected).isEmpty()
 
 
+def test_selection_contours_merge_edges_into_closed_loops():
+    mask = np.zeros((6, 6), dtype=bool)
+    mask[1:4, 1:5] = True
+    mask[2, 2] = False
+
+    contours = trace_selection_contours(mask)
+
+    assert sorted(len(points) for points, closed in contours if closed) == [4, 4]
+    outer = next(points for points, _closed in contours if (points == [1, 1]).all(axis=1).any())
+    assert sorted(map(tuple, outer.tolist())) == [(1, 1), (1, 4), (5, 1), (5, 4)]
+    assert simplify_contours(contours, 1) is contours
+    assert simplify_contours(contours, 8) == []
+
+
+def test_contour_tiles_only_retrace_tiles_touched_by_a_mask_edit():
+    mask = np.zeros((40, 40), dtype=bool)
+    mask[2:6, 2:6] = True
+    mask[30:36, 30:36] = True
+    tiles = update_contour_tiles(mask, tile_size=16)
+    far_tile = tiles[(32, 32)]
+
+    edited = mask.copy()
+    edited[3, 3] = False
+    updated = update_contour_tiles(edited, mask, tiles, tile_size=16)
+
+    assert updated[(32, 32)] is far_tile
+    assert updated[(0, 0)] is not tiles[(0, 0)]
+    assert sum(len(contours) for contours in updated.values()) == sum(len(contours) for contours in tiles.values()) + 1
+
+
+def test_contour_tiles_survive_an_edit_that_grows_the_mask_bounds():
+    document = np.zeros((64, 64), dtype=bool)
+    document[40:46, 40:46] = True
+    tiles = update_contour_tiles(document[40:46, 40:46], tile_size=16, origin=(40, 40))
+    far_tile = tiles[(32, 32)]
+
+    document[2:6, 2:6] = True
+    grown = update_contour_tiles(document[2:46, 2:46], document[40:46, 40:46], tiles, tile_size=16, origin=(2, 2), previous_origin=(40, 40))
+
+    assert grown[(32, 32)] is far_tile
+    assert sorted(grown) == sorted(update_contour_tiles(document, tile_size=16))
+    assert np.array_equal(grown[(0, 0)][0][0].min(axis=0), [2, 2])
+
+
 def test_document_factory_creates_background_layer():
     layers = create_document_layers(2, 1, named_background_rgba("Black"))
 
@@ -215,6 +444,55 @@ def test_document_owns_editor_state_and_revision_metadata():
     assert document.has_unsaved_changes is True
 
 
+def test_history_diff_restores_pending_move_offset():
+    layer = Layer("Paint", image=Image.new("RGBA", (4, 4), (0, 0, 0, 0)))
+    layer.image.putpixel((0, 0), (255, 0, 0, 255))
+    layer.offset = (2, 1)
+    before = clone_layer_state(layer)
+    layer.offset = (0, 0)
+
+    command = DiffHistoryCommand.capture([before], 0, [layer], 0)
+    undone, _ = command.undo([layer])
+
+    assert undone[0].offset == (2, 1)
+    assert undone[0].crop_image((2, 1, 3, 2)).getpixel((0, 0)) == (255, 0, 0, 255)
+    assert command.redo(undone)[0][0].offset == (0, 0)
+
+    layer.offset = (2, 1)
+    painted = clone_layer_state(layer)
+    painted.image.putpixel((3, 3), (0, 255, 0, 255))
+    painted.mark_pixels_changed((3, 3, 4, 4))
+
+    command = DiffHistoryCommand.capture([layer], 0, [painted], 0)
+    undone, _ = command.undo([painted])
+
+    assert undone[0].image.getpixel((3, 3)) == (0, 0, 0, 0)
+    assert undone[0].offset == (2, 1)
+
+
+def test_history_reuses_snapshots_and_skips_diffing_untouched_layers(monkeypatch):
+    untouched = Layer("Untouched", image=Image.new("RGBA", (3, 3), (9, 9, 9, 255)))
+    painted = Layer("Painted", image=Image.new("RGBA", (3, 3), (0, 0, 0, 0)))
+    history = HistoryManager(max_states=3)
+    history.save_state([untouched, painted], 1)
+    untouched_snapshot = history.undo_stack[-1].layers[0]
+
+    painted.image.putpixel((2, 2), (255, 0, 0, 255))
+    painted.mark_pixels_changed()
+    differences = []
+    original_difference = ImageChops.difference
+    monkeypatch.setattr(
+        "pyshop.core.history.ImageChops.difference",
+        lambda first, second: differences.append(first.size) or original_difference(first, second),
+    )
+    history.save_state([untouched, painted], 1)
+
+    assert history.undo_stack[-1].layers[0] is untouched_snapshot
+    assert len(differences) == 1
+    assert history.undo_stack[0].patches[0].bbox is None
+    assert history.undo_stack[0].patches[1].bbox == (2, 2, 3, 3)
+
+
 def test_brush_helpers_paint_and_erase_pixels():
     image = Image.new("RGBA", (5, 5), (0, 0, 0, 0))
 
@@ -226,6 +504,16 @@ def test_brush_helpers_paint_and_erase_pixels():
     assert image.getpixel((2, 2))[3] == 0
 
 
+def test_brush_helpers_report_clipped_dirty_bounds():
+    image = Image.new("RGBA", (10, 10), (0, 0, 0, 0))
+
+    assert paint_brush_dab(image, 1, 1, 4, (255, 0, 0, 255)) == (0, 0, 4, 4)
+    assert paint_brush_dab(image, 50, 50, 4, (255, 0, 0, 255)) is None
+    assert paint_brush_line(image, 2, 5, 7, 5, 2, (255, 0, 0, 255)) == (1, 4, 9, 7)
+    assert erase_brush_dab(image, 9, 9, 1) == (9, 9, 10, 10)
+    assert apply_retouch_dab(image, 5, 5, 4, "blur") == (3, 3, 8, 8)
+
+
 def test_brush_settings_apply_pressure_and_spacing():
     settings = BrushSettings(size=20, opacity=200, spacing=50, pressure_size=True, pressure_opacity=True)
 
@@ -263,6 +551,72 @@ def test_dynamic_brush_stroke_uses_pressure_opacity_and_eraser_stroke():
     assert image.getpixel((1, 0))[3] == 0
 
 
+def test_brush_stroke_blends_once_without_compounding_overlapping_dabs():
+    image = Image.new("RGBA", (12, 3), (0, 0, 255, 255))
+    stroke = BrushStroke(image, BrushSettings(size=3, opacity=128, spacing=1), (255, 0, 0, 255))
+
+    assert stroke.add_segment(2, 1, 9, 1) == (1, 0, 11, 3)
+    stroke.add_segment(9, 1, 2, 1)
+
+    assert image.getpixel((5, 1)) == (128, 0, 127, 255)
+    assert stroke.dirty == (1, 0, 11, 3)
+
+
+def test_brush_stroke_reblends_only_pixels_a_dab_raised():
+    image = Image.new("RGBA", (40, 20), (0, 0, 255, 255))
+    stroke = BrushStroke(image, BrushSettings(size=9), (255, 0, 0, 255))
+
+    first = stroke.add_dab(10, 10, 9, (255, 0, 0, 255))
+    moved = stroke.add_dab(14, 10, 9, (255, 0, 0, 255))
+
+    assert stroke.add_dab(30, 10, 1, (255, 0, 0, 255)) == (30, 10, 31, 11)
+    assert stroke.add_dab(30, 10, 1, (255, 0, 0, 255)) is None
+    assert moved[0] > first[0] and moved[2] == first[2] + 4
+    assert stroke.dirty == (first[0], first[1], 31, moved[3])
+    assert image.getpixel((14, 10)) == (255, 0, 0, 255)
+
+
+def test_brush_stroke_flow_builds_toward_opacity():
+    image = Image.new("RGBA", (3, 1), (0, 0, 0, 0))
+    stroke = BrushStroke(image, BrushSettings(size=1, flow=50), (255, 0, 0, 255))
+
+    stroke.add_segment(1, 0, 1, 0)
+    assert image.getpixel((1, 0)) == (255, 0, 0, 128)
+    stroke.add_segment(1, 0, 1, 0)
+    assert image.getpixel((1, 0)) == (255, 0, 0, 191)
+
+
+def test_erase_stroke_removes_alpha_within_dab_bounds_with_soft_edges_and_pressure():
+    image = Image.new("RGBA", (40, 40), (10, 20, 30, 255))
+    settings = BrushSettings(size=9, hardness=0, spacing=100)
+
+    dirty = erase_brush_stroke(image, 10, 10, 10, 10, settings)
+
+    assert dirty == (6, 6, 15, 15)
+    assert image.getpixel((10, 10)) == (0, 0, 0, 0)
+    assert 0 < image.getpixel((10, 7))[3] < 255
+    assert image.getpixel((10, 7))[:3] == (10, 20, 30)
+    assert image.crop((0, 0, 40, 6)).getextrema()[3] == (255, 255)
+
+    erase_brush_stroke(image, 30, 30, 30, 30, BrushSettings(size=1, pressure_opacity=True), pressure=0.5)
+    assert image.getpixel((30, 30))[3] == 128
+
+
+def test_brush_tip_cache_builds_antialiased_soft_and_elliptical_stamps():
+    hard, left, top = brush_tip(6)
+    soft, soft_left, soft_top = brush_tip(6, 0)
+    shifted = brush_tip(6, 100, (0.5, 0.0))[0]
+    flat = brush_tip(6, 100, (0, 0), 90, 50)[0]
+
+    assert brush_tip(6) is brush_tip(6)
+    assert not hard.flags.writeable
+    assert (left, top) == (-3, -3)
+    assert hard[3, 3] == 1.0 and 0.0 < hard[0, 3] < 1.0
+    assert soft[-soft_top, -soft_left] == 1.0 and soft[-soft_top - 2, -soft_left] < hard[1, 3]
+    assert not np.array_equal(shifted, hard)
+    assert flat.shape[0] > flat.shape[1]
+
+
 def test_retouch_dab_applies_tonal_adjustments():
     image = Image.new("RGBA", (5, 5), (100, 100, 100, 255))
 
@@ -284,6 +638,105 @@ def test_retouch_dab_blurs_local_patch():
     assert 0 < image.getpixel((2, 3))[0] < 255
 
 
+def test_retouch_stroke_filters_segment_once_through_dab_coverage():
+    image = Image.new("RGBA", (30, 9), (100, 150, 200, 255))
+
+    dirty = apply_retouch_stroke(image, 5, 4, 20, 4, BrushSettings(size=5, spacing=25), "sponge")
+
+    assert dirty == (3, 2, 23, 7)
+    assert image.getpixel((12, 4)) == (114, 147, 179, 255)
+    assert 100 < image.getpixel((3, 2))[0] < 114
+    assert image.getpixel((26, 4)) == (100, 150, 200, 255)
+    assert apply_retouch_stroke(image, 5, 4, 20, 4, BrushSettings(size=5), "unknown") is None
+
+
+def test_contiguous_region_follows_runs_around_obstacles():
+    match = np.array(
+        [
+            [1, 1, 1, 0, 1],
+            [0, 0, 1, 0, 1],
+            [1, 0, 1, 1, 1],
+            [1, 0, 0, 0, 0],
+        ],
+        dtype=bool,
+    )
+
+    region = contiguous_region(match, 0, 0)
+
+    assert region.sum() == 9
+    assert region[0, 4] and not region[2, 0]
+    assert not contiguous_region(match, 1, 1).any()
+
+
+def test_matching_region_and_sample_cache_share_one_source_array():
+    pixels = np.zeros((3, 5, 4), dtype=np.uint8)
+    pixels[:, 2] = (200, 200, 200, 255)
+    cache = SampleCache()
+    renders = []
+
+    source = cache.pixels(("layer", 1), lambda: renders.append(1) or pixels)
+
+    assert cache.pixels(("layer", 1), lambda: renders.append(1) or pixels) is source
+    assert len(renders) == 1
+    assert matching_region(source, 0, 0, 10).sum() == 6
+    assert matching_region(source, 0, 0, 10, contiguous=False).sum() == 12
+    cache.pixels(("layer", 2), lambda: renders.append(1) or pixels)
+    assert len(renders) == 2
+
+
+def test_flood_fill_blends_contiguous_match_within_selection():
+    image = Image.new("RGBA", (6, 4), (255, 255, 255, 255))
+    for y in range(4):
+        image.putpixel((3, y), (0, 0, 0, 255))
+    image.putpixel((5, 0), (250, 250, 250, 255))
+    selection = Selection((6, 4), (0, 0, 6, 3))
+
+    assert flood_fill(image, 0, 0, (255, 0, 0, 255), tolerance=10, selection=selection) == (0, 0, 3, 3)
+    assert image.getpixel((2, 2)) == (255, 0, 0, 255)
+    assert image.getpixel((0, 3)) == (255, 255, 255, 255)
+    assert image.getpixel((4, 0)) == (255, 255, 255, 255)
+
+    assert flood_fill(image, 4, 0, (0, 0, 255, 128), tolerance=10, contiguous=False) == (0, 0, 6, 4)
+    assert image.getpixel((5, 0)) == (125, 125, 253, 255)
+    assert image.getpixel((0, 3)) == (127, 127, 255, 255)
+    assert image.getpixel((1, 1)) == (255, 0, 0, 255)
+
+
+def test_flood_fill_weights_a_large_canvas_by_a_small_selection_without_full_size_masks(monkeypatch):
+    image = Image.new("RGBA", (4000, 3000), (255, 255, 255, 255))
+    mask = Image.new("L", (20, 10), 0)
+    mask.paste(255, (0, 0, 10, 10))
+    mask.paste(128, (10, 0, 20, 10))
+    selection = Selection((4000, 3000), (1000, 2000, 1020, 2010), mask)
+    monkeypatch.setattr(Selection, "to_image", lambda self: pytest.fail("full-size selection mask"))
+    shapes = []
+    original = fill_module.contiguous_region
+
+    def spy(match, x, y):
+        shapes.append(match.shape)
+        return original(match, x, y)
+
+    monkeypatch.setattr(fill_module, "contiguous_region", spy)
+
+    assert flood_fill(image, 1002, 2003, (255, 0, 0, 255), tolerance=0, selection=selection) == (1000, 2000, 1020, 2010)
+    assert shapes == [(10, 20)]
+    assert image.getpixel((1005, 2005)) == (255, 0, 0, 255)
+    assert image.getpixel((1015, 2005)) == (255, 127, 127, 255)
+    assert image.getpixel((999, 2005)) == (255, 255, 255, 255)
+    assert flood_fill(image, 0, 0, (0, 0, 255, 255), selection=selection) is None
+    assert flood_fill(image, 0, 0, (0, 0, 255, 255), selection=Selection((4000, 3000))) is None
+
+
+def test_flood_fill_antialias_softens_the_fill_edge():
+    image = Image.new("RGBA", (5, 1), (0, 0, 0, 255))
+    image.paste((255, 255, 255, 255), (0, 0, 2, 1))
+
+    assert flood_fill(image, 0, 0, (255, 0, 0, 255), tolerance=0, antialias=True) == (0, 0, 3, 1)
+    assert image.getpixel((1, 0)) == (255, 0, 0, 255)
+    assert 0 < image.getpixel((2, 0))[0] < 255
+    assert image.getpixel((3, 0)) == (0, 0, 0, 255)
+
+
 def test_apply_channel_visibility_zeros_hidden_color_channels():
     image = Image.new("RGBA", (1, 1), (10, 20, 30, 40))
 
@@ -388,6 +841,70 @@ def test_native_project_round_trip_preserves_document_state(tmp_path):
     assert restored_base.image.getpixel((0, 0)) == (10, 20, 30, 255)
 
 
+def test_live_tonal_adjustment_layers_render_per_tile_and_round_trip(tmp_path):
+    base = Layer("Base", image=Image.fromarray(np.arange(64 * 64 * 4, dtype=np.uint32).reshape(64, 64, 4).astype(np.uint8), "RGBA"))
+    base.image.putalpha(255)
+    base.mark_pixels_changed()
+    auto = Layer("Auto Contrast Adjustment", 64, 64)
+    auto.adjustment = auto_contrast_levels(base.image)
+    curves = Layer("Curves Adjustment", 64, 64)
+    curves.adjustment = {"type": "curves", "points": parse_curve_points("0,0 96,160 255,255"), "red": [[0, 30], [255, 255]]}
+    balance = Layer("Color Balance Adjustment", 64, 64)
+    balance.adjustment = {"type": "color_balance", "red": -10, "green": 0, "blue": 25}
+    balance.opacity = 128
+    layers = [base, auto, curves, balance]
+
+    whole = composite_layers_tile(layers, TileBox(0, 0, 64, 64))
+    tiled = Image.new("RGBA", (64, 64))
+    for tile_box in iter_tile_boxes(64, 64, 16):
+        tiled.paste(composite_layers_tile(layers, tile_box), (tile_box.x, tile_box.y))
+
+    assert ImageChops.difference(whole, tiled).getbbox() is None
+    assert format_curve_points(curves.adjustment["points"]) == "0,0 96,160 255,255"
+
+    restored = load_project(save_project(tmp_path / "adjusted.pyshop", layers))
+
+    assert [layer.adjustment for layer in restored.layers[1:]] == [auto.adjustment, curves.adjustment, balance.adjustment]
+    assert ImageChops.difference(composite_layers(restored.layers), composite_layers(layers)).getbbox() is None
+
+
+def test_native_project_save_reuses_encoded_pixels_for_unchanged_layers(tmp_path, monkeypatch):
+    import pyshop.core.project as project
+
+    base = Layer("Base", image=Image.new("RGBA", (3, 2), (10, 20, 30, 255)))
+    top = Layer("Top", image=Image.new("RGBA", (3, 2), (0, 0, 0, 0)))
+    encoded = []
+    original = project._image_png_bytes
+    monkeypatch.setattr(project, "_image_png_bytes", lambda image, mode: encoded.append(mode) or original(image, mode))
+
+    cache = EncodedLayerCache()
+
+    save_project(tmp_path / "first.pyshop", [base, top], encoded_layers=cache)
+    top.image.putpixel((1, 1), (255, 0, 0, 255))
+    top.mark_pixels_changed()
+    save_project(tmp_path / "second.pyshop", [clone_layer_state(base), top], encoded_layers=cache)
+
+    assert len(encoded) == 3
+    assert load_project(tmp_path / "second.pyshop").layers[1].image.getpixel((1, 1)) == (255, 0, 0, 255)
+
+
+def test_encoded_layer_cache_drops_oldest_entries_past_byte_budget(tmp_path):
+    layers = [Layer(f"Layer {index}", image=Image.new("RGBA", (3, 2), (index, 0, 0, 255))) for index in range(3)]
+    cache = EncodedLayerCache()
+    save_project(tmp_path / "full.pyshop", layers, encoded_layers=cache)
+    sizes = [len(cache.encode(layer, "image", "RGBA")) for layer in layers]
+
+    cache = EncodedLayerCache(max_bytes=sum(sizes[1:]))
+    save_project(tmp_path / "bounded.pyshop", layers, encoded_layers=cache)
+
+    assert cache.nbytes == sum(sizes[1:])
+    assert cache.nbytes <= cache.max_bytes
+
+    cache.clear()
+
+    assert cache.nbytes == 0
+
+
 def test_native_project_rejects_oversized_document(tmp_path):
     path = tmp_path / "large.pyshop"
     layer = Layer("Large", image=Image.new("RGBA", (2, 2), (0, 0, 0, 0)))
@@ -404,6 +921,45 @@ def test_open_raster_image_rejects_oversized_files(tmp_path):
         open_raster_image(path, max_pixels=3)
 
 
+def test_selection_keeps_cropped_mask_and_combines_within_bounds():
+    full = Image.new("L", (100, 80), 0)
+    full.paste(255, (10, 20, 30, 25))
+    rect = Selection.from_mask(full)
+    ellipse = Selection.from_shape((100, 80), (25, 22, 40, 30), "ellipse")
+
+    assert rect.bounds == (10, 20, 30, 25)
+    assert rect.mask is None
+    assert ellipse.mask.size == (ellipse.bounds[2] - ellipse.bounds[0], ellipse.bounds[3] - ellipse.bounds[1])
+
+    union = rect.union(ellipse)
+    assert union.bounds == (10, 20, 41, 31)
+    assert union.value_at(10, 20) == 255 and union.value_at(38, 26) == 255
+    assert rect.subtract(ellipse).value_at(29, 24) == 0
+    assert rect.subtract(ellipse).bounds[:2] == (10, 20)
+    assert rect.intersect(Selection.from_shape((100, 80), (50, 50, 60, 60))).is_empty
+    assert rect.invert().value_at(10, 20) == 0
+    assert rect.invert().bounds == (0, 0, 100, 80)
+    assert rect.invert().invert().bounds == rect.bounds
+    assert ImageChops.difference(union.to_image(), ImageChops.lighter(full, ellipse.to_image())).getbbox() is None
+
+
+def test_apply_in_selection_filters_only_the_bounds_plus_apron():
+    image = Image.new("RGBA", (50, 40), (0, 0, 0, 255))
+    image.paste((255, 255, 255, 255), (0, 0, 12, 40))
+    selection = Selection.from_shape((50, 40), (10, 5, 19, 14), "ellipse")
+    seen = []
+
+    def blur(region):
+        seen.append(region.size)
+        return region.filter(ImageFilter.BoxBlur(2))
+
+    assert apply_in_selection(image, blur, selection, apron=2) == selection.bounds
+    assert seen == [(14, 14)]
+    assert 0 < image.getpixel((13, 9))[0] < 255
+    assert image.getpixel((10, 5)) == (255, 255, 255, 255)
+    assert image.getpixel((30, 9)) == (0, 0, 0, 255)
+
+
 def test_selection_mask_bounds_returns_cropped_extent():
     mask = Image.new("L", (5, 5), 0)
     mask.putpixel((1, 2), 255)
@@ -432,6 +988,524 @@ def test_iter_intersecting_tile_boxes_culls_to_visible_extent():
     ]
 
 
+def test_tiled_composite_cache_evicts_only_damaged_tiles():
+    layer = Layer("Paint", image=Image.new("RGBA", (4, 4), (0, 0, 0, 0)))
+    cache = TiledCompositeCache()
+    boxes = list(iter_tile_boxes(4, 4, tile_size=2))
+    tiles = {box: cache.get_tile([layer], box) for box in boxes}
+
+    layer.image.putpixel((3, 3), (255, 0, 0, 255))
+    cache.invalidate((3, 3, 4, 4))
+
+    assert cache.get_tile([layer], boxes[0]) is tiles[boxes[0]]
+    assert cache.get_tile([layer], boxes[2]) is tiles[boxes[2]]
+    assert cache.get_tile([layer], boxes[3]).getpixel((1, 1)) == (255, 0, 0, 255)
+
+    cache.invalidate()
+
+    assert cache.get_tile([layer], boxes[0]) is not tiles[boxes[0]]
+
+
+def test_tiled_composite_cache_keeps_placeholders_and_drops_superseded_renders():
+    layer = Layer("Paint", image=Image.new("RGBA", (4, 4), (0, 0, 255, 255)))
+    cache = TiledCompositeCache()
+    box = TileBox(0, 0, 4, 4)
+    previous = cache.get_tile([layer], box)
+
+    cache.invalidate((1, 1, 2, 2))
+    token = cache.begin_render(box)
+    stale_render = cache.render_tile([layer], box)
+    cache.invalidate((1, 1, 2, 2))
+
+    assert cache.cached_tile(box) is None
+    assert cache.placeholder_tile(box) is previous
+    assert not cache.is_pending(box)
+    assert cache.finish_render(box, token, stale_render) is False
+
+    token = cache.begin_render(box)
+    assert cache.finish_render(box, token, cache.render_tile([layer], box)) is True
+    assert cache.placeholder_tile(box) is None
+    assert cache.cached_tile(box).getpixel((0, 0)) == (0, 0, 255, 255)
+
+
+def test_tiled_composite_cache_evicts_least_recently_used_tiles_past_byte_budget():
+    layer = Layer("Paint", image=Image.new("RGBA", (8, 2), (0, 0, 255, 255)))
+    boxes = list(iter_tile_boxes(8, 2, tile_size=2))
+    cache = TiledCompositeCache(max_bytes=48)
+    for box in boxes[:3]:
+        cache.get_tile([layer], box)
+    cache.cached_tile(boxes[0])
+
+    cache.get_tile([layer], boxes[3])
+
+    assert cache.cached_tile(boxes[1]) is None
+    assert all(cache.cached_tile(box) is not None for box in (boxes[0], boxes[3], boxes[2]))
+    assert cache.nbytes == 48
+
+    cache.invalidate(boxes[0].as_crop_box())
+    cache.tile_level(boxes[2], cache.cached_tile(boxes[2]), 1)
+
+    assert cache.placeholder_tile(boxes[0]) is None
+    assert cache.nbytes == 2 * 16 + 4
+
+    cache.get_tile([layer], boxes[1])
+    cache.get_tile([layer], boxes[0])
+
+    assert cache.cached_tile(boxes[2]) is None
+    assert cache._pyramids == {}
+    assert cache.nbytes == 2 * 16
+
+
+def test_tiled_composite_cache_builds_tile_pyramid_and_overview():
+    layer = Layer("Paint", image=Image.new("RGBA", (12, 8), (0, 128, 0, 255)))
+    layer.image.paste((255, 0, 0, 255), (8, 0, 12, 8))
+    cache = TiledCompositeCache()
+    box = TileBox(0, 0, 12, 8)
+    tile = cache.get_tile([layer], box)
+
+    half = cache.tile_level(box, tile, 1)
+    quarter = cache.tile_level(box, tile, 2)
+
+    assert half.size == (6, 4)
+    assert quarter.size == (3, 2)
+    assert cache.tile_level(box, tile, 1) is half
+    assert cache.tile_level(box, tile, 0) is tile
+    assert quarter.getpixel((2, 0)) == (255, 0, 0, 255)
+
+    overview, missing, level = cache.overview_image([layer], (3, 2))
+
+    assert (missing, level) == ([], 2)
+    assert overview.size == (3, 2)
+    assert overview.getpixel((0, 1)) == (0, 128, 0, 255)
+
+
+def test_overview_renders_missing_tiles_at_the_overview_level_without_caching_them():
+    layer = Layer("Paint", image=Image.new("RGBA", (600, 300), (0, 128, 0, 255)))
+    cache = TiledCompositeCache()
+    boxes = list(iter_tile_boxes(600, 300))
+    cache.get_tile([layer], boxes[0])
+
+    overview, missing, level = cache.overview_image([layer], (150, 75))
+
+    assert level == 2
+    assert missing == boxes[1:]
+    assert overview.getpixel((1, 1)) == (0, 128, 0, 255)
+    assert overview.getpixel((140, 1)) == (0, 0, 0, 0)
+
+    for box in missing:
+        token = cache.begin_render(box, level)
+        assert cache.is_pending(box, level) and not cache.is_pending(box)
+        assert cache.finish_render(box, token, cache.render_tile([layer], box, level=level), level)
+    overview, missing, _level = cache.overview_image([layer], (150, 75))
+
+    assert missing == []
+    assert overview.getpixel((149, 74)) == (0, 128, 0, 255)
+    assert list(cache._tiles) == [boxes[0].as_crop_box()]
+
+    cache.invalidate(boxes[-1].as_crop_box())
+    overview, missing, _level = cache.overview_image([layer], (150, 75))
+
+    assert missing == [boxes[-1]]
+    assert overview.getpixel((149, 74)) == (0, 128, 0, 255)
+
+
+def test_sample_composite_reads_point_and_averages_neighbourhood():
+    base = Layer("Base", image=Image.new("RGBA", (6, 6), (0, 0, 0, 255)))
+    base.image.putpixel((2, 2), (90, 180, 45, 255))
+    top = Layer("Top", image=Image.new("RGBA", (6, 6), (0, 0, 0, 0)))
+
+    assert sample_composite([base, top], 2, 2) == (90, 180, 45, 255)
+    assert sample_composite([base, top], 2, 2, radius=1) == (10, 20, 5, 255)
+    assert sample_composite([base, top], 0, 0, radius=2) == (10, 20, 5, 255)
+    assert sample_composite([base, top], 6, 0) is None
+
+
+def test_sample_composite_reuses_cached_tiles(monkeypatch):
+    layer = Layer("Paint", image=Image.new("RGBA", (4, 4), (40, 50, 60, 255)))
+    cache = TiledCompositeCache()
+    cache.get_tile([layer], TileBox(0, 0, 4, 4))
+    monkeypatch.setattr("pyshop.core.compositor.composite_layers_tile", lambda *args: pytest.fail("recomposited"))
+
+    assert sample_composite([layer], 1, 1, radius=1, cache=cache) == (40, 50, 60, 255)
+
+
+def test_sample_composite_matches_full_composite_for_layers_that_need_the_whole_image(monkeypatch):
+    gradient = np.zeros((8, 8, 4), dtype=np.uint8)
+    gradient[..., :3] = np.arange(8, dtype=np.uint8)[None, :, None] * 30
+    gradient[..., 3] = 255
+    base = Layer("Base", image=Image.fromarray(gradient, "RGBA"))
+    contrast = Layer("Contrast", image=Image.new("RGBA", (8, 8), (0, 0, 0, 0)))
+    contrast.adjustment = {"type": "brightness_contrast", "contrast": 60}
+    layers = [base, contrast]
+    expected = composite_layers(layers)
+    cache = TiledCompositeCache()
+
+    assert sample_composite(layers, 6, 3) == expected.getpixel((6, 3))
+    assert sample_composite(layers, 6, 3, cache=cache) == expected.getpixel((6, 3))
+
+    monkeypatch.setattr("pyshop.core.compositor.composite_layers", lambda *args: pytest.fail("recomposited"))
+
+    assert sample_composite(layers, 1, 3, cache=cache) == expected.getpixel((1, 3))
+
+
+def test_tiled_composite_cache_renders_missing_tiles_on_worker_threads():
+    layer = Layer("Paint", image=Image.new("RGBA", (4, 4), (10, 20, 30, 255)))
+    cache = TiledCompositeCache()
+    boxes = list(iter_tile_boxes(4, 4, tile_size=2))
+    first = cache.get_tile([layer], boxes[0])
+    previous = render_workers()
+    set_render_workers(3)
+    try:
+        rendered = cache.render_missing([layer], boxes, active_index=0)
+    finally:
+        set_render_workers(previous)
+
+    assert rendered == 3
+    assert cache.get_tile([layer], boxes[0]) is first
+    assert cache.get_tile([layer], boxes[3]).getpixel((0, 0)) == (10, 20, 30, 255)
+
+
+def test_composite_layers_renders_document_tiles_in_parallel():
+    rng = np.random.default_rng(6)
+    base = Layer("Base", image=Image.fromarray(rng.integers(0, 256, (700, 600, 4), dtype=np.uint8), "RGBA"))
+    top = Layer("Top", image=Image.fromarray(rng.integers(0, 256, (700, 600, 4), dtype=np.uint8), "RGBA"))
+    top.blend_mode = "Overlay"
+    expected = composite_layers_tile([base, top], TileBox(0, 0, 600, 700))
+    previous = render_workers()
+    set_render_workers(4)
+    try:
+        result = composite_layers([base, top])
+    finally:
+        set_render_workers(previous)
+
+    assert result.tobytes() == expected.tobytes()
+
+
+def test_composite_layers_keeps_spatial_effects_on_one_tile(monkeypatch):
+    base = Layer("Base", image=Image.new("RGBA", (600, 4), (0, 0, 0, 255)))
+    base.image.putpixel((511, 0), (255, 255, 255, 255))
+    blur = Layer("Blur", image=Image.new("RGBA", (600, 4), (0, 0, 0, 0)))
+    blur.effect = {"type": "gaussian_blur", "radius": 2.0}
+    tiles = []
+    monkeypatch.setattr("pyshop.core.compositor.render_tiles", lambda render, boxes: tiles.append(boxes))
+
+    result = composite_layers([base, blur])
+
+    assert tiles == []
+    assert result.getpixel((512, 0))[0] > 0
+
+
+def test_tiled_composite_cache_reuses_stack_below_and_above_active_layer():
+    base = Layer("Base", image=Image.new("RGBA", (4, 4), (0, 0, 255, 255)))
+    multiply = Layer("Multiply", image=Image.new("RGBA", (4, 4), (128, 255, 128, 255)))
+    multiply.blend_mode = "Multiply"
+    active = Layer("Active", image=Image.new("RGBA", (4, 4), (0, 0, 0, 0)))
+    top = Layer("Top", image=Image.new("RGBA", (4, 4), (0, 0, 0, 0)))
+    top.image.putpixel((0, 0), (255, 255, 255, 128))
+    layers = [base, multiply, active, top]
+    tile_box = TileBox(0, 0, 4, 4)
+    cache = TiledCompositeCache()
+
+    first = cache.get_tile(layers, tile_box, active_index=2)
+    below = cache._below[(0, 0, 4, 4)][1]
+    active.image.putpixel((1, 1), (255, 0, 0, 255))
+    active.mark_pixels_changed()
+    cache.invalidate((1, 1, 2, 2))
+    second = cache.get_tile(layers, tile_box, active_index=2)
+
+    assert first.getpixel((1, 1)) != second.getpixel((1, 1))
+    assert cache._below[(0, 0, 4, 4)][1] is below
+    assert np.array_equal(np.array(second), np.array(composite_layers_tile(layers, tile_box)))
+
+    base.opacity = 64
+    cache.invalidate()
+
+    assert np.array_equal(
+        np.array(cache.get_tile(layers, tile_box, active_index=2)), np.array(composite_layers_tile(layers, tile_box))
+    )
+    assert cache._below[(0, 0, 4, 4)][1] is not below
+
+
+def test_tiled_composite_cache_matches_full_composite_across_the_active_layer():
+    rng = np.random.default_rng(5)
+    layers = [Layer(f"Layer {index}", image=Image.fromarray(rng.integers(0, 256, (6, 6, 4), dtype=np.uint8), "RGBA")) for index in range(5)]
+    layers[1].blend_mode = "Multiply"
+    layers[2].opacity = 100
+    layers[3].blend_mode = "Screen"
+    tile_box = TileBox(0, 0, 6, 6)
+    cache = TiledCompositeCache()
+
+    for active_index in range(len(layers)):
+        cache.clear()
+        cache.get_tile(layers, tile_box, active_index=active_index)
+        cache.invalidate()
+
+        assert cache.get_tile(layers, tile_box, active_index=active_index).tobytes() == composite_layers_tile(layers, tile_box).tobytes()
+
+
+def test_tiled_composite_cache_falls_back_when_layers_above_need_the_running_result():
+    base = Layer("Base", image=Image.new("RGBA", (2, 2), (200, 40, 40, 255)))
+    active = Layer("Active", image=Image.new("RGBA", (2, 2), (0, 0, 0, 0)))
+    active.image.putpixel((0, 0), (0, 0, 0, 255))
+    clipped = Layer("Clipped", image=Image.new("RGBA", (2, 2), (0, 255, 0, 255)))
+    clipped.clipping = True
+    inverted = Layer("Invert", 2, 2)
+    inverted.adjustment = {"type": "invert"}
+    layers = [base, active, clipped, inverted]
+    tile_box = TileBox(0, 0, 2, 2)
+
+    tile = TiledCompositeCache().get_tile(layers, tile_box, active_index=1)
+
+    assert np.array_equal(np.array(tile), np.array(composite_layers_tile(layers, tile_box)))
+
+
+def test_top_level_span_expands_group_children_to_whole_group():
+    base = Layer("Base", 1, 1)
+    group = Layer("Group", 1, 1)
+    group.is_group = True
+    group.group_id = "group-1"
+    child = Layer("Child", 1, 1)
+    child.group_id = "group-1"
+    sibling = Layer("Sibling", 1, 1)
+    sibling.group_id = "group-1"
+    top = Layer("Top", 1, 1)
+    layers = [base, group, child, sibling, top]
+
+    assert top_level_span(layers, 0) == (0, 1)
+    assert top_level_span(layers, 1) == (1, 4)
+    assert top_level_span(layers, 3) == (1, 4)
+    assert top_level_span(layers, 4) == (4, 5)
+
+
+def test_layer_pixel_revision_advances_when_pixels_or_mask_are_replaced():
+    layer = Layer("Paint", 2, 2)
+    revisions = [layer.pixel_revision]
+
+    layer.image = Image.new("RGBA", (2, 2), (1, 2, 3, 255))
+    revisions.append(layer.pixel_revision)
+    layer.mask = Image.new("L", (2, 2), 255)
+    revisions.append(layer.pixel_revision)
+    layer.mark_pixels_changed()
+    revisions.append(layer.pixel_revision)
+
+    assert revisions == sorted(set(revisions))
+    assert layer.copy().uid != layer.uid
+
+
+def test_layer_metadata_revision_advances_only_for_real_property_changes():
+    layer = Layer("Paint", 2, 2)
+    pixel_revision, metadata_revision = layer.revision
+
+    layer.opacity = 255
+    layer.blend_mode = "Normal"
+    assert layer.revision == (pixel_revision, metadata_revision)
+
+    layer.opacity = 128
+    assert layer.pixel_revision == pixel_revision
+    assert layer.metadata_revision > metadata_revision
+
+
+def test_clone_layer_state_preserves_revisions():
+    layer = Layer("Paint", image=Image.new("RGBA", (4, 4), (10, 20, 30, 255)))
+    snapshot = clone_layer_state(layer)
+
+    assert snapshot.revision == layer.revision
+
+    layer.image.putpixel((0, 0), (255, 0, 0, 255))
+    layer.mark_pixels_changed()
+
+    assert snapshot.revision != layer.revision
+
+
+def test_pixel_tiles_skip_empty_tiles_and_round_trip():
+    image = Image.new("RGBA", (5, 3), (0, 0, 0, 0))
+    image.putpixel((4, 2), (1, 2, 3, 0))
+    image.putpixel((1, 1), (200, 100, 50, 255))
+
+    tiles = PixelTiles.from_image(image, tile_size=2)
+
+    assert sorted(tiles.tiles) == [(0, 0), (4, 2)]
+    assert tiles.to_image().tobytes() == image.tobytes()
+    assert tiles.crop((1, 1, 5, 3)).tobytes() == image.crop((1, 1, 5, 3)).tobytes()
+
+
+def test_clone_layer_state_shares_tiles_and_copies_only_damaged_ones():
+    layer = Layer("Paint", image=Image.new("RGBA", (1024, 1024), (10, 20, 30, 255)))
+    first = clone_layer_state(layer)
+
+    layer.image.putpixel((600, 10), (255, 0, 0, 255))
+    layer.mark_pixels_changed((600, 10, 601, 11))
+    second = clone_layer_state(layer)
+
+    assert first._image is None
+    assert second.pixel_tiles().tiles[(0, 0)] is first.pixel_tiles().tiles[(0, 0)]
+    assert second.pixel_tiles().tiles[(512, 0)] is not first.pixel_tiles().tiles[(512, 0)]
+    assert first.image.getpixel((600, 10)) == (10, 20, 30, 255)
+    assert second.crop_image((600, 10, 601, 11)).getpixel((0, 0)) == (255, 0, 0, 255)
+    assert first.pixel_tiles().difference_bbox(second.pixel_tiles()) == (600, 10, 601, 11)
+
+
+def test_history_undo_restores_tiled_snapshot_after_bounded_edit():
+    layer = Layer("Paint", image=Image.new("RGBA", (1024, 600), (0, 0, 0, 0)))
+    history = HistoryManager()
+    history.save_state([layer], 0)
+    layer.image.paste((255, 0, 0, 255), (700, 500, 710, 510))
+    layer.mark_pixels_changed((700, 500, 710, 510))
+
+    restored, _index = history.undo([layer], 0)
+
+    assert restored[0].image.getbbox() is None
+    redone, _index = history.redo(restored, 0)
+    assert redone[0].image.getbbox() == (700, 500, 710, 510)
+
+
+def test_layer_edit_history_snapshots_only_target_layers_and_stores_patches(monkeypatch):
+    layers = [Layer(str(index), image=Image.new("RGBA", (8, 8), (index, 0, 0, 255))) for index in range(4)]
+    history = HistoryManager()
+    cloned = []
+    original_clone = history_module.clone_layer_state
+    monkeypatch.setattr(history_module, "clone_layer_state", lambda layer: cloned.append(layer) or original_clone(layer))
+
+    history.save_layer_state(layers, 2, [2])
+    layers[2].image.putpixel((5, 6), (255, 255, 255, 255))
+    layers[2].mark_pixels_changed((5, 6, 6, 7))
+    history.save_layer_state(layers, 2, [2])
+
+    assert cloned == [layers[2], layers[2]]
+    patch = history.undo_stack[0].patches[2]
+    assert isinstance(history.undo_stack[0], DiffHistoryCommand)
+    assert patch.bbox == (5, 6, 6, 7)
+    assert patch.before_crop.load().getpixel((0, 0)) == (2, 0, 0, 255)
+    assert history.undo_stack[0].patches[0].bbox is None
+
+
+def test_layer_edit_history_limits_diff_to_declared_bounds_and_undoes():
+    layers = [Layer("Base", image=Image.new("RGBA", (8, 8), (0, 0, 0, 255))), Layer("Paint", image=Image.new("RGBA", (8, 8)))]
+    layers[1].opacity = 128
+    history = HistoryManager()
+
+    history.save_layer_state(layers, 1, [1], bounds=(2, 2, 4, 4))
+    layers[1].image.paste((0, 255, 0, 255), (2, 2, 4, 4))
+    layers[1].mark_pixels_changed((2, 2, 4, 4))
+    layers[1].opacity = 200
+    restored, index = history.undo(layers, 1)
+
+    assert index == 1
+    assert restored[1].image.getbbox() is None
+    assert restored[1].opacity == 128
+    assert history.redo_stack[-1].patches[1].bbox == (2, 2, 4, 4)
+    redone, _index = history.redo(restored, 1)
+    assert redone[1].image.getpixel((3, 3)) == (0, 255, 0, 255)
+    assert redone[1].opacity == 200
+
+
+def _paint_history_steps(history, layer, steps):
+    for step in range(steps):
+        history.save_layer_state([layer], 0, [0])
+        bounds = (step * 4, 0, step * 4 + 4, 64)
+        layer.image.paste((step * 20, 100, 200, 255), bounds)
+        layer.mark_pixels_changed(bounds)
+
+
+def test_history_compresses_older_patches_and_reports_memory_use(tmp_path):
+    layer = Layer("Paint", image=Image.new("RGBA", (64, 64)))
+    history = HistoryManager(spill_dir=tmp_path)
+
+    _paint_history_steps(history, layer, 3)
+    history.save_layer_state([layer], 0, [0])
+    history.flush()
+
+    patch = history.undo_stack[0].patches[0]
+    assert patch.before_crop.state == "compressed"
+    assert history.undo_stack[0].nbytes < 2 * 4 * 4 * 64
+    assert history.memory_usage() == sum(command.nbytes for command in list(history.undo_stack)[:-1])
+    assert history.disk_usage() == 0
+    restored, _index = history.undo([layer], 0)
+    restored, _index = history.undo(restored, 0)
+    assert restored[0].image.getpixel((5, 10)) == (20, 100, 200, 255)
+    assert restored[0].image.getpixel((9, 10)) == (0, 0, 0, 0)
+
+
+def test_history_spills_entries_beyond_memory_budget_and_pages_them_back(tmp_path):
+    layer = Layer("Paint", image=Image.new("RGBA", (64, 64)))
+    history = HistoryManager(memory_budget=1, spill_dir=tmp_path)
+
+    _paint_history_steps(history, layer, 4)
+    history.save_layer_state([layer], 0, [0])
+    history.flush()
+
+    assert history.undo_stack[0].patches[0].before_crop.state == "spilled"
+    assert history.disk_usage() > 0
+    assert list(tmp_path.iterdir())
+    layers = [layer]
+    for _ in range(5):
+        layers, _index = history.undo(layers, 0)
+    assert layers[0].image.getbbox() is None
+
+    history.save_state(layers, 0)
+
+    assert not list(tmp_path.iterdir())
+
+
+def test_history_counts_only_tiles_that_the_live_document_no_longer_holds(tmp_path):
+    rng = np.random.default_rng(6)
+    layers = [Layer(f"Layer {index}", image=Image.fromarray(rng.integers(0, 256, (64, 64, 4), dtype=np.uint8), "RGBA")) for index in range(4)]
+    history = HistoryManager(memory_budget=1, spill_dir=tmp_path)
+
+    history.save_state(layers, 0)
+    layers = layers + [Layer("New", 64, 64)]
+    history.save_state(layers, 4)
+    history.flush()
+
+    assert isinstance(history.undo_stack[0], PairedSnapshotCommand)
+    assert history.memory_usage() == 0
+    assert history.memory_usage(layers) == 0
+    assert history.disk_usage() == 0
+
+    deleted = layers.pop(1)
+    history.save_state(layers, 0)
+    history.flush()
+
+    assert history.undo_stack[1].before.stored
+    assert history.memory_usage(layers) == 0
+    assert history.disk_usage() > 0
+
+    restored, _index = history.undo(layers, 0)
+    restored, _index = history.undo(restored, 0)
+
+    assert len(restored) == 5
+    assert restored[1].image.tobytes() == deleted.image.tobytes()
+
+
+def test_layer_content_bounds_covers_pixels_or_whole_document_for_live_layers():
+    layer = Layer("Paint", image=Image.new("RGBA", (6, 6), (0, 0, 0, 0)))
+    assert layer_content_bounds(layer) is None
+
+    layer.image.putpixel((2, 3), (1, 2, 3, 255))
+    assert layer_content_bounds(layer) == (2, 3, 3, 4)
+
+    layer.adjustment = {"type": "invert"}
+    assert layer_content_bounds(layer) == (0, 0, 6, 6)
+
+
+def test_layer_offset_translates_rendering_until_committed():
+    layer = Layer("Paint", image=Image.new("RGBA", (6, 6), (0, 0, 0, 0)))
+    layer.image.putpixel((1, 1), (255, 0, 0, 255))
+    revision = layer.revision
+
+    layer.offset = (9, 0)
+    assert layer.revision != revision
+    assert layer_content_bounds(layer) is None
+    layer.offset = (3, 2)
+    assert layer_content_bounds(layer) == (4, 3, 5, 4)
+    assert composite_layers([layer]).getpixel((4, 3)) == (255, 0, 0, 255)
+
+    assert layer.commit_offset() == (4, 3, 5, 4)
+    assert layer.offset == (0, 0)
+    assert layer.image.getpixel((4, 3)) == (255, 0, 0, 255)
+    assert layer.commit_offset() is None
+
+
 def test_composite_layers_tile_blends_only_requested_tile():
     bottom = Layer("Bottom", image=Image.new("RGBA", (4, 4), (0, 0, 255, 255)))
     top = Layer("Top", image=Image.new("RGBA", (4, 4), (255, 0, 0, 128)))
@@ -484,6 +1558,44 @@ def test_adjustment_layer_composites_without_mutating_source_layer():
     assert base.image.getpixel((0, 0)) == (255, 0, 0, 255)
 
 
+def test_adjustment_chain_compiles_to_one_lookup_table():
+    image = Image.fromarray(np.arange(256, dtype=np.uint8).reshape(16, 16, 1).repeat(4, axis=2), "RGBA")
+    chain = [
+        {"type": "levels", "black": 16, "white": 235, "gamma": 1.4},
+        {"type": "curves", "points": [[0, 0], [128, 160], [255, 255]], "blue": [[0, 20], [255, 255]]},
+        {"type": "color_balance", "red": 12, "green": -8},
+        {"type": "posterize", "bits": 5},
+        {"type": "invert"},
+    ]
+    sequential = image
+    for adjustment in chain:
+        sequential = apply_adjustment(sequential, adjustment)
+
+    lut = compile_adjustment_luts(chain)
+
+    assert lut.shape == (3, 256)
+    assert np.array_equal(np.asarray(apply_lut(image, lut)), np.asarray(sequential))
+    assert adjustment_lut({"type": "solarize", "threshold": 100})[0, 200] == 55
+    assert compile_adjustment_luts([{"type": "grayscale"}]) is None
+
+
+def test_consecutive_adjustment_layers_render_as_one_fused_lookup(monkeypatch):
+    from pyshop.core import compositor
+
+    base = Layer("Base", image=Image.new("RGBA", (2, 2), (200, 100, 50, 255)))
+    levels = Layer("Levels", image=Image.new("RGBA", (2, 2)))
+    levels.adjustment = {"type": "levels", "black": 50, "white": 200, "gamma": 1.0}
+    balance = Layer("Balance", image=Image.new("RGBA", (2, 2)))
+    balance.adjustment = {"type": "color_balance", "blue": 40}
+    calls = []
+    monkeypatch.setattr(compositor, "apply_lut", lambda image, lut: calls.append(lut) or apply_lut(image, lut))
+
+    result = composite_layers([base, levels, balance])
+
+    assert len(calls) == 1
+    assert result.getpixel((0, 0)) == (255, 85, 40, 255)
+
+
 def test_effect_layer_composites_without_mutating_source_layer():
     base = Layer("Base", image=Image.new("RGBA", (1, 1), (200, 20, 30, 255)))
     effect = Layer("Solarize Effect", image=Image.new("RGBA", (1, 1), (0, 0, 0, 0)))
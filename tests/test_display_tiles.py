@@ -0,0 +1,40 @@
+from PIL import Image
+
+from pyshop.core import TileBox
+from pyshop.ui import DisplayTileCache
+
+
+def test_display_tile_cache_reuses_image_until_tile_changes():
+    cache = DisplayTileCache()
+    box = TileBox(0, 0, 2, 2)
+    tile = Image.new("RGBA", (2, 2), (10, 20, 30, 255))
+
+    first = cache.get(box, 0, tile, {})
+
+    assert cache.get(box, 0, tile, {}) is first
+    assert cache.get(box, 0, tile.copy(), {}) is not first
+    assert first.pixel(1, 1) == 0xFF0A141E
+
+
+def test_display_tile_cache_applies_channel_visibility_view():
+    cache = DisplayTileCache()
+    box = TileBox(0, 0, 1, 1)
+    tile = Image.new("RGBA", (1, 1), (10, 20, 30, 40))
+
+    image = cache.get(box, 0, tile, {"green": False, "alpha": False})
+
+    assert image.pixel(0, 0) == 0xFF0A001E
+    assert tile.getpixel((0, 0)) == (10, 20, 30, 40)
+
+
+def test_display_tile_cache_evicts_least_recently_drawn_tiles():
+    cache = DisplayTileCache(max_tiles=2)
+    tile = Image.new("RGBA", (1, 1))
+    boxes = [TileBox(index, 0, 1, 1) for index in range(3)]
+    first = cache.get(boxes[0], 0, tile, {})
+    cache.get(boxes[1], 0, tile, {})
+    cache.get(boxes[0], 0, tile, {})
+    cache.get(boxes[2], 0, tile, {})
+
+    assert cache.get(boxes[0], 0, tile, {}) is first
+    assert len(cache._images) == 2
@@ -1,4 +1,7 @@
 import os
+import threading
+
+import pytest
 
 os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
 
@@ -7,8 +10,9 @@ from PyQt5.QtCore import QPointF, Qt
 from PyQt5.QtGui import QColor
 from PyQt5.QtWidgets import QToolButton
 
-from pyshop.core import Layer, create_document_layers, named_background_rgba
+from pyshop.core import Layer, Selection, TiledCompositeCache, create_document_layers, iter_intersecting_tile_boxes, iter_tile_boxes, named_background_rgba
 from pyshop.tools import CanvasToolEvent
+from pyshop.ui.tile_queue import TileRenderQueue
 from pyshop_image_editor import ImageEditor
 
 
@@ -121,3 +125,294 @@ def test_brush_tool_flow_paints_active_layer(qtbot):
     assert canvas.tool_handlers["brush"].press(canvas, event) is True
 
     assert editor.active_layer().image.getpixel((1, 1))[0] == 255
+
+
+def test_brush_stroke_records_its_dirty_rect_in_history(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    canvas = editor.canvas
+    handler = canvas.tool_handlers["brush"]
+    editor.brush_size = 1
+
+    handler.press(canvas, CanvasToolEvent(QPointF(1, 1), QPointF(1, 1), buttons=Qt.LeftButton, modifiers=Qt.NoModifier))
+    handler.move(canvas, CanvasToolEvent(QPointF(3, 1), QPointF(3, 1), buttons=Qt.LeftButton, modifiers=Qt.NoModifier))
+    canvas.end_brush_stroke()
+
+    assert canvas.brush_stroke is None
+    assert editor.history.undo_stack[-1].bounds == (1, 1, 4, 2)
+
+
+def test_retouch_stroke_stores_only_the_tiles_it_touched_in_history(qtbot):
+    editor = make_editor(qtbot)
+    editor.layers = create_document_layers(1024, 1024, named_background_rgba("White"))
+    editor.set_active_layer_index(0)
+    layer = editor.active_layer()
+    layer.image.paste((128, 128, 128, 255), (0, 0, 1024, 1024))
+    editor.canvas.invalidate_layer(layer)
+    editor.brush_size = 9
+    canvas = editor.canvas
+    handler = canvas.tool_handlers["dodge"]
+
+    handler.press(canvas, CanvasToolEvent(QPointF(20, 20), QPointF(20, 20), buttons=Qt.LeftButton, modifiers=Qt.NoModifier))
+    handler.move(canvas, CanvasToolEvent(QPointF(60, 30), QPointF(60, 30), buttons=Qt.LeftButton, modifiers=Qt.NoModifier))
+    canvas.end_brush_stroke()
+
+    command = editor.history.undo_stack[-1]
+    left, top, right, bottom = command.bounds
+    assert left >= 15 and top >= 15 and right <= 66 and bottom <= 36
+    patch = command.compact_against(editor.layers, editor.active_layer_index).patches[0]
+    assert len(list(iter_intersecting_tile_boxes(1024, 1024, patch.bbox))) == 1
+
+
+def test_clone_stamp_stroke_records_its_dirty_rect_in_history(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    editor.active_layer().image.paste((255, 0, 0, 255), (0, 0, 2, 2))
+    editor.clone_source = (1, 1)
+    editor.brush_size = 2
+    canvas = editor.canvas
+    handler = canvas.tool_handlers["clone_stamp"]
+
+    handler.press(canvas, CanvasToolEvent(QPointF(3, 3), QPointF(3, 3), buttons=Qt.LeftButton, modifiers=Qt.NoModifier))
+    canvas.end_brush_stroke()
+
+    assert editor.history.undo_stack[-1].bounds == (2, 2, 4, 4)
+
+
+def test_paint_bucket_fills_within_selection_and_records_dirty_rect(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    editor.fg_color = QColor(0, 255, 0)
+    canvas = editor.canvas
+    selection = Image.new("L", (4, 4), 0)
+    selection.paste(255, (0, 0, 2, 4))
+    canvas.set_selection_mask(selection)
+
+    canvas.tool_handlers["fill"].press(canvas, CanvasToolEvent(QPointF(0, 0), QPointF(0, 0), buttons=Qt.LeftButton, modifiers=Qt.NoModifier))
+
+    assert editor.active_layer().image.getpixel((1, 3)) == (0, 255, 0, 255)
+    assert editor.active_layer().image.getpixel((2, 0))[3] == 0
+    assert editor.history.undo_stack[-1].bounds == (0, 0, 2, 4)
+
+
+def test_delete_and_copy_selection_work_inside_selection_bounds(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    editor.active_layer().image.paste((255, 0, 0, 255), (0, 0, 4, 4))
+    canvas = editor.canvas
+    canvas.set_selection_mask(Selection((4, 4), (1, 1, 3, 2)))
+
+    editor.copy_selection()
+    editor.delete_selection()
+
+    assert editor.history.undo_stack[-1].bounds == (1, 1, 3, 2)
+    assert editor.active_layer().image.getpixel((1, 1))[3] == 0
+    assert editor.active_layer().image.getpixel((0, 1)) == (255, 0, 0, 255)
+    assert editor._clipboard.size == (2, 1)
+
+    editor.paste_clipboard()
+
+    assert editor.active_layer().image.getpixel((2, 1)) == (255, 0, 0, 255)
+    assert editor.active_layer().image.getpixel((0, 0))[3] == 0
+
+
+def test_adjustment_with_selection_only_processes_selection_bounds(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    editor.active_layer().image.paste((10, 20, 30, 255), (0, 0, 4, 4))
+    editor.canvas.set_selection_mask(Selection((4, 4), (2, 0, 4, 3)))
+
+    editor.invert_colors()
+
+    assert editor.history.undo_stack[-1].bounds == (2, 0, 4, 3)
+    assert editor.active_layer().image.getpixel((3, 2)) == (245, 235, 225, 255)
+    assert editor.active_layer().image.getpixel((1, 2)) == (10, 20, 30, 255)
+    assert editor.active_layer().image.getpixel((3, 3)) == (10, 20, 30, 255)
+
+
+def test_auto_contrast_with_selection_ignores_unselected_pixels_in_the_bounds(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    image = editor.active_layer().image
+    image.paste((0, 0, 0, 255), (0, 0, 4, 4))
+    image.putpixel((0, 0), (100, 100, 100, 255))
+    image.putpixel((1, 0), (200, 200, 200, 255))
+    image.putpixel((0, 1), (150, 150, 150, 255))
+    mask = Image.new("L", (4, 4), 0)
+    mask.putpixel((0, 0), 255)
+    mask.putpixel((1, 0), 255)
+    mask.putpixel((0, 1), 255)
+    editor.canvas.set_selection_mask(mask)
+
+    editor.auto_contrast()
+
+    assert editor.history.undo_stack[-1].bounds == (0, 0, 2, 2)
+    assert image.getpixel((0, 0)) == (0, 0, 0, 255)
+    assert image.getpixel((1, 0)) == (254, 254, 254, 255)
+    assert image.getpixel((1, 1)) == (0, 0, 0, 255)
+
+
+def test_magic_wand_reuses_sampled_composite_until_layers_change(qtbot, monkeypatch):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    editor.active_layer().image.paste((255, 0, 0, 255), (0, 0, 2, 4))
+    editor.magic_wand_sample_all = True
+    canvas = editor.canvas
+    renders = []
+    get_composite = editor.get_composite
+    monkeypatch.setattr(editor, "get_composite", lambda: renders.append(1) or get_composite())
+
+    canvas._magic_wand_select(0, 0)
+    canvas._magic_wand_select(3, 0)
+
+    assert len(renders) == 1
+    assert canvas.selection_mask.getpixel((3, 3)) == 255
+    assert canvas.selection_mask.getpixel((0, 0)) == 0
+
+    canvas.invalidate_layer_rect(editor.active_layer(), (0, 0, 1, 1))
+    canvas._magic_wand_select(0, 0)
+
+    assert len(renders) == 2
+    assert canvas.selection_mask.getpixel((1, 3)) == 255
+
+
+def test_large_selection_outline_is_traced_in_the_background(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    canvas = editor.canvas
+    canvas.ants.sync_pixels = 0
+    selection = Image.new("L", (4, 4), 0)
+    selection.paste(255, (1, 1, 3, 3))
+    selection.putpixel((2, 2), 0)
+
+    with qtbot.waitSignal(canvas.ants.path_ready):
+        canvas.set_selection_mask(selection)
+
+    assert canvas.marching_ants_path is canvas.ants.path
+    assert canvas.marching_ants_path.boundingRect().getCoords() == (1.0, 1.0, 3.0, 3.0)
+
+
+def test_background_outline_is_dropped_once_a_newer_selection_was_traced(qtbot):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    canvas = editor.canvas
+    ready = []
+    canvas.ants.path_ready.connect(lambda token, path: ready.append(token))
+    first = Image.new("L", (4, 4), 0)
+    first.paste(255, (1, 1, 3, 3))
+    first.putpixel((2, 2), 0)
+    second = Image.new("L", (4, 4), 0)
+    second.paste(255, (0, 0, 2, 2))
+    second.putpixel((1, 1), 0)
+
+    with qtbot.waitSignal(canvas.ants._traced):
+        canvas.ants.sync_pixels = 0
+        canvas.set_selection_mask(first)
+        canvas.ants.sync_pixels = 1024
+        canvas.set_selection_mask(second)
+
+    assert ready == []
+    assert canvas.marching_ants_path is canvas.ants.path
+    assert canvas.marching_ants_path.boundingRect().getCoords() == (0.0, 0.0, 2.0, 2.0)
+
+
+def test_brush_tool_invalidates_only_tiles_under_the_dab(qtbot):
+    editor = make_editor(qtbot)
+    editor.layers = create_document_layers(1024, 1024, named_background_rgba("Transparent"))
+    editor.set_active_layer_index(0)
+    editor.brush_size = 4
+    canvas = editor.canvas
+    boxes = list(iter_tile_boxes(1024, 1024))
+    for box in boxes:
+        canvas.tile_cache.get_tile(editor.layers, box)
+    event = CanvasToolEvent(QPointF(10, 10), QPointF(10, 10), buttons=Qt.LeftButton, modifiers=Qt.NoModifier)
+
+    assert canvas.tool_handlers["brush"].press(canvas, event) is True
+
+    assert sorted(canvas.tile_cache._tiles) == sorted(box.as_crop_box() for box in boxes[1:])
+
+
+def test_canvas_paints_placeholders_while_tiles_render_in_background(qtbot):
+    editor = make_editor(qtbot)
+    editor.layers = create_document_layers(1024, 1024, named_background_rgba("White"))
+    editor.set_active_layer_index(0)
+    canvas = editor.canvas
+    canvas.reset_tiles()
+    boxes = list(iter_tile_boxes(1024, 1024))
+    for box in boxes:
+        canvas.tile_cache.get_tile(editor.layers, box)
+    canvas.update()
+    ready = []
+    canvas.render_queue.tile_ready.connect(ready.append)
+
+    canvas.repaint()
+
+    assert all(canvas.tile_cache.placeholder_tile(box) is not None or canvas.tile_cache.cached_tile(box) is not None for box in boxes)
+    qtbot.waitUntil(lambda: all(canvas.tile_cache.cached_tile(box) is not None for box in canvas.visible_tile_boxes()))
+    qtbot.waitUntil(lambda: bool(ready))
+
+
+def test_render_queue_composites_a_snapshot_while_the_layer_is_painted(qtbot):
+    layers = create_document_layers(64, 64, named_background_rgba("White"))
+    cache = TiledCompositeCache()
+    queue = TileRenderQueue(cache)
+    box = next(iter(iter_tile_boxes(64, 64)))
+    started, release = threading.Event(), threading.Event()
+    rendered = []
+    render_tile = cache.render_tile
+
+    def blocked_render(snapshot, tile_box, active_index=None, level=0):
+        started.set()
+        release.wait(5)
+        rendered.append((snapshot, render_tile(snapshot, tile_box, active_index, level)))
+        return rendered[-1][1]
+
+    cache.render_tile = blocked_render
+    ready = []
+    queue.tile_ready.connect(ready.append)
+
+    assert queue.request(layers, [box]) == 1
+    assert started.wait(5)
+    layers[0].image.paste((255, 0, 0, 255), (0, 0, 64, 64))
+    layers[0].mark_pixels_changed((0, 0, 64, 64))
+    release.set()
+    qtbot.waitUntil(lambda: bool(ready))
+
+    snapshot, tile = rendered[0]
+    assert snapshot[0] is not layers[0]
+    assert tile.getpixel((10, 10)) == (255, 255, 255, 255)
+
+
+def test_navigator_overview_renders_reduced_tiles_off_the_gui_thread(qtbot, monkeypatch):
+    editor = make_editor(qtbot)
+    editor.layers = create_document_layers(2048, 1024, named_background_rgba("White"))
+    editor.set_active_layer_index(0)
+    cache = editor.canvas.tile_cache
+    cache.clear()
+    monkeypatch.setattr(cache, "get_tile", lambda *args: pytest.fail("synchronous tile render"))
+    panel = editor.navigator_panel
+
+    panel.refresh()
+
+    qtbot.waitUntil(lambda: not cache.overview_image(editor.layers, (220, 140))[1])
+    panel.refresh()
+    assert {entry[0] for entry in cache._overview.values()} == {2}
+    assert len(cache._overview) == 8
+    assert not panel.preview.pixmap().isNull()
+
+
+def test_eyedropper_samples_composite_without_full_document_render(qtbot, monkeypatch):
+    editor = make_editor(qtbot)
+    install_small_document(editor)
+    editor.active_layer().image.paste((10, 200, 30, 255), (0, 0, 4, 4))
+    editor.canvas.invalidate_layer(editor.active_layer())
+    editor.sample_size_combo.setCurrentText("3 by 3 Average")
+    monkeypatch.setattr(editor, "get_composite", lambda: pytest.fail("full composite"))
+    picked = []
+    editor.canvas.color_picked.connect(picked.append)
+    event = CanvasToolEvent(QPointF(1, 1), QPointF(1, 1), buttons=Qt.LeftButton, modifiers=Qt.NoModifier)
+
+    assert editor.canvas.tool_handlers["eyedropper"].press(editor.canvas, event) is True
+
+    assert editor.eyedropper_sample_size == "3 by 3 Average"
+    assert picked[0].getRgb() == (10, 200, 30, 255)
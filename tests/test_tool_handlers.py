@@ -18,6 +18,9 @@ class FakeHistory:
     def save_state(self, layers, active_layer_index):
         self.calls += 1
 
+    def save_layer_state(self, layers, active_layer_index, targets, bounds=None):
+        self.calls += 1
+
 
 class FakeStatus:
     def __init__(self):
@@ -59,6 +62,7 @@ class FakeCanvas:
         self.editor = FakeEditor()
         self.drawing = False
         self.last_pos = None
+        self.move_bounds = None
         self.selection_start = None
         self.selection_rect = None
         self.crop_rect = None
@@ -67,10 +71,18 @@ class FakeCanvas:
         self._lasso_points = []
         self.calls = []
         self.updates = 0
+        self.overlay_updates = 0
+        self.invalidated = []
 
     def update(self):
         self.updates += 1
 
+    def update_overlay(self):
+        self.overlay_updates += 1
+
+    def invalidate_image_rect(self, bounds):
+        self.invalidated.append(bounds)
+
     def set_selection_mask(self, mask):
         self.selection_mask = mask
 
@@ -148,10 +160,13 @@ def test_selection_handler_press_move_release_creates_selection_mask():
     assert handler.move(canvas, tool_event(3, 4)) is True
     assert canvas.selection_rect.width() == 2
     assert canvas.selection_rect.height() == 3
+    assert canvas.updates == 0
+    assert canvas.overlay_updates == 1
 
     assert handler.release(canvas, tool_event(3, 4, buttons=Qt.NoButton)) is True
-    assert canvas.selection_mask.getpixel((1, 1)) == 255
-    assert canvas.selection_mask.getpixel((5, 5)) == 0
+    assert canvas.selection_mask.bounds == (1, 1, 4, 5)
+    assert canvas.selection_mask.mask is None
+    assert canvas.selection_mask.value_at(5, 5) == 0
     assert canvas.drawing is False
 
 
@@ -187,3 +202,25 @@ def test_retouch_handler_press_and_move_dispatches_mode():
 
     assert handler.move(canvas, tool_event(3, 2)) is True
     assert canvas.calls[-1] == ("retouch_line", "dodge", 2, 2, 3, 2)
+
+
+def test_move_handler_drags_by_offset_and_commits_once_on_release():
+    canvas = FakeCanvas()
+    layer = canvas.editor.active_layer()
+    layer.image.putpixel((1, 1), (255, 0, 0, 255))
+    original = layer.image
+    handler = build_default_tool_handlers()["move"]
+
+    assert handler.press(canvas, tool_event(1, 1)) is True
+    assert handler.move(canvas, tool_event(9, 1)) is True
+    assert handler.move(canvas, tool_event(3, 2)) is True
+    assert canvas.editor.history.calls == 1
+    assert layer.image is original
+    assert layer.offset == (2, 1)
+    assert canvas.invalidated[-1] == (3, 2, 4, 3)
+    assert canvas.updates == 0
+
+    assert handler.release(canvas, tool_event(3, 2, buttons=Qt.NoButton)) is True
+    assert layer.offset == (0, 0)
+    assert layer.image.getbbox() == (3, 2, 4, 3)
+    assert layer.image.getpixel((3, 2)) == (255, 0, 0, 255)